@@ -0,0 +1,85 @@
+from threading import Thread
+import logging
+
+import numpy as np
+
+from classes.database.DBHandler import DBHandler
+from classes.telemetry.TelemetryStore import TelemetryStore
+
+
+class LiveDelta:
+    """
+    Compares a running stage to the best previous run, packet by packet.
+
+    The time-vs-distance profile of the best run is loaded once, when the run starts,
+    each update is a binary search and a linear interpolation on it.
+    """
+
+    _log = logging.getLogger(__name__)
+
+    def __init__(self, run_id: int, distance: np.ndarray, lap_time: np.ndarray) -> None:
+        self.run_id = run_id
+        self._distance = distance
+        self._lap_time = lap_time
+        self._last_index = len(distance) - 1
+        self.delta: float = None
+
+
+
+    def load_best(game_name: str, track_name: str, car_name: str) -> "LiveDelta":
+        """
+        Returns a LiveDelta against the fastest saved run with the same track and car, that has telemetry.
+        Returns None if there is no such run.
+        """
+
+        for run_id in DBHandler.get_fastest_run_ids(game_name, track_name, car_name):
+            if not TelemetryStore.has_run(run_id):
+                continue
+
+            # copied into memory, updates should never wait on disk reads
+            distance = np.array(TelemetryStore.load_index(run_id, "distance"), dtype=np.float64)
+            lap_time = np.array(TelemetryStore.load_channels(run_id, ["lap_time"])["lap_time"], dtype=np.float64)
+            if len(distance) < 2:
+                continue
+
+            return LiveDelta(run_id, distance, lap_time)
+
+        return None
+
+
+
+    def load_best_async(game_name: str, track_name: str, car_name: str, callback) -> None:
+        """
+        Loads the best run on a background thread, and calls callback with the LiveDelta (or None)
+        """
+
+        def load():
+            try:
+                callback(LiveDelta.load_best(game_name, track_name, car_name))
+            except Exception as e:
+                LiveDelta._log.warning("could not load the best run for the live delta: %s", e)
+                callback(None)
+
+        Thread(target=load, daemon=True).start()
+
+
+
+    def update(self, distance: float, lap_time: float) -> float:
+        """
+        Returns (and stores) the current time minus the time of the best run at the same distance.
+        Positive means slower than the best run.
+        """
+
+        i = int(self._distance.searchsorted(distance))
+        if i <= 0:
+            best_time = self._lap_time[0]
+        elif i > self._last_index:
+            best_time = self._lap_time[self._last_index]
+        else:
+            d0 = self._distance[i - 1]
+            d1 = self._distance[i]
+            t0 = self._lap_time[i - 1]
+            best_time = t0 + (self._lap_time[i] - t0) * ((distance - d0) / (d1 - d0) if d1 > d0 else 0)
+
+        self.delta = float(lap_time - best_time)
+        return self.delta
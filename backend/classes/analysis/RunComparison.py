@@ -0,0 +1,126 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List
+
+import numpy as np
+
+from classes.telemetry.TelemetryStore import TelemetryStore
+
+
+class RunComparison:
+    """
+    Compares runs of the same stage, on a common distance grid.
+
+    Each run is resampled once to a time-vs-distance profile (stage time at every GRID_STEP meters),
+    profiles are cached, so a comparison is only slicing and subtracting NumPy arrays.
+    Cached profiles are checked against the version of the telemetry, as comparisons also run in the JobQueue workers.
+    """
+
+    GRID_STEP = 1.0  # meters between profile samples
+    PROFILE_CACHE_SIZE = 512  # number of run profiles to keep in memory
+
+    # class (static) variables
+    _lock: Lock = Lock()
+    _profiles: OrderedDict = OrderedDict()
+
+
+
+    def get_profile(run_id: int) -> np.ndarray:
+        """
+        Returns the stage time of a run at every GRID_STEP meters, starting from 0
+        """
+
+        version = TelemetryStore.get_version(run_id)
+
+        with RunComparison._lock:
+            cached = RunComparison._profiles.get(run_id)
+            if cached is not None and cached[0] == version:
+                RunComparison._profiles.move_to_end(run_id)
+                return cached[1]
+
+        profile = RunComparison._build_profile(run_id)
+
+        with RunComparison._lock:
+            RunComparison._profiles[run_id] = (version, profile)
+            RunComparison._profiles.move_to_end(run_id)
+            while len(RunComparison._profiles) > RunComparison.PROFILE_CACHE_SIZE:
+                RunComparison._profiles.popitem(last=False)
+
+        return profile
+
+
+
+    def invalidate(run_id: int) -> None:
+        """
+        Drops the cached profile of a run (eg.: its telemetry was rewritten)
+        """
+
+        with RunComparison._lock:
+            RunComparison._profiles.pop(run_id, None)
+
+
+
+    def compare(reference_id: int, run_ids: List[int], segments: int = 10, resolution: float = 10.0) -> Dict:
+        """
+        Compares runs to a reference run
+
+        :param segments: number of equal length segments to split the stage into, for the gains and losses
+        :param resolution: distance between the points of the returned delta traces (meters)
+
+        Returns
+        - distance: the distances of the delta trace points
+        - runs: for each run, its delta trace (run time - reference time, at each distance), segment gains (reference - run, positive is faster) and total time over the common distance
+        """
+
+        run_ids = [run_id for run_id in run_ids if run_id != reference_id]
+        profiles = [RunComparison.get_profile(run_id) for run_id in [reference_id] + run_ids]
+
+        # only the distance every run covered can be compared
+        length = min(len(profile) for profile in profiles)
+        if length < 2:
+            raise ValueError("The runs have no common distance to compare")
+        times = np.stack([profile[:length] for profile in profiles])
+
+        # cumulative delta to the reference, positive means the run is behind
+        deltas = times[1:] - times[0]
+
+        # segment times are the differences of the times at the segment boundaries
+        boundaries = np.linspace(0, length - 1, segments + 1).astype(np.int64)
+        segment_times = np.diff(times[:, boundaries], axis=1)
+        segment_gains = segment_times[0] - segment_times[1:]
+
+        step = max(int(round(resolution / RunComparison.GRID_STEP)), 1)
+        trace_index = np.arange(0, length, step)
+
+        return {
+            "reference": {
+                "run_id": reference_id,
+                "time": float(times[0, -1]),
+                "segment_times": np.round(segment_times[0], 3).tolist(),
+            },
+            "distance": (trace_index * RunComparison.GRID_STEP).tolist(),
+            "segment_boundaries": (boundaries * RunComparison.GRID_STEP).tolist(),
+            "runs": [
+                {
+                    "run_id": run_id,
+                    "time": float(times[i + 1, -1]),
+                    "delta": np.round(deltas[i, trace_index], 3).tolist(),
+                    "segment_gains": np.round(segment_gains[i], 3).tolist(),
+                }
+                for i, run_id in enumerate(run_ids)
+            ],
+        }
+
+
+
+    def _build_profile(run_id: int) -> np.ndarray:
+        """
+        Resamples the stage time of a run onto the distance grid
+        """
+
+        distance = TelemetryStore.load_index(run_id, "distance")
+        lap_time = TelemetryStore.load_channels(run_id, ["lap_time"])["lap_time"]
+
+        # the run may start slightly behind the line, the grid starts at 0
+        grid = np.arange(0, float(distance[-1]), RunComparison.GRID_STEP) if len(distance) > 0 else np.zeros(0)
+        return np.interp(grid, distance, lap_time)
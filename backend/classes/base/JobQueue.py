@@ -0,0 +1,267 @@
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, TimeoutError
+from threading import RLock
+from typing import Callable, Dict
+import multiprocessing
+import os
+import time
+import uuid
+
+from classes.base.AppSettings import AppSettings
+from classes.base.Metrics import Metrics
+
+
+class JobQueue:
+    """
+    Runs heavy analytics (comparisons and the like) in a pool of worker processes,
+    so they do not hold the GIL of the process that gathers the UDP data.
+
+    - submit(kind, function, args, cache_key) queues a job and returns its id
+    - get(job_id) / wait(job_id, timeout) return the state of the job, and its result once it is done
+    - cancel(job_id) cancels a job (a job that already started finishes in the background, its result is dropped)
+
+    The number of jobs waiting for a worker is bounded (submit raises RuntimeError when the queue is full).
+    Results of jobs with a cache_key are kept (RESULT_CACHE_SIZE), a job with the same key is answered from the cache,
+    or attached to the job that is already running for it.
+
+    Settings are read from settings.jobs ({ "workers": int, "max_pending": int, "timeout_seconds": float }),
+    with 0 workers the jobs run inline, in the calling thread.
+    Functions and arguments have to be picklable (module level functions, or the static-like methods of a class).
+    """
+
+    RESULT_CACHE_SIZE = 64
+    JOB_TTL = 600  # seconds a finished job can still be queried
+
+    # class (static) variables
+    _lock: RLock = RLock()  # reentrant, cancelling a future runs its done callback right away
+    _executor: ProcessPoolExecutor = None
+    _jobs: Dict[str, dict] = {}
+    _pending_keys: Dict[str, str] = {}  # cache_key -> id of the job computing it
+    _results: OrderedDict = OrderedDict()  # cache_key -> result
+
+    # metrics
+    _jobs_submitted = Metrics.counter("simstats_jobs_submitted_total", "Analytics jobs submitted, by kind and how they were answered", ["kind", "source"])
+    _jobs_pending = Metrics.gauge("simstats_jobs_pending", "Analytics jobs queued or running")
+    _job_seconds = Metrics.histogram("simstats_job_seconds", "Time from submitting an analytics job to its result", ["kind"], Metrics.LATENCY_BUCKETS)
+
+
+
+    def get_settings() -> dict:
+        """
+        Returns the job settings, with defaults for the missing keys
+        """
+
+        settings = AppSettings().read_setting("jobs") or {}
+        return {
+            "workers": settings.get("workers", max(1, min(4, (os.cpu_count() or 2) - 1))),
+            "max_pending": settings.get("max_pending", 16),
+            "timeout_seconds": settings.get("timeout_seconds", 30),
+        }
+
+
+
+    def submit(kind: str, function: Callable, args: tuple = (), cache_key: str = None) -> str:
+        """
+        Queues function(*args) and returns the id of the job
+
+        :param kind: name of the job type, for the status and the metrics
+        :param cache_key: identifies the result, jobs with the same key share it (None: never cached)
+        """
+
+        settings = JobQueue.get_settings()
+
+        with JobQueue._lock:
+            JobQueue._drop_expired()
+
+            # answered from the cache, or by the job already computing it
+            if cache_key is not None and cache_key in JobQueue._results:
+                JobQueue._results.move_to_end(cache_key)
+                JobQueue._jobs_submitted.labels(kind, "cache").inc()
+                return JobQueue._add_job(kind, cache_key, None, "done", JobQueue._results[cache_key])
+            if cache_key is not None and cache_key in JobQueue._pending_keys:
+                JobQueue._jobs_submitted.labels(kind, "shared").inc()
+                return JobQueue._pending_keys[cache_key]
+
+            if settings["workers"] == 0:
+                future = Future()
+            else:
+                pending = sum(1 for job in JobQueue._jobs.values() if job["future"] is not None and not job["future"].done())
+                if pending >= settings["max_pending"]:
+                    raise RuntimeError(f"Job queue is full ({pending} jobs pending), try again later")
+
+                future = JobQueue._get_executor(settings["workers"]).submit(function, *args)
+
+            job_id = JobQueue._add_job(kind, cache_key, future, "queued", None)
+            if cache_key is not None:
+                JobQueue._pending_keys[cache_key] = job_id
+            JobQueue._jobs_submitted.labels(kind, "worker").inc()
+            JobQueue._jobs_pending.inc()
+
+        future.add_done_callback(lambda f: JobQueue._on_done(job_id, f))
+
+        # without workers, the job runs here (outside the lock)
+        if settings["workers"] == 0 and future.set_running_or_notify_cancel():
+            try:
+                future.set_result(function(*args))
+            except Exception as e:
+                future.set_exception(e)
+
+        return job_id
+
+
+
+    def get(job_id: str) -> dict:
+        """
+        Returns the state of a job
+
+        { "id", "kind", "state": "queued" / "running" / "done" / "failed" / "cancelled", "result" (if done), "error" (if failed) }
+        """
+
+        with JobQueue._lock:
+            job = JobQueue._jobs.get(job_id)
+            if job is None:
+                raise KeyError(f"No job with id \"{job_id}\"")
+
+            state = job["state"]
+            if state == "queued" and job["future"].running():
+                state = "running"
+
+            response = { "id": job_id, "kind": job["kind"], "state": state }
+            if state == "done":
+                response["result"] = job["result"]
+            if state == "failed":
+                response["error"] = job["error"]
+
+        return response
+
+
+
+    def wait(job_id: str, timeout: float) -> dict:
+        """
+        Waits up to timeout seconds for a job to finish, then returns its state (like get())
+        """
+
+        with JobQueue._lock:
+            job = JobQueue._jobs.get(job_id)
+        if job is not None and job["future"] is not None:
+            try:
+                job["future"].result(timeout)
+            except (TimeoutError, CancelledError, Exception):
+                pass
+
+            # the state is set by the done callback, which runs right after the future completes
+            deadline = time.monotonic() + 1
+            while job["state"] == "queued" and job["future"].done() and time.monotonic() < deadline:
+                time.sleep(0.001)
+
+        return JobQueue.get(job_id)
+
+
+
+    def cancel(job_id: str) -> dict:
+        """
+        Cancels a job. A job that did not start yet is removed from the queue,
+        a running one can not be stopped, it finishes in its worker and the result is dropped.
+        """
+
+        with JobQueue._lock:
+            job = JobQueue._jobs.get(job_id)
+            if job is None:
+                raise KeyError(f"No job with id \"{job_id}\"")
+
+            if job["state"] == "queued":
+                job["future"].cancel()
+                job["state"] = "cancelled"
+                if JobQueue._pending_keys.get(job["cache_key"]) == job_id:
+                    del JobQueue._pending_keys[job["cache_key"]]
+
+        return JobQueue.get(job_id)
+
+
+
+    def shutdown() -> None:
+        """
+        Stops the worker processes
+        """
+
+        with JobQueue._lock:
+            if JobQueue._executor is not None:
+                JobQueue._executor.shutdown(wait=False, cancel_futures=True)
+                JobQueue._executor = None
+
+
+
+    def _get_executor(workers: int) -> ProcessPoolExecutor:
+        """
+        Returns the process pool, starts it on first use
+        """
+
+        if JobQueue._executor is None:
+            # spawn, so the workers do not inherit the listener and gather threads (and it is the only option on Windows)
+            JobQueue._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        return JobQueue._executor
+
+
+
+    def _add_job(kind: str, cache_key: str, future: Future, state: str, result) -> str:
+        job_id = uuid.uuid4().hex
+        JobQueue._jobs[job_id] = {
+            "kind": kind,
+            "cache_key": cache_key,
+            "future": future,
+            "state": state,
+            "result": result,
+            "error": None,
+            "submitted": time.monotonic(),
+            "finished": time.monotonic() if state == "done" else None,
+        }
+        return job_id
+
+
+
+    def _on_done(job_id: str, future: Future) -> None:
+        """
+        Stores the result of a finished job (runs on the thread that completed the future)
+        """
+
+        with JobQueue._lock:
+            job = JobQueue._jobs.get(job_id)
+            if job is None:
+                return
+
+            JobQueue._jobs_pending.inc(-1)
+            if JobQueue._pending_keys.get(job["cache_key"]) == job_id:
+                del JobQueue._pending_keys[job["cache_key"]]
+
+            job["finished"] = time.monotonic()
+            JobQueue._job_seconds.labels(job["kind"]).observe(job["finished"] - job["submitted"])
+
+            if job["state"] == "cancelled" or future.cancelled():
+                job["state"] = "cancelled"
+                return
+
+            error = future.exception()
+            if error is not None:
+                job["state"] = "failed"
+                job["error"] = str(error)
+                return
+
+            job["state"] = "done"
+            job["result"] = future.result()
+
+            if job["cache_key"] is not None:
+                JobQueue._results[job["cache_key"]] = job["result"]
+                JobQueue._results.move_to_end(job["cache_key"])
+                while len(JobQueue._results) > JobQueue.RESULT_CACHE_SIZE:
+                    JobQueue._results.popitem(last=False)
+
+
+
+    def _drop_expired() -> None:
+        """
+        Forgets jobs that finished more than JOB_TTL seconds ago
+        """
+
+        now = time.monotonic()
+        for job_id in [k for k, job in JobQueue._jobs.items() if job["finished"] is not None and now - job["finished"] > JobQueue.JOB_TTL]:
+            del JobQueue._jobs[job_id]
@@ -0,0 +1,271 @@
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import struct
+import sys
+import time
+from typing import Dict, Iterator, List, Tuple
+
+from classes.base.AppSettings import AppSettings
+from classes.base.Metrics import Metrics
+
+
+class LogHandler:
+    """
+    Sets up the logging of the backend (the standard logging module, one logger per module, named by __name__)
+
+    - records go through a bounded queue, and are written to stdout by a listener thread, so logging never blocks
+      the caller (eg. the gather thread). When the queue is full, records are dropped (and counted in the metrics).
+    - levels: settings.logging.level for every logger, settings.logging.levels for single modules or packages
+      (eg. { "classes.game": "DEBUG" })
+    - per-packet lines go through PacketLog: sampled to the log at DEBUG level, or all of them to a binary trace file
+
+    Settings are read from settings.logging
+    ({ "level": str, "levels": { logger: str }, "packet_lines_per_second": float, "trace": { "enabled": bool, "path": str } })
+    """
+
+    QUEUE_SIZE = 10000  # records
+    FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+    # metrics
+    _dropped_records = Metrics.counter("simstats_log_dropped_records_total", "Log records dropped, because the log queue was full")
+
+    # class (static) variables
+    _queue_handler: "_DroppingQueueHandler" = None
+    _listener: logging.handlers.QueueListener = None
+    _trace_handler: "TraceFileHandler" = None
+
+
+
+    def get_settings() -> dict:
+        """
+        Returns the logging settings, with defaults for the missing keys
+        """
+
+        settings = AppSettings().read_setting("logging") or {}
+        trace = settings.get("trace") or {}
+        return {
+            "level": settings.get("level", "INFO"),
+            "levels": settings.get("levels", {}),
+            "packet_lines_per_second": settings.get("packet_lines_per_second", 2),
+            "trace": {
+                "enabled": trace.get("enabled", False),
+                "path": trace.get("path", "traces"),
+            },
+        }
+
+
+
+    def setup() -> None:
+        """
+        Installs the queue handler on the root logger, and starts the listener (once per process)
+        """
+
+        if LogHandler._listener is not None:
+            return
+
+        settings = LogHandler.get_settings()
+        root = logging.getLogger()
+        root.setLevel(settings["level"])
+        for name, level in settings["levels"].items():
+            logging.getLogger(name).setLevel(level)
+
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(LogHandler.FORMAT))
+        stream_handler.addFilter(lambda record: not hasattr(record, "trace_values"))
+        handlers = [stream_handler]
+
+        if settings["trace"]["enabled"]:
+            LogHandler._trace_handler = TraceFileHandler(settings["trace"]["path"])
+            handlers.append(LogHandler._trace_handler)
+
+        LogHandler._queue_handler = _DroppingQueueHandler(queue.Queue(LogHandler.QUEUE_SIZE))
+        root.handlers = [LogHandler._queue_handler]
+
+        LogHandler._listener = logging.handlers.QueueListener(LogHandler._queue_handler.queue, *handlers, respect_handler_level=True)
+        LogHandler._listener.start()
+        atexit.register(LogHandler.shutdown)
+
+
+
+    def shutdown() -> None:
+        """
+        Writes out the queued records, and closes the trace file
+        """
+
+        if LogHandler._listener is None:
+            return
+
+        LogHandler._listener.stop()
+        LogHandler._listener = None
+        if LogHandler._trace_handler is not None:
+            LogHandler._trace_handler.close()
+            LogHandler._trace_handler = None
+
+
+
+    def is_tracing() -> bool:
+        return LogHandler._trace_handler is not None
+
+
+
+    def trace(name: str, fields: List[str], values: Tuple[float, ...]) -> None:
+        """
+        Queues a record for the trace file (regardless of the log levels, nothing goes to stdout)
+        """
+
+        record = logging.LogRecord(name, logging.DEBUG, "", 0, name, None, None)
+        record.trace_fields = fields
+        record.trace_values = values
+        LogHandler._queue_handler.handle(record)
+
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that drops the record when the queue is full, instead of reporting an error
+    """
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LogHandler._dropped_records.inc()
+
+
+
+class PacketLog:
+    """
+    A debug line written for every packet (eg. the values the state machine works on), that would flood the log:
+    - if tracing is enabled, every line goes to the trace file, as binary values (nothing goes to the log)
+    - else, if the logger is enabled for DEBUG, at most settings.logging.packet_lines_per_second lines are logged,
+      each with the number of lines skipped since the previous one
+    - else nothing is done, the check costs a call
+    """
+
+    def __init__(self, name: str, fields: List[str]) -> None:
+        self.name = name
+        self.fields = fields
+        self.logger = logging.getLogger(name)
+
+        lines_per_second = LogHandler.get_settings()["packet_lines_per_second"]
+        self._interval = 1 / lines_per_second if lines_per_second > 0 else None
+        self._format = " ".join(f"{field}=%.3f" for field in fields) + " (%d skipped)"
+        self._next_time = 0
+        self._skipped = 0
+
+
+
+    def log(self, *values: float) -> None:
+        if LogHandler._trace_handler is not None:
+            LogHandler.trace(self.name, self.fields, values)
+            return
+
+        if self._interval is None or not self.logger.isEnabledFor(logging.DEBUG):
+            return
+
+        now = time.monotonic()
+        if now < self._next_time:
+            self._skipped += 1
+            return
+
+        self._next_time = now + self._interval
+        self.logger.debug(self._format, *values, self._skipped)
+        self._skipped = 0
+
+
+
+class TraceFileHandler(logging.Handler):
+    """
+    Writes the PacketLog records to a binary file (runs on the listener thread)
+
+    - TRACE_PATH/DATE/TIME-PID.trace: one record per line, RECORD_HEADER (unix time, event number, value count), then the values (f4)
+    - TRACE_PATH/DATE/TIME-PID.json: started, pid, events ([ { "name", "fields" } ], the event number is the position)
+    """
+
+    RECORD_HEADER = struct.Struct("<dHB")
+    FLUSH_RECORDS = 256
+
+
+
+    def __init__(self, path: str) -> None:
+        super().__init__(logging.DEBUG)
+        self.addFilter(lambda record: hasattr(record, "trace_values"))
+
+        started = datetime.datetime.now()
+        directory = os.path.join(path, started.strftime("%Y-%m-%d"))
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = os.path.join(directory, f"{started.strftime('%H%M%S')}-{os.getpid()}.trace")
+        self._meta = { "started": started.isoformat(), "pid": os.getpid(), "events": [] }
+        self._events: Dict[str, int] = {}
+        self._file = open(self.path, "ab")
+        self._unflushed = 0
+        self._write_meta()
+
+
+
+    def emit(self, record: logging.LogRecord) -> None:
+        event = self._events.get(record.name)
+        if event is None:
+            event = len(self._meta["events"])
+            self._events[record.name] = event
+            self._meta["events"].append({ "name": record.name, "fields": record.trace_fields })
+            self._write_meta()
+
+        values = record.trace_values
+        self._file.write(TraceFileHandler.RECORD_HEADER.pack(record.created, event, len(values)))
+        self._file.write(struct.pack(f"<{len(values)}f", *values))
+
+        self._unflushed += 1
+        if self._unflushed >= TraceFileHandler.FLUSH_RECORDS:
+            self.flush()
+
+
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            self._unflushed = 0
+
+
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        super().close()
+
+
+
+    def _write_meta(self) -> None:
+        with open(self.path[:-6] + ".json", "w") as f:
+            json.dump(self._meta, f, indent=4)
+
+
+
+    def read(path: str) -> Iterator[Tuple[float, str, Dict[str, float]]]:
+        """
+        Yields the records of a trace file: (unix time, event name, { field: value })
+        """
+
+        with open(path[:-6] + ".json", "r") as f:
+            events = json.load(f)["events"]
+
+        with open(path, "rb") as f:
+            data = f.read()
+
+        position = 0
+        while position + TraceFileHandler.RECORD_HEADER.size <= len(data):
+            created, event, count = TraceFileHandler.RECORD_HEADER.unpack_from(data, position)
+            position += TraceFileHandler.RECORD_HEADER.size
+            if position + count * 4 > len(data):
+                break  # cut off by a crash
+
+            values = struct.unpack_from(f"<{count}f", data, position)
+            position += count * 4
+            yield created, events[event]["name"], dict(zip(events[event]["fields"], values))
@@ -0,0 +1,208 @@
+from bisect import bisect_left
+from threading import Lock
+import time
+from typing import Dict, List, Tuple
+
+
+class _Metric:
+    """
+    A metric with a fixed set of label names, each label value combination is a separate child
+    """
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...]) -> None:
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._children: Dict[tuple, object] = {}
+        self._lock = Lock()
+
+        # metrics without labels have a single child, that the metric itself forwards to
+        if len(label_names) == 0:
+            self._default = self.labels()
+
+
+
+    def labels(self, *values):
+        """
+        Returns the child for the given label values (in the order of the label names)
+        """
+
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+
+
+    def _format_labels(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{value}"' for name, value in zip(self.label_names, values)]
+        if extra != "":
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if len(pairs) > 0 else ""
+
+
+
+class Counter(_Metric):
+
+    TYPE = "counter"
+
+    class Child:
+        def __init__(self) -> None:
+            self.value = 0.0
+
+        def inc(self, amount: float = 1) -> None:
+            self.value += amount
+
+    def _new_child(self):
+        return Counter.Child()
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.value += amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(values)} {child.value}" for values, child in list(self._children.items())]
+
+
+
+class Gauge(_Metric):
+
+    TYPE = "gauge"
+
+    class Child:
+        def __init__(self) -> None:
+            self.value = 0.0
+
+        def set(self, value: float) -> None:
+            self.value = value
+
+        def inc(self, amount: float = 1) -> None:
+            self.value += amount
+
+    def _new_child(self):
+        return Gauge.Child()
+
+    def set(self, value: float) -> None:
+        self._default.value = value
+
+    def inc(self, amount: float = 1) -> None:
+        self._default.value += amount
+
+    def render(self) -> List[str]:
+        return [f"{self.name}{self._format_labels(values)} {child.value}" for values, child in list(self._children.items())]
+
+
+
+class Histogram(_Metric):
+
+    TYPE = "histogram"
+
+    class Child:
+        def __init__(self, buckets: List[float]) -> None:
+            self.buckets = buckets
+            self.counts = [0] * (len(buckets) + 1) # the last one is +Inf
+            self.sum = 0.0
+
+        def observe(self, value: float) -> None:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...], buckets: List[float]) -> None:
+        self.buckets = sorted(buckets)
+        super().__init__(name, help, label_names)
+
+    def _new_child(self):
+        return Histogram.Child(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def render(self) -> List[str]:
+        lines = []
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], child.counts):
+                cumulative += count
+                le = 'le="' + str(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._format_labels(values, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._format_labels(values)} {child.sum}")
+            lines.append(f"{self.name}_count{self._format_labels(values)} {cumulative}")
+        return lines
+
+
+
+class Metrics:
+    """
+    A static registry of counters, gauges and histograms, rendered in the Prometheus text format.
+
+    Updating a metric is a couple of attribute operations, so it can be done on every packet.
+    Metrics are created once, at import time of the module that uses them:
+    - PACKETS = Metrics.counter("simstats_udp_packets_received_total", "UDP packets received")
+    - PACKETS.inc()
+    """
+
+    # latency buckets, from 1 microsecond to 10 seconds
+    LATENCY_BUCKETS = [
+        0.000001, 0.000005, 0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10
+    ]
+
+    # class (static) variables
+    _metrics: Dict[str, _Metric] = {}
+    _lock: Lock = Lock()
+    _start_time: float = time.time()
+
+
+
+    def counter(name: str, help: str, label_names: Tuple[str, ...] = ()) -> Counter:
+        return Metrics._register(name, lambda: Counter(name, help, label_names))
+
+
+
+    def gauge(name: str, help: str, label_names: Tuple[str, ...] = ()) -> Gauge:
+        return Metrics._register(name, lambda: Gauge(name, help, label_names))
+
+
+
+    def histogram(name: str, help: str, label_names: Tuple[str, ...] = (), buckets: List[float] = None) -> Histogram:
+        return Metrics._register(
+            name, lambda: Histogram(name, help, label_names, buckets if buckets is not None else Metrics.LATENCY_BUCKETS)
+        )
+
+
+
+    def render() -> str:
+        """
+        Returns every metric in the Prometheus text exposition format
+        """
+
+        lines = [
+            "# HELP process_cpu_seconds_total CPU time used by the process",
+            "# TYPE process_cpu_seconds_total counter",
+            f"process_cpu_seconds_total {time.process_time()}",
+            "# HELP process_uptime_seconds Time since the metrics were initialized",
+            "# TYPE process_uptime_seconds gauge",
+            f"process_uptime_seconds {time.time() - Metrics._start_time}",
+        ]
+
+        for metric in list(Metrics._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.TYPE}")
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+
+    def _register(name: str, create) -> _Metric:
+        """
+        Returns the metric with the given name, creates it if it does not exist
+        """
+
+        with Metrics._lock:
+            metric = Metrics._metrics.get(name)
+            if metric is None:
+                metric = create()
+                Metrics._metrics[name] = metric
+            return metric
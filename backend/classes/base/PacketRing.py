@@ -0,0 +1,138 @@
+from multiprocessing import shared_memory
+import uuid
+from typing import List, Tuple
+
+import numpy as np
+
+
+class PacketRing:
+    """
+    Fixed-size ring of decoded packets (float32 records), in a multiprocessing.shared_memory block,
+    with a single writer and any number of readers, in the same or in other processes.
+
+    Attach from processes started by multiprocessing (they share the resource tracker of the creator),
+    so the block is only freed by the creator.
+    A ring only used in its own process (shared=False) is kept in a plain buffer, freed with the object.
+
+    Every record gets a sequence number (1, 2, 3, ...), readers ask for the records after the last one they have seen.
+    Sequence numbers start over in every ring, the epoch (random, per ring object) tells a cursor of another ring apart.
+    The writer never waits for readers, a reader that falls behind more than `slots` records loses the oldest ones.
+
+    Layout: a uint64 header (sequence number of the last record written), then `slots` slots of (uint64 stamp, float32[width]).
+    The stamp of a slot is cleared while it is written, and set to the sequence number after,
+    so a reader can tell (and drop) a record that was overwritten while it was copied.
+    """
+
+    HEADER_SIZE = 8
+
+
+
+    def __init__(self, width: int, slots: int = 8192, name: str = None, shared: bool = True) -> None:
+        """
+        Creates a new ring (name is None), or attaches to the ring created by another process
+
+        :param width: number of float32 values in a record
+        :param shared: False for a ring only used in this process (not in shared memory, name is None)
+        """
+
+        self.width = width
+        self.slots = slots
+        self.epoch = uuid.uuid4().hex
+        self.slot_dtype = np.dtype([("stamp", "<u8"), ("values", "<f4", (width,))])
+
+        size = PacketRing.HEADER_SIZE + slots * self.slot_dtype.itemsize
+        self._owner = name is None
+        if shared:
+            self._shm = shared_memory.SharedMemory(name=name, create=self._owner, size=size if self._owner else 0)
+            self.name = self._shm.name
+            buffer = self._shm.buf
+        else:
+            self._shm = None
+            self.name = None
+            buffer = bytearray(size)
+
+        self._head = np.ndarray((1,), dtype="<u8", buffer=buffer, offset=0)
+        slots_array = np.ndarray((slots,), dtype=self.slot_dtype, buffer=buffer, offset=PacketRing.HEADER_SIZE)
+        self._stamps = slots_array["stamp"]
+        self._values = slots_array["values"]
+        if self._owner:
+            self._head[0] = 0
+            self._stamps[:] = 0
+
+
+
+    def write(self, values: np.ndarray) -> int:
+        """
+        Appends a record (missing values are NaN, extra values are dropped), returns its sequence number
+        """
+
+        seq = int(self._head[0]) + 1
+        position = (seq - 1) % self.slots
+
+        self._stamps[position] = 0
+        count = min(len(values), self.width)
+        self._values[position, :count] = values[:count]
+        self._values[position, count:] = np.nan
+        self._stamps[position] = seq
+
+        self._head[0] = seq
+        return seq
+
+
+
+    def last_seq(self) -> int:
+        return int(self._head[0])
+
+
+
+    def read_after(self, after_seq: int, limit: int = None, columns: List[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the records written after after_seq (the oldest ones the ring still holds, if it fell behind)
+
+        :param columns: positions of the values to copy (all of them if not set)
+
+        Returns (sequence numbers, records[n, width or len(columns)]), copies, so they stay valid after the writer moves on
+        """
+
+        head = int(self._head[0])
+        first = max(after_seq + 1, head - self.slots + 1, 1)
+        if limit is not None:
+            first = max(first, head - limit + 1)
+        if first > head:
+            return np.empty(0, dtype=np.uint64), np.empty((0, self.width if columns is None else len(columns)), dtype=np.float32)
+
+        seqs = np.arange(first, head + 1, dtype=np.uint64)
+        positions = ((seqs - 1) % self.slots).astype(np.intp)
+
+        # drop the records that were being written, or got overwritten, while they were copied
+        stamps_before = self._stamps[positions]
+        values = self._values[positions] if columns is None else self._values[positions[:, None], np.asarray(columns, dtype=np.intp)]
+        valid = (stamps_before == seqs) & (self._stamps[positions] == seqs)
+        return seqs[valid], values[valid]
+
+
+
+    def latest(self) -> np.ndarray:
+        """
+        Returns the last record written (None if the ring is empty)
+        """
+
+        seqs, records = self.read_after(0, limit=1)
+        return records[-1] if len(records) > 0 else None
+
+
+
+    def close(self) -> None:
+        """
+        Detaches from the ring, the creator also frees the shared memory
+        """
+
+        self._head = None
+        self._stamps = None
+        self._values = None
+        if self._shm is None:
+            return
+
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
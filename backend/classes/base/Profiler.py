@@ -0,0 +1,195 @@
+import cProfile
+import pstats
+from collections import Counter
+import logging
+import os
+import sys
+from threading import Lock, Thread, get_ident, local
+import threading
+import time
+
+from classes.base.AppSettings import AppSettings
+
+
+class Profiler:
+    """
+    A static, opt-in profiler for the gather threads and the API request handlers.
+
+    Formats:
+    - collapsed: samples the stacks of the target threads every INTERVAL seconds, and writes them as collapsed stacks
+      ("thread;file:function;file:function count" per line, the input of flamegraph.pl / speedscope)
+    - pstats: deterministic cProfile of the API request handlers, written as a pstats file (api target only)
+
+    Targets:
+    - gather: threads started by the game handlers (named "gather-...")
+    - api: threads that handled an API request while profiling
+    - all: both
+
+    When no profile is running, the only cost is the Profiler.active check in the request hooks.
+    With settings.ingestion.mode = "process", the gather threads run in the ingestion process, out of reach of the sampler,
+    so only the api target can be profiled.
+    Output files are written to settings.profiling.path (default: "profiles").
+    """
+
+    TARGETS = ["gather", "api", "all"]
+    FORMATS = ["collapsed", "pstats"]
+    INTERVAL = 0.005 # seconds between stack samples
+
+    _log = logging.getLogger(__name__)
+
+    # class (static) variables
+    active: bool = False
+    _lock: Lock = Lock()
+    _target: str = None
+    _format: str = None
+    _api_threads: set = set()
+    _request_profiles: list = []
+    _local: local = local()
+    _last_output: str = None
+
+
+
+    def start(seconds: float, target: str = "all", output_format: str = "collapsed") -> str:
+        """
+        Starts profiling for the given number of seconds, in the background.
+        Returns the path of the output file, that is written when profiling ends.
+        """
+
+        if target not in Profiler.TARGETS:
+            raise ValueError(f"Invalid target \"{target}\", expected one of {Profiler.TARGETS}")
+        if output_format not in Profiler.FORMATS:
+            raise ValueError(f"Invalid format \"{output_format}\", expected one of {Profiler.FORMATS}")
+        if output_format == "pstats" and target != "api":
+            raise ValueError("pstats output is only available for the api target")
+        if target != "api" and (AppSettings().read_setting("ingestion") or {}).get("mode", "thread") == "process":
+            raise ValueError("The gather threads run in the ingestion process (ingestion.mode is \"process\"), only the api target can be profiled")
+
+        with Profiler._lock:
+            if Profiler.active:
+                raise RuntimeError("A profile is already running")
+            Profiler.active = True
+
+        path = (AppSettings().read_setting("profiling") or {}).get("path", "profiles")
+        os.makedirs(path, exist_ok=True)
+        extension = "collapsed" if output_format == "collapsed" else "pstats"
+        output_path = os.path.join(path, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{target}.{extension}")
+
+        Profiler._target = target
+        Profiler._format = output_format
+        Profiler._api_threads = set()
+        Profiler._request_profiles = []
+
+        Thread(target=Profiler._run, args=(seconds, output_path), daemon=True, name="profiler").start()
+        return output_path
+
+
+
+    def get_status() -> dict:
+        """
+        Returns whether a profile is running, and the path of the last output
+        """
+        return {
+            "active": Profiler.active,
+            "target": Profiler._target if Profiler.active else None,
+            "format": Profiler._format if Profiler.active else None,
+            "last_output": Profiler._last_output,
+        }
+
+
+
+    def request_started() -> None:
+        """
+        Called at the start of each API request, while a profile is active
+        """
+
+        if Profiler._target in ["api", "all"]:
+            Profiler._api_threads.add(get_ident())
+
+        # one profile per request, cProfile only sees the thread it was enabled on
+        if Profiler._format == "pstats":
+            Profiler._local.profile = cProfile.Profile()
+            Profiler._local.profile.enable()
+
+
+
+    def request_finished() -> None:
+        """
+        Called at the end of each API request, while a profile is active
+        """
+
+        profile = getattr(Profiler._local, "profile", None)
+        if profile is not None:
+            profile.disable()
+            Profiler._local.profile = None
+            Profiler._request_profiles.append(profile)
+
+
+
+    def _run(seconds: float, output_path: str) -> None:
+        """
+        Samples the target threads (collapsed), or waits (pstats), then writes the output
+        """
+
+        try:
+            if Profiler._format == "collapsed":
+                stacks = Profiler._sample(seconds)
+                with open(output_path, "w") as f:
+                    for stack, count in stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+            else:
+                time.sleep(seconds)
+                profiles = Profiler._request_profiles
+                Profiler._request_profiles = []
+                if len(profiles) == 0:
+                    raise RuntimeError("No API requests were made while profiling")
+                pstats.Stats(*profiles).dump_stats(output_path)
+
+            Profiler._last_output = output_path
+            Profiler._log.info("profile written to %s", output_path)
+
+        except Exception as e:
+            Profiler._log.warning("could not write profile: %s", e)
+
+        finally:
+            Profiler.active = False
+
+
+
+    def _sample(seconds: float) -> Counter:
+        """
+        Collects the stacks of the target threads every INTERVAL seconds
+        """
+
+        stacks = Counter()
+        own_id = get_ident()
+        end_time = time.perf_counter() + seconds
+
+        while time.perf_counter() < end_time:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id or not Profiler._is_target(thread_id, names.get(thread_id, "")):
+                    continue
+
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+
+                # thread name first, then the frames from the root to the leaf
+                thread_name = names.get(thread_id, str(thread_id))
+                stacks[";".join([thread_name] + frames[::-1])] += 1
+
+            time.sleep(Profiler.INTERVAL)
+
+        return stacks
+
+
+
+    def _is_target(thread_id: int, thread_name: str) -> bool:
+        if Profiler._target in ["gather", "all"] and thread_name.startswith("gather-"):
+            return True
+        if Profiler._target in ["api", "all"] and thread_id in Profiler._api_threads:
+            return True
+        return False
@@ -1,5 +1,9 @@
-from threading import Thread
+from threading import Event, Lock, Thread
 import socket
+import time
+from typing import Callable, Dict, List, Tuple
+
+from classes.base.Metrics import Metrics
 
 
 class UdpHandler:
@@ -9,13 +13,40 @@ class UdpHandler:
     - The thread is started by calling start_listen(port, buffer_size)
     - The thread is stopped by calling stop_listen().
     - The data from the last UDP packet received is returned by calling get_data().
+
+    Incoming packets are demultiplexed by their source (ip, port):
+    - get_data(source) returns the last packet received from that source
+    - get_sources() returns every source seen since the listener was started
+    - set_source_callback(callback) registers a function, that is called when a new source shows up
+
+    The listener is shared: every start_listen() needs a matching stop_listen(),
+    the socket is only closed when the last user stops listening.
     """
 
     # class (static) variables
     _listener_thread: Thread = None
-    _stop_thread: bool = False
+    _stop_event: Event = None  # of the running listener thread, each thread gets its own
     _data: bytes = None
 
+    _bind: Tuple[str, int] = None
+    _users: int = 0
+    _lock: Lock = Lock()
+
+    _source_data: Dict[Tuple[str, int], bytes] = {}
+    _source_last_seen: Dict[Tuple[str, int], float] = {}
+    _allowed_ips: set = None
+    _allowed_sources: set = None
+    _source_callback: Callable = None
+
+    # sources with a packet that get_data() did not return yet, and the source of _data
+    _unread_sources: set = set()
+    _data_source: Tuple[str, int] = None
+
+    # metrics
+    _packets_received = Metrics.counter("simstats_udp_packets_received_total", "UDP packets received")
+    _packets_dropped = Metrics.counter("simstats_udp_packets_dropped_total", "UDP packets dropped, because their source is not allowed")
+    _packets_overwritten = Metrics.counter("simstats_udp_packets_overwritten_total", "UDP packets replaced by a newer one from the same source, before they were read")
+
 
 
     def __init__(self) -> None:
@@ -23,56 +54,172 @@ class UdpHandler:
 
 
 
-    def start_listen(self, port: int, buffer_size: int = 1024) -> None:
-        """
-        Starts listening on the specified port.
-        Closes previous conenction if one exists.
+    def start_listen(self, port: int, buffer_size: int = 1024, bind_address: str = "127.0.0.1", allowed_sources: List[str] = None) -> None:
         """
+        Starts listening on the specified address and port.
+        If the listener is already running on the same address, it is reused.
+        Closes previous conenction if it was bound elsewhere.
 
-        # close previous connection if one exists
-        if UdpHandler._listener_thread is not None:
-            while UdpHandler._listener_thread.is_alive():
-                UdpHandler._stop_thread = True
-        UdpHandler._stop_thread = False
+        :param allowed_sources: list of "ip" or "ip:port" strings, packets from other sources are dropped (None or empty allows all)
+        """
 
-        # start new listener thread
-        UdpHandler._listener_thread = Thread(
-            target=UdpHandler._listen, daemon=True, args=(port, buffer_size)
-        )
-        UdpHandler._listener_thread.start()
+        with UdpHandler._lock:
+            UdpHandler._set_allowed_sources(allowed_sources)
+
+            # reuse the running listener, if it is bound to the same address
+            if (
+                UdpHandler._listener_thread is not None
+                and UdpHandler._listener_thread.is_alive()
+                and not UdpHandler._stop_event.is_set()
+                and UdpHandler._bind == (bind_address, port)
+            ):
+                UdpHandler._users += 1
+                return
+
+            # close previous connection if one exists (the thread notices within the socket timeout, and closes it)
+            if UdpHandler._listener_thread is not None:
+                UdpHandler._stop_event.set()
+                UdpHandler._listener_thread.join()
+
+            # bound here, so a busy port is reported to the caller
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Internet, UDP
+            sock.bind((bind_address, port))
+            sock.settimeout(0.1)
+
+            UdpHandler._bind = (bind_address, port)
+            UdpHandler._users = 1
+            UdpHandler._data = None
+            UdpHandler._source_data = {}
+            UdpHandler._source_last_seen = {}
+            UdpHandler._unread_sources = set()
+
+            # start new listener thread
+            UdpHandler._stop_event = Event()
+            UdpHandler._listener_thread = Thread(
+                target=UdpHandler._listen, daemon=True, args=(sock, buffer_size, UdpHandler._stop_event), name="udp-listener"
+            )
+            UdpHandler._listener_thread.start()
 
 
 
     def stop_listen(self) -> None:
         """
-        Stops listening.
+        Stops listening, once every user of the listener has called stop_listen().
         """
-        UdpHandler._stop_thread = True
+
+        with UdpHandler._lock:
+            UdpHandler._users = max(UdpHandler._users - 1, 0)
+            if UdpHandler._users == 0 and UdpHandler._stop_event is not None:
+                UdpHandler._stop_event.set()
 
 
 
-    def get_data(self) -> bytes:
+    def get_data(self, source: Tuple[str, int] = None) -> bytes:
         """
         Returns data from the last UDP packet received.
+        If source is given, only packets from that (ip, port) are considered.
+        """
+
+        if source is None:
+            UdpHandler._unread_sources.discard(UdpHandler._data_source)
+            return UdpHandler._data
+
+        UdpHandler._unread_sources.discard(source)
+        return UdpHandler._source_data.get(source)
+
+
+
+    def get_sources(self) -> Dict[Tuple[str, int], float]:
+        """
+        Returns the sources seen by the listener, with the time they last sent a packet
+        """
+        return dict(UdpHandler._source_last_seen)
+
+
+
+    def set_source_callback(self, callback: Callable) -> None:
+        """
+        Sets a function to call with the (ip, port) of each new source.
+        The callback runs on the listener thread, so it should return quickly.
+        Pass None to remove it.
+        """
+        UdpHandler._source_callback = callback
+
+
+
+    def parse_source(source: str) -> Tuple[str, int]:
+        """
+        Parses an "ip:port" string into an (ip, port) tuple
         """
-        return UdpHandler._data
 
+        ip, port = source.rsplit(":", 1)
+        return (ip, int(port))
 
 
-    def _listen(port, buffer_size) -> None:
+
+    def format_source(source: Tuple[str, int]) -> str:
         """
-        Listens for incoming UDP packets.
-        Stores data in UdpHandler.data
+        Formats an (ip, port) tuple as an "ip:port" string
         """
+        return f"{source[0]}:{source[1]}"
+
 
-        # set up UDP socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)  # Internet, UDP
-        sock.bind(("127.0.0.1", port))
-        sock.settimeout(0.1)
 
-        # listen for incoming UDP packets until stop_thread is set to True
-        while not UdpHandler._stop_thread:
+    def _set_allowed_sources(allowed_sources: List[str]) -> None:
+        """
+        Splits the allow-list into whole IPs and exact (ip, port) sources
+        """
+
+        if not allowed_sources:
+            UdpHandler._allowed_ips = None
+            UdpHandler._allowed_sources = None
+            return
+
+        UdpHandler._allowed_ips = set(s for s in allowed_sources if ":" not in s)
+        UdpHandler._allowed_sources = set(UdpHandler.parse_source(s) for s in allowed_sources if ":" in s)
+
+
+
+    def _is_allowed(addr: Tuple[str, int]) -> bool:
+        """
+        Checks a source against the allow-list
+        """
+
+        if UdpHandler._allowed_ips is None:
+            return True
+        return addr[0] in UdpHandler._allowed_ips or addr in UdpHandler._allowed_sources
+
+
+
+    def _listen(sock: socket.socket, buffer_size: int, stop: Event) -> None:
+        """
+        Listens for incoming UDP packets, until stop is set.
+        Stores data in UdpHandler.data, and per source in UdpHandler._source_data
+        """
+
+        # listen for incoming UDP packets until the thread is stopped
+        while not stop.is_set():
             try:
-                UdpHandler._data, addr = sock.recvfrom(buffer_size)
+                data, addr = sock.recvfrom(buffer_size)
             except socket.timeout:
-                pass
+                continue
+
+            UdpHandler._packets_received.inc()
+            if not UdpHandler._is_allowed(addr):
+                UdpHandler._packets_dropped.inc()
+                continue
+
+            if addr in UdpHandler._unread_sources:
+                UdpHandler._packets_overwritten.inc()
+            UdpHandler._unread_sources.add(addr)
+
+            is_new_source = addr not in UdpHandler._source_data
+            UdpHandler._source_data[addr] = data
+            UdpHandler._source_last_seen[addr] = time.time()
+            UdpHandler._data = data
+            UdpHandler._data_source = addr
+
+            if is_new_source and UdpHandler._source_callback is not None:
+                UdpHandler._source_callback(addr)
+
+        sock.close()
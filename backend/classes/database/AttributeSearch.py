@@ -0,0 +1,238 @@
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, List
+import re
+import unicodedata
+
+from sqlalchemy import select
+from sqlalchemy.engine import Connection
+
+from classes.database.DbEngine import read_engine
+from classes.database.models.Car import Car
+from classes.database.models.Game import Game
+from classes.database.models.Track import Track
+from classes.database.models.Run import Tag
+
+
+class AttributeSearch:
+    """
+    In-memory search over the track, car and tag names of a game, for the autocomplete fields of the frontend.
+
+    Per game, every word of every name is kept in a sorted list, so prefix matches are a bisect into that list.
+    Names that do not match the prefix are ranked by shared trigrams, so typos still find something.
+
+    The index holds the names saved in the DB and the names the game knows of (eg. every DR2 stage),
+    it is built on the first search, and rebuilt on the next search after invalidate() is called (eg. after a save).
+    """
+
+    KINDS = ["track", "car", "tag"]
+    FUZZY_MIN_SCORE = 0.4  # minimum share of the query trigrams, that a fuzzy match needs
+    FUZZY_MIN_TRIGRAMS = 2  # and the minimum number of them
+
+    # class (static) variables
+    _lock: Lock = Lock()
+    _indexes: Dict[str, dict] = {}
+
+
+
+    def search(game_name: str, query: str, kinds: List[str] = None, limit: int = 10, known_names: dict = None) -> dict:
+        """
+        Returns the best matches of the query, for each kind
+
+        :param kinds: any of KINDS, all of them if None
+        :param limit: number of matches to return per kind
+        :param known_names: { "track": [name], "car": [(name, class)] } names of the game, that might not be saved yet
+
+        { "track": [ { "name", "saved", "match" } ], "car": [ { "name", "car_class", "saved", "match" } ], "tag": [ ... ] }
+        match is "prefix" or "fuzzy"
+        """
+
+        if kinds is None:
+            kinds = AttributeSearch.KINDS
+        for kind in kinds:
+            if kind not in AttributeSearch.KINDS:
+                raise ValueError(f"Invalid kind \"{kind}\", expected one of {AttributeSearch.KINDS}")
+
+        index = AttributeSearch._get_index(game_name, known_names)
+        tokens = AttributeSearch._tokenize(query)
+
+        results = {}
+        for kind in kinds:
+            results[kind] = AttributeSearch._search_kind(index[kind], tokens, limit)
+
+        return results
+
+
+
+    def invalidate(game_name: str = None) -> None:
+        """
+        Marks the index of a game (or every game) as outdated, it is rebuilt on the next search
+        """
+
+        with AttributeSearch._lock:
+            if game_name is None:
+                AttributeSearch._indexes = {}
+            else:
+                AttributeSearch._indexes.pop(game_name, None)
+
+
+
+    def _get_index(game_name: str, known_names: dict) -> dict:
+        """
+        Returns the index of a game, builds it if needed
+        """
+
+        with AttributeSearch._lock:
+            index = AttributeSearch._indexes.get(game_name)
+            if index is None:
+                index = AttributeSearch._build_index(game_name, known_names or {})
+                AttributeSearch._indexes[game_name] = index
+
+        return index
+
+
+
+    def _build_index(game_name: str, known_names: dict) -> dict:
+        """
+        Reads the names from the DB, and builds the word and trigram lists for each kind
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            saved_tracks = conn.execute(
+                select(Track.name).join(Game, Track.game_id == Game.id).where(Game.name == game_name)
+            ).scalars().all()
+
+            saved_cars = conn.execute(
+                select(Car.name, Car.car_class).join(Game, Car.game_id == Game.id).where(Game.name == game_name)
+            ).all()
+
+            saved_tags = conn.execute(select(Tag.name)).scalars().all()
+
+        # entries are (name, extra fields), saved names overwrite the known ones
+        tracks = { name: { "saved": False } for name in known_names.get("track", []) }
+        tracks.update({ name: { "saved": True } for name in saved_tracks })
+
+        cars = { name: { "car_class": car_class, "saved": False } for name, car_class in known_names.get("car", []) }
+        cars.update({ name: { "car_class": car_class, "saved": True } for name, car_class in saved_cars })
+
+        tags = { name: { "saved": True } for name in saved_tags }
+
+        return {
+            "track": AttributeSearch._build_kind(tracks),
+            "car": AttributeSearch._build_kind(cars),
+            "tag": AttributeSearch._build_kind(tags),
+        }
+
+
+
+    def _build_kind(entries: dict) -> dict:
+        """
+        Builds the index of one kind
+
+        - names: list of (name, extra fields)
+        - words: sorted list of (word, position of the word in the name, name id)
+        - word_sets: the words of each name
+        - trigrams: trigram -> set of name ids
+        """
+
+        names = list(entries.items())
+        words = []
+        word_sets = []
+        trigrams = {}
+
+        for name_id, (name, _) in enumerate(names):
+            name_words = AttributeSearch._tokenize(name)
+            word_sets.append(name_words)
+            for position, word in enumerate(name_words):
+                words.append((word, position, name_id))
+
+            for trigram in AttributeSearch._trigrams(name_words):
+                trigrams.setdefault(trigram, set()).add(name_id)
+
+        words.sort()
+
+        return {
+            "names": names,
+            "words": words,
+            "word_sets": word_sets,
+            "trigrams": trigrams,
+        }
+
+
+
+    def _search_kind(index: dict, tokens: List[str], limit: int) -> List[dict]:
+        """
+        Returns the prefix matches of the tokens (every token has to start a word of the name),
+        topped up with fuzzy matches if there are less than limit
+        """
+
+        if len(tokens) == 0 or limit <= 0:
+            return []
+
+        # names with a word starting with the first token, and the earliest position of that word
+        words = index["words"]
+        first = tokens[0]
+        candidates = {}
+        i = bisect_left(words, (first,))
+        while i < len(words) and words[i][0].startswith(first):
+            _, position, name_id = words[i]
+            candidates[name_id] = min(position, candidates.get(name_id, position))
+            i += 1
+
+        # the rest of the tokens have to start a word too
+        word_sets = index["word_sets"]
+        prefix_ids = [
+            name_id for name_id in candidates
+            if all(any(word.startswith(token) for word in word_sets[name_id]) for token in tokens[1:])
+        ]
+
+        # names starting with the query first, then shorter names
+        names = index["names"]
+        prefix_ids.sort(key=lambda name_id: (candidates[name_id], len(names[name_id][0]), names[name_id][0]))
+        matches = [(name_id, "prefix") for name_id in prefix_ids[:limit]]
+
+        # top up with the names sharing the most trigrams with the query
+        if len(matches) < limit:
+            query_trigrams = AttributeSearch._trigrams(tokens)
+            scores = {}
+            for trigram in query_trigrams:
+                for name_id in index["trigrams"].get(trigram, ()):
+                    scores[name_id] = scores.get(name_id, 0) + 1
+
+            matched = set(prefix_ids)
+            min_score = max(AttributeSearch.FUZZY_MIN_SCORE * len(query_trigrams), AttributeSearch.FUZZY_MIN_TRIGRAMS)
+            fuzzy_ids = [
+                name_id for name_id, score in scores.items()
+                if name_id not in matched and score >= min_score
+            ]
+            fuzzy_ids.sort(key=lambda name_id: (-scores[name_id], len(names[name_id][0]), names[name_id][0]))
+            matches.extend((name_id, "fuzzy") for name_id in fuzzy_ids[:limit - len(matches)])
+
+        return [
+            { "name": names[name_id][0], **names[name_id][1], "match": match }
+            for name_id, match in matches
+        ]
+
+
+
+    def _tokenize(text: str) -> List[str]:
+        """
+        Splits a name into lowercase words, without accents
+        """
+
+        text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+        return re.findall(r"[a-z0-9]+", text.lower())
+
+
+
+    def _trigrams(words: List[str]) -> set:
+        """
+        Returns the trigrams of the words, each padded so word starts weigh more and short words have some too
+        """
+
+        trigrams = set()
+        for word in words:
+            word = f"  {word} "
+            trigrams.update(word[i:i + 3] for i in range(len(word) - 2))
+        return trigrams
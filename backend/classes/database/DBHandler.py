@@ -1,16 +1,27 @@
-from typing import List
-
-from sqlalchemy import distinct, select
-
-from classes.database.DbEngine import engine
-from sqlalchemy.orm import Session
+import base64
+import datetime
+import json
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextvars import ContextVar
+from typing import Callable, Dict, List
+
+from sqlalchemy import DateTime, bindparam, distinct, exists, func, select, text, tuple_, update
+from sqlalchemy.engine import Connection
+
+from classes.base.Metrics import Metrics
+from classes.database.DbEngine import engine, read_engine
 
 from classes.database.models.Base import Base
 from classes.database.models.Car import Car
 from classes.database.models.Game import Game
+from classes.database.models.IdentificationCorrection import IdentificationCorrection
 from classes.database.models.Run import Run
+from classes.database.models.RunSplit import RunSplit
 from classes.database.models.Track import Track
-from classes.database.models.Run import Tag
+from classes.database.models.Run import Tag, run_tag_table
 
 from classes.game.RunData import RunData
 
@@ -38,7 +49,43 @@ from classes.game.RunData import RunData
 
 
 class DBHandler:
-  
+    """
+    Reads go through the read-only pool (read_engine), so API queries never wait on a write.
+    Writes go through the single writer connection (engine), with the statements below, compiled once
+    (SQLAlchemy caches the compiled form per statement object, so they skip the ORM and the query building).
+    """
+
+    _log = logging.getLogger(__name__)
+
+    # metrics
+    _commit_seconds = Metrics.histogram("simstats_db_commit_seconds", "Time spent committing a saved run")
+
+    # class (static) variables
+    _game_ids: Dict[str, int] = {}  # games are never renamed or deleted
+
+    # reads shared by the sub-requests of a /batch call (see BatchRequest), keyed by (method, arguments)
+    # None outside of a batch, so every call reads the DB
+    batch_memo: ContextVar[Dict[tuple, Future]] = ContextVar("batch_memo", default=None)
+    _memo_lock = threading.Lock()
+
+    # statements of the writer
+    _select_game_id = text("SELECT id FROM games WHERE name = :name")
+    _select_track_id = text("SELECT id FROM tracks WHERE game_id = :game_id AND name = :name")
+    _select_car_id = text("SELECT id FROM cars WHERE game_id = :game_id AND name = :name")
+    _select_tag_id = text("SELECT id FROM tags WHERE name = :name")
+    _insert_track = text("INSERT INTO tracks (name, game_id) VALUES (:name, :game_id)")
+    _insert_car = text("INSERT INTO cars (name, car_class, game_id) VALUES (:name, :car_class, :game_id)")
+    _insert_tag = text("INSERT INTO tags (name) VALUES (:name)")
+    _insert_run = text("""
+        INSERT INTO runs (conditions, run_date, runtime_seconds, game_id, track_id, car_id)
+        VALUES (:conditions, :run_date, :runtime_seconds, :game_id, :track_id, :car_id)
+    """).bindparams(bindparam("run_date", type_=DateTime()))
+    _insert_run_tag = text("INSERT OR IGNORE INTO run_tags (run_id, tag_id) VALUES (:run_id, :tag_id)")
+    _insert_split = text("""
+        INSERT INTO run_splits (sector, split_seconds, sector_seconds, run_id, track_id, car_id)
+        VALUES (:sector, :split_seconds, :sector_seconds, :run_id, :track_id, :car_id)
+    """)
+
     def save_run(run_data: RunData):
         """
         Save a run to the database
@@ -47,68 +94,112 @@ class DBHandler:
         - tags
         - runtime (each lap time will be a separate run entry)
         - run date
+        - sector splits (only if a single runtime is saved)
+
+        Returns the ids of the created runs
         """
         
-        print("* saving run to database")
-
-        session: Session
-        with Session(engine) as session:
-            # the game should be in the DB by default, find it
-            game: Game = session.execute(
-                select(Game).where(Game.name == run_data.game_name)
-            ).scalars().first()
-            if game is None:
-                raise Exception(f"Game \"{run_data.game_name}\" not found in database")
-
-            # try to find track
-            track: Track = session.execute(
-                select(Track).where(Track.name == run_data.track, Track.game_id == game.id)
-            ).scalars().first()
-            # if track does not exist, create it
-            if track is None:
-                track = Track(name=run_data.track, game=game)
-                session.add(track)
-
-            # try to find car
-            car: Car = session.execute(
-                select(Car).where(Car.name == run_data.car, Car.game_id == game.id)
-            ).scalars().first()
-            # if car does not exist, create it
-            if car is None:
-                car = Car(name=run_data.car, game=game, car_class=run_data.car_class)
-                session.add(car)
+        DBHandler._log.info("saving run to database")
+
+        conn: Connection
+        with engine.connect() as conn:
+            # the game should be in the DB by default, the track, car and tags are created if they don't exist
+            game_id = DBHandler._get_game_id(conn, run_data.game_name)
+            track_id = DBHandler._get_or_create(conn, DBHandler._select_track_id, DBHandler._insert_track, { "game_id": game_id, "name": run_data.track })
+            car_id = DBHandler._get_or_create(conn, DBHandler._select_car_id, DBHandler._insert_car, { "game_id": game_id, "name": run_data.car, "car_class": run_data.car_class })
+            tag_ids = [
+                DBHandler._get_or_create(conn, DBHandler._select_tag_id, DBHandler._insert_tag, { "name": tag_name.lower() })
+                for tag_name in run_data.tags
+            ]
 
             # create a run for each laptime
+            run_ids = []
             for lap_time in run_data.lap_times_sec:
-                run = Run(
-                    game=game,
+                run_id = conn.execute(DBHandler._insert_run, {
+                    "conditions": run_data.track_conditions,
+                    "run_date": run_data.run_date,
+                    "runtime_seconds": lap_time,
+                    "game_id": game_id,
+                    "track_id": track_id,
+                    "car_id": car_id,
+                }).lastrowid
 
-                    conditions=run_data.track_conditions,
-                    run_date=run_data.run_date,
-                    runtime_seconds=lap_time,
+                # add tags
+                for tag_id in tag_ids:
+                    conn.execute(DBHandler._insert_run_tag, { "run_id": run_id, "tag_id": tag_id })
+
+                # add splits, they belong to the whole run, so only if it is saved as a single entry
+                if len(run_data.lap_times_sec) == 1 and len(run_data.split_times_sec) > 0:
+                    split_times = run_data.split_times_sec + [lap_time]
+                    conn.execute(DBHandler._insert_split, [
+                        {
+                            "sector": sector + 1,
+                            "split_seconds": split_time,
+                            "sector_seconds": split_time - (split_times[sector - 1] if sector > 0 else 0),
+                            "run_id": run_id,
+                            "track_id": track_id,
+                            "car_id": car_id,
+                        }
+                        for sector, split_time in enumerate(split_times)
+                    ])
+
+                run_ids.append(run_id)
 
-                    track=track,
-                    car=car,
-                )
+            # save all changes
+            commit_start = time.perf_counter()
+            conn.commit()
+            DBHandler._commit_seconds.observe(time.perf_counter() - commit_start)
 
-                # add tags
-                for tag_name in run_data.tags:
-                    # try to find tag
-                    tag: Tag = session.execute(
-                        select(Tag).where(Tag.name == tag_name.lower())
-                    ).scalars().first()
-                    # if tag does not exist, create it
-                    if tag is None:
-                        tag = Tag(name=tag_name.lower())
-                        session.add(tag)
+            return run_ids
 
-                    # add tag to run
-                    run.tags.append(tag)
 
-                session.add(run)
+    def _get_game_id(conn: Connection, game_name: str) -> int:
+        """
+        Returns the id of a game (raises if it is not in the DB)
+        """
 
-            # save all changes
-            session.commit()
+        if game_name not in DBHandler._game_ids:
+            game_id = conn.execute(DBHandler._select_game_id, { "name": game_name }).scalar()
+            if game_id is None:
+                raise Exception(f"Game \"{game_name}\" not found in database")
+            DBHandler._game_ids[game_name] = game_id
+
+        return DBHandler._game_ids[game_name]
+
+
+    def _get_or_create(conn: Connection, select_statement, insert_statement, params: dict) -> int:
+        """
+        Returns the id of the row select_statement finds, inserts it with insert_statement if there is none
+        """
+
+        row_id = conn.execute(select_statement, params).scalar()
+        if row_id is None:
+            row_id = conn.execute(insert_statement, params).lastrowid
+        return row_id
+
+
+    def _memoized(key: tuple, load: Callable):
+        """
+        Returns load(), read once per batch for the same key (concurrent sub-requests wait for the first one)
+        """
+
+        memo = DBHandler.batch_memo.get()
+        if memo is None:
+            return load()
+
+        with DBHandler._memo_lock:
+            future = memo.get(key)
+            owner = future is None
+            if owner:
+                future = memo[key] = Future()
+
+        if owner:
+            try:
+                future.set_result(load())
+            except Exception as e:
+                future.set_exception(e)
+
+        return future.result()
 
 
     def get_saved_tracks(game_name: str) -> List[str]:
@@ -116,16 +207,16 @@ class DBHandler:
         Returns all track names in the DB, for a given game
         """
 
-        session: Session
-        with Session(engine) as session:
-            tracks = session.execute(
-                select(Track)
-                .join(Game, Track.game_id == Game.id)
-                .where(Game.name == game_name)
-            ).scalars().all()
+        def load():
+            conn: Connection
+            with read_engine.connect() as conn:
+                return conn.execute(
+                    select(Track.name)
+                    .join(Game, Track.game_id == Game.id)
+                    .where(Game.name == game_name)
+                ).scalars().all()
 
-        # return the track names
-        return [track.name for track in tracks]
+        return DBHandler._memoized(("tracks", game_name), load)
 
 
     def get_saved_track_conditions(game_name: str) -> List[str]:
@@ -133,15 +224,16 @@ class DBHandler:
         Returns all unique track conditions of RunData saved in the DB, for a given game
         """
 
-        session: Session
-        with Session(engine) as session:
-            conditions = session.execute(
-                select(distinct(Run.conditions))
-                .join(Game, Run.game_id == Game.id)
-                .where(Game.name == game_name)
-            ).scalars().all()
+        def load():
+            conn: Connection
+            with read_engine.connect() as conn:
+                return conn.execute(
+                    select(distinct(Run.conditions))
+                    .join(Game, Run.game_id == Game.id)
+                    .where(Game.name == game_name)
+                ).scalars().all()
 
-        return conditions
+        return DBHandler._memoized(("track_conditions", game_name), load)
 
 
     def get_saved_cars(game_name: str) -> List[str]:
@@ -149,16 +241,19 @@ class DBHandler:
         Returns all cars (name, class) in the DB, for a given game
         """
 
-        session: Session
-        with Session(engine) as session:
-            cars = session.execute(
-                select(Car)
-                .join(Game, Car.game_id == Game.id)
-                .where(Game.name == game_name)
-            ).scalars().all()
+        def load():
+            conn: Connection
+            with read_engine.connect() as conn:
+                cars = conn.execute(
+                    select(Car.name, Car.car_class)
+                    .join(Game, Car.game_id == Game.id)
+                    .where(Game.name == game_name)
+                ).all()
+
+            # return car-name, car-class tuples
+            return [(name, car_class) for name, car_class in cars]
 
-        # return car-name, car-class tuples
-        return [(car.name, car.car_class) for car in cars]
+        return DBHandler._memoized(("cars", game_name), load)
 
 
 
@@ -167,15 +262,16 @@ class DBHandler:
         Returns all unique car classes saved in the DB, for a given game
         """
 
-        session: Session
-        with Session(engine) as session:
-            car_classes = session.execute(
-                select(distinct(Car.car_class))
-                .join(Game, Car.game_id == Game.id)
-                .where(Game.name == game_name)
-            ).scalars().all()
+        def load():
+            conn: Connection
+            with read_engine.connect() as conn:
+                return conn.execute(
+                    select(distinct(Car.car_class))
+                    .join(Game, Car.game_id == Game.id)
+                    .where(Game.name == game_name)
+                ).scalars().all()
 
-        return car_classes
+        return DBHandler._memoized(("car_classes", game_name), load)
 
 
     def get_saved_tags(game_name: str) -> List[str]:
@@ -185,32 +281,381 @@ class DBHandler:
         { "all": [ ], "game": [ ] }
         """
 
-        session: Session
-        with Session(engine) as session:
-            # get all tags
-            all_tags = session.execute(
-                select(Tag)
+        # get all tags (the same for every game, so shared between the games of a batch)
+        def load_all():
+            conn: Connection
+            with read_engine.connect() as conn:
+                return conn.execute(
+                    select(Tag.name)
+                ).scalars().all()
+
+        # get the tags used by runs of the game (without loading the runs)
+        def load_game():
+            conn: Connection
+            with read_engine.connect() as conn:
+                return conn.execute(
+                    select(distinct(Tag.name))
+                    .join(run_tag_table, run_tag_table.c.tag_id == Tag.id)
+                    .join(Run, run_tag_table.c.run_id == Run.id)
+                    .join(Game, Run.game_id == Game.id)
+                    .where(Game.name == game_name)
+                ).scalars().all()
+
+        return {
+            "all": DBHandler._memoized(("tags",), load_all),
+            "game": DBHandler._memoized(("tags", game_name), load_game),
+        }
+
+
+    def get_best_run_ids(run_id: int, same_car: bool = False) -> List[int]:
+        """
+        Returns the ids of the runs on the same track as the given run, fastest first
+        (optionally only the ones with the same car), without the runs saved with a 0 time
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            run = conn.execute(select(Run.track_id, Run.car_id).where(Run.id == run_id)).first()
+            if run is None:
+                raise Exception(f"Run {run_id} not found in database")
+
+            query = select(Run.id).where(Run.track_id == run.track_id, Run.runtime_seconds > 0)
+            if same_car:
+                query = query.where(Run.car_id == run.car_id)
+
+            return conn.execute(
+                query.order_by(Run.runtime_seconds, Run.id)
             ).scalars().all()
 
-            # get all runs for the game
-            runs = session.execute(
-                select(Run)
+
+    def get_fastest_run_ids(game_name: str, track_name: str, car_name: str) -> List[int]:
+        """
+        Returns the ids of the runs with a given track and car, fastest first, without the runs saved with a 0 time
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            return conn.execute(
+                select(Run.id)
                 .join(Game, Run.game_id == Game.id)
+                .join(Track, Run.track_id == Track.id)
+                .join(Car, Run.car_id == Car.id)
+                .where(Game.name == game_name, Track.name == track_name, Car.name == car_name, Run.runtime_seconds > 0)
+                .order_by(Run.runtime_seconds, Run.id)
+            ).scalars().all()
+
+
+    def get_personal_best_run_ids() -> set:
+        """
+        Returns the ids of the fastest run of every track and car combination
+        (runs saved with a 0 time, the 00:00:000 results, are not the fastest)
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            # SQLite returns the id of the row the min() came from
+            run_ids = conn.execute(
+                select(Run.id, func.min(Run.runtime_seconds))
+                .where(Run.runtime_seconds > 0)
+                .group_by(Run.track_id, Run.car_id)
+            ).scalars().all()
+
+        return set(run_ids)
+
+
+    def get_run_dates(run_ids: List[int]) -> dict:
+        """
+        Returns the date of each run, { run_id: run_date }
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            rows = conn.execute(
+                select(Run.id, Run.run_date).where(Run.id.in_(run_ids))
+            ).all()
+
+        return { run_id: run_date for run_id, run_date in rows }
+
+
+    def get_identification_corrections(game_name: str) -> List[dict]:
+        """
+        Returns the car and track corrections of a game
+
+        [ { "kind", "fingerprint" (list), "name", "car_class" } ]
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            rows = conn.execute(
+                select(IdentificationCorrection.kind, IdentificationCorrection.fingerprint, IdentificationCorrection.name, IdentificationCorrection.car_class)
+                .join(Game, IdentificationCorrection.game_id == Game.id)
                 .where(Game.name == game_name)
+            ).all()
+
+        return [
+            { "kind": kind, "fingerprint": json.loads(fingerprint), "name": name, "car_class": car_class }
+            for kind, fingerprint, name, car_class in rows
+        ]
+
+
+    def save_identification_correction(game_name: str, kind: str, fingerprint: List[float], name: str, car_class: str = None):
+        """
+        Saves (or replaces) the car or track a fingerprint belongs to
+        """
+
+        # floats are written with repr, so they read back exactly
+        fingerprint_json = json.dumps([float(value) for value in fingerprint])
+
+        conn: Connection
+        with engine.connect() as conn:
+            game_id = DBHandler._get_game_id(conn, game_name)
+
+            table = IdentificationCorrection.__table__
+            values = { "name": name, "car_class": car_class, "updated_date": datetime.datetime.now() }
+            updated = conn.execute(
+                update(table)
+                .where(table.c.game_id == game_id, table.c.kind == kind, table.c.fingerprint == fingerprint_json)
+                .values(**values)
+            ).rowcount
+            if updated == 0:
+                conn.execute(table.insert().values(game_id=game_id, kind=kind, fingerprint=fingerprint_json, **values))
+            conn.commit()
+
+
+    def get_runs_between(game_name: str, date_from: datetime.datetime, date_to: datetime.datetime) -> List[dict]:
+        """
+        Returns the runs of a game from date_from (inclusive) to date_to (exclusive), by date
+
+        [ { "id", "run_date", "runtime_seconds" } ]
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            rows = conn.execute(
+                select(Run.id, Run.run_date, Run.runtime_seconds)
+                .join(Game, Run.game_id == Game.id)
+                .where(Game.name == game_name, Run.run_date >= date_from, Run.run_date < date_to)
+                .order_by(Run.run_date, Run.id)
+            ).all()
+
+        return [
+            { "id": run_id, "run_date": run_date, "runtime_seconds": runtime_seconds }
+            for run_id, run_date, runtime_seconds in rows
+        ]
+
+
+    def get_runs_without_time() -> List[int]:
+        """
+        Returns the ids of the runs saved with a 0 time
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            return conn.execute(
+                select(Run.id).where(Run.runtime_seconds == 0).order_by(Run.id)
             ).scalars().all()
 
-            # get tag names fro all_tags
-            all_tag_names = [tag.name for tag in all_tags]
 
-            # get all tags for the runs
-            game_tags = []
-            for run in runs:
-                game_tags.extend(run.tags)
+    def set_run_time(run_id: int, runtime_seconds: float):
+        """
+        Replaces the time of a saved run (and its last split, which is the finish)
+        """
+
+        conn: Connection
+        with engine.connect() as conn:
+            updated = conn.execute(
+                update(Run.__table__).where(Run.__table__.c.id == run_id).values(runtime_seconds=runtime_seconds)
+            ).rowcount
+            if updated == 0:
+                raise Exception(f"Run {run_id} not found in database")
+
+            splits = conn.execute(
+                select(RunSplit.id, RunSplit.split_seconds).where(RunSplit.run_id == run_id).order_by(RunSplit.sector.desc()).limit(2)
+            ).all()
+            if len(splits) > 0:
+                conn.execute(
+                    update(RunSplit.__table__).where(RunSplit.__table__.c.id == splits[0].id).values(
+                        split_seconds=runtime_seconds,
+                        sector_seconds=runtime_seconds - (splits[1].split_seconds if len(splits) > 1 else 0),
+                    )
+                )
+            conn.commit()
+
+
+    def get_best_sectors(game_name: str, track_name: str, car_name: str = None):
+        """
+        Returns the best time of each sector on a track (optionally with a given car),
+        and the theoretical best run (the sum of the best sectors)
+
+        { "sectors": [ { "sector", "sector_seconds", "run_id" } ], "theoretical_best_seconds": float }
+        """
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            track = conn.execute(
+                select(Track.id, Track.game_id)
+                .join(Game, Track.game_id == Game.id)
+                .where(Game.name == game_name, Track.name == track_name)
+            ).first()
+            if track is None:
+                return { "sectors": [], "theoretical_best_seconds": None }
+
+            query = select(RunSplit.sector, func.min(RunSplit.sector_seconds), RunSplit.run_id).where(RunSplit.track_id == track.id)
+
+            if car_name is not None:
+                car_id = conn.execute(
+                    select(Car.id).where(Car.name == car_name, Car.game_id == track.game_id)
+                ).scalar()
+                if car_id is None:
+                    return { "sectors": [], "theoretical_best_seconds": None }
+                query = query.where(RunSplit.car_id == car_id)
 
-            # get all unique tags
-            game_tag_names = list(set(tag.name for tag in game_tags))
+            # sqlite returns the run_id of the row with the minimum (bare column in an aggregate query)
+            rows = conn.execute(
+                query.group_by(RunSplit.sector).order_by(RunSplit.sector)
+            ).all()
+
+        sectors = [
+            { "sector": sector, "sector_seconds": sector_seconds, "run_id": run_id }
+            for sector, sector_seconds, run_id in rows
+        ]
 
         return {
-            "all": all_tag_names,
-            "game": game_tag_names,
-        }
\ No newline at end of file
+            "sectors": sectors,
+            "theoretical_best_seconds": sum(s["sector_seconds"] for s in sectors) if len(sectors) > 0 else None,
+        }
+
+
+    def get_runs(filters: dict, sort: str = "date", order: str = None, cursor: str = None, limit: int = 50):
+        """
+        Returns a page of runs, with keyset pagination
+
+        :param filters: any of game, track, car, car_class, conditions (names), tags (list, runs need all of them), date_from, date_to (datetime)
+        :param sort: "date" (newest first by default) or "time" (fastest first by default)
+        :param order: "asc" or "desc", overrides the default order of the sort
+        :param cursor: next_cursor of the previous page, None for the first page
+
+        The page continues after the (sort value, id) in the cursor, so every page costs the same,
+        the ix_runs_date / ix_runs_time (and track) indexes cover the sort
+
+        { "runs": [ ... ], "next_cursor": str or None }
+        """
+
+        if sort not in ["date", "time"]:
+            raise ValueError(f"Invalid sort \"{sort}\", expected date or time")
+        if limit < 1:
+            raise ValueError("limit must be at least 1")
+        if order is None:
+            order = "desc" if sort == "date" else "asc"
+        if order not in ["asc", "desc"]:
+            raise ValueError(f"Invalid order \"{order}\", expected asc or desc")
+
+        sort_column = Run.run_date if sort == "date" else Run.runtime_seconds
+
+        conn: Connection
+        with read_engine.connect() as conn:
+            query = (
+                select(Run.id, Game.name, Track.name, Run.conditions, Car.name, Car.car_class, Run.run_date, Run.runtime_seconds)
+                .join(Game, Run.game_id == Game.id)
+                .join(Track, Run.track_id == Track.id)
+                .join(Car, Run.car_id == Car.id)
+            )
+
+            # names are resolved to ids first, so the filters are plain equalities on the indexed columns of runs
+            # (an IN over a subquery would make SQLite sort the whole match, instead of walking the index)
+            if "game" in filters:
+                query = DBHandler._filter_ids(conn, query, Run.game_id, select(Game.id).where(Game.name == filters["game"]))
+            if "track" in filters:
+                track_ids = select(Track.id).join(Game, Track.game_id == Game.id).where(Track.name == filters["track"])
+                if "game" in filters:
+                    track_ids = track_ids.where(Game.name == filters["game"])
+                query = DBHandler._filter_ids(conn, query, Run.track_id, track_ids)
+            if "car" in filters:
+                query = DBHandler._filter_ids(conn, query, Run.car_id, select(Car.id).where(Car.name == filters["car"]))
+            if "car_class" in filters:
+                query = DBHandler._filter_ids(conn, query, Run.car_id, select(Car.id).where(Car.car_class == filters["car_class"]))
+            if "conditions" in filters:
+                query = query.where(Run.conditions == filters["conditions"])
+            if "date_from" in filters:
+                query = query.where(Run.run_date >= filters["date_from"])
+            if "date_to" in filters:
+                query = query.where(Run.run_date < filters["date_to"])
+            for tag_name in filters.get("tags", []):
+                query = query.where(
+                    exists()
+                    .select_from(run_tag_table.join(Tag, run_tag_table.c.tag_id == Tag.id))
+                    .where(run_tag_table.c.run_id == Run.id, Tag.name == tag_name.lower())
+                )
+
+            # continue after the last row of the previous page
+            if cursor is not None:
+                value, run_id = DBHandler._decode_cursor(cursor, sort)
+                if order == "asc":
+                    query = query.where(tuple_(sort_column, Run.id) > tuple_(value, run_id))
+                else:
+                    query = query.where(tuple_(sort_column, Run.id) < tuple_(value, run_id))
+
+            if order == "asc":
+                query = query.order_by(sort_column.asc(), Run.id.asc())
+            else:
+                query = query.order_by(sort_column.desc(), Run.id.desc())
+
+            # one extra row, to know if there is a next page
+            rows = conn.execute(query.limit(limit + 1)).all()
+            has_next = len(rows) > limit
+            rows = rows[:limit]
+
+            # tags of the page, in a single query
+            tags = {}
+            if len(rows) > 0:
+                tag_rows = conn.execute(
+                    select(run_tag_table.c.run_id, Tag.name)
+                    .join(Tag, run_tag_table.c.tag_id == Tag.id)
+                    .where(run_tag_table.c.run_id.in_([row[0] for row in rows]))
+                ).all()
+                for run_id, tag_name in tag_rows:
+                    tags.setdefault(run_id, []).append(tag_name)
+
+        runs = [
+            {
+                "id": row[0],
+                "game": row[1],
+                "track": row[2],
+                "conditions": row[3],
+                "car": row[4],
+                "car_class": row[5],
+                "run_date": row[6].isoformat(),
+                "runtime_seconds": row[7],
+                "tags": tags.get(row[0], []),
+            }
+            for row in rows
+        ]
+
+        next_cursor = None
+        if has_next:
+            last = runs[-1]
+            next_cursor = DBHandler._encode_cursor(last["run_date"] if sort == "date" else last["runtime_seconds"], last["id"])
+
+        return { "runs": runs, "next_cursor": next_cursor }
+
+
+    def _filter_ids(conn: Connection, query, column, id_query):
+        """
+        Filters the query to the ids returned by id_query
+        """
+
+        ids = conn.execute(id_query).scalars().all()
+        if len(ids) == 1:
+            return query.where(column == ids[0])
+        return query.where(column.in_(ids))
+
+
+    def _encode_cursor(value, run_id: int) -> str:
+        return base64.urlsafe_b64encode(json.dumps([value, run_id]).encode("utf-8")).decode("ascii")
+
+
+    def _decode_cursor(cursor: str, sort: str):
+        value, run_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if sort == "date":
+            value = datetime.datetime.fromisoformat(value)
+        return value, int(run_id)
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
-from sqlalchemy import create_engine, select
+from sqlalchemy import create_engine, event, select
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 from classes.database.models.Base import Base
 from classes.database.models.Game import Game
 
@@ -9,15 +10,57 @@ from classes.database.models.Game import Game
 cwd = os.getcwd()
 db_path = os.path.join(cwd, "db.sqlite3")
 
+# connections of the read pool, API queries beyond this wait for a free one
+READ_POOL_SIZE = 4
+
+# writes go through a single connection, so they are serialized in this process, instead of retrying on SQLITE_BUSY
+# (other processes, eg. the ingestion process, still take turns through the SQLite lock and the timeout)
 engine = create_engine(
     f"sqlite:///{db_path}",
-    connect_args={"timeout": 60},
+    connect_args={"timeout": 60, "check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=1,
+    max_overflow=0,
+    pool_timeout=60,
     future=True
 )
 
+# API queries read through their own connections, opened read-only
+read_engine = create_engine(
+    f"sqlite:///file:{db_path}?mode=ro&uri=true",
+    connect_args={"timeout": 60, "check_same_thread": False},
+    poolclass=QueuePool,
+    pool_size=READ_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=60,
+    future=True
+)
+
+
+@event.listens_for(engine, "connect")
+def _on_write_connect(dbapi_connection, connection_record):
+    # WAL: readers see the last commit while a write is going on, and never block it
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+@event.listens_for(read_engine, "connect")
+def _on_read_connect(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=1")
+    cursor.close()
+
+
 # create table if missing
 Base.metadata.create_all(engine)
 
+# create_all only creates indexes together with new tables, add the ones that are missing from existing tables
+for table in Base.metadata.sorted_tables:
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+
 # add default contents
 session: Session
 with Session(engine) as session:
@@ -29,4 +72,4 @@ with Session(engine) as session:
     if game is None:
         game = Game(name="DirtRally2")
         session.add(game)
-        session.commit()
\ No newline at end of file
+        session.commit()
@@ -0,0 +1,105 @@
+from threading import Lock
+from typing import Dict, List, Tuple
+
+from classes.database.DBHandler import DBHandler
+
+
+class IdentificationCache:
+    """
+    The car and track corrections of the user (IdentificationCorrection), kept in memory,
+    so the identification of a run checks them before the static tables of the game.
+
+    Per game:
+    - cars: fingerprint (eg. max rpm, idle rpm, gears) -> (name, class), a dict lookup
+    - tracks: track length -> [ (start z, name) ], the closest start within TRACK_START_TOLERANCE wins
+      (the start position varies a little between runs)
+
+    A game is loaded on first use (or by load(), at startup), record_car() / record_track() update the DB and the cache.
+    """
+
+    TRACK_START_TOLERANCE = 25.0  # meters
+
+    # class (static) variables
+    _lock: Lock = Lock()
+    _games: Dict[str, dict] = {}
+
+
+
+    def load(game_name: str, reload: bool = False) -> None:
+        """
+        Reads the corrections of a game from the DB (if they are not loaded yet, or reload is set)
+        """
+
+        if game_name in IdentificationCache._games and not reload:
+            return
+
+        cars = {}
+        tracks = {}
+        for correction in DBHandler.get_identification_corrections(game_name):
+            if correction["kind"] == "car":
+                cars[tuple(correction["fingerprint"])] = (correction["name"], correction["car_class"])
+            elif correction["kind"] == "track":
+                length, start_z = correction["fingerprint"]
+                tracks.setdefault(length, []).append((start_z, correction["name"]))
+
+        with IdentificationCache._lock:
+            IdentificationCache._games[game_name] = { "car": cars, "track": tracks }
+
+
+
+    def find_car(game_name: str, fingerprint: Tuple[float, ...]) -> Tuple[str, str]:
+        """
+        Returns the (name, class) the user picked for the fingerprint, None if there is no correction
+        """
+        return IdentificationCache._get(game_name)["car"].get(tuple(fingerprint))
+
+
+
+    def find_track(game_name: str, length: float, start_z: float) -> str:
+        """
+        Returns the track the user picked for the length and start z, None if there is no correction
+        """
+
+        candidates = IdentificationCache._get(game_name)["track"].get(length)
+        if candidates is None or start_z is None:
+            return None
+
+        distance, name = min((abs(z - start_z), name) for z, name in candidates)
+        return name if distance <= IdentificationCache.TRACK_START_TOLERANCE else None
+
+
+
+    def record_car(game_name: str, fingerprint: Tuple[float, ...], name: str, car_class: str) -> None:
+        """
+        Saves the car the user picked for a fingerprint
+        """
+
+        DBHandler.save_identification_correction(game_name, "car", list(fingerprint), name, car_class)
+        with IdentificationCache._lock:
+            IdentificationCache._get(game_name)["car"][tuple(fingerprint)] = (name, car_class)
+
+
+
+    def record_track(game_name: str, length: float, start_z: float, name: str) -> None:
+        """
+        Saves the track the user picked for a length and start z (replaces the correction with the closest start, if in tolerance)
+        """
+
+        with IdentificationCache._lock:
+            candidates: List[tuple] = IdentificationCache._get(game_name)["track"].setdefault(length, [])
+            close = [i for i, (z, _) in enumerate(candidates) if abs(z - start_z) <= IdentificationCache.TRACK_START_TOLERANCE]
+            if len(close) > 0:
+                i = min(close, key=lambda i: abs(candidates[i][0] - start_z))
+                start_z = candidates[i][0]
+                candidates[i] = (start_z, name)
+            else:
+                candidates.append((start_z, name))
+
+        DBHandler.save_identification_correction(game_name, "track", [length, start_z], name)
+
+
+
+    def _get(game_name: str) -> dict:
+        if game_name not in IdentificationCache._games:
+            IdentificationCache.load(game_name)
+        return IdentificationCache._games[game_name]
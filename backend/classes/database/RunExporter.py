@@ -0,0 +1,190 @@
+import csv
+import datetime
+import io
+import json
+from typing import Iterator, List
+
+from sqlalchemy import exists, func, select
+from sqlalchemy.sql import Select
+
+from classes.database.DbEngine import read_engine
+from classes.database.models.Car import Car
+from classes.database.models.Game import Game
+from classes.database.models.Run import Run, Tag, run_tag_table
+from classes.database.models.Track import Track
+
+# parquet export is optional, it needs pyarrow
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class RunExporter:
+    """
+    Streams runs (joined with their game, track, car and tags) as CSV, NDJSON or Parquet.
+
+    Rows are read with a server-side cursor in CHUNK_SIZE chunks, and each chunk is encoded and yielded right away,
+    so memory use does not depend on the size of the database.
+    Filters are applied in SQL.
+    """
+
+    FORMATS = ["csv", "ndjson", "parquet"]
+    CONTENT_TYPES = {
+        "csv": "text/csv",
+        "ndjson": "application/x-ndjson",
+        "parquet": "application/vnd.apache.parquet",
+    }
+    COLUMNS = ["id", "game", "track", "conditions", "car", "car_class", "run_date", "runtime_seconds", "tags"]
+    CHUNK_SIZE = 5000
+
+
+
+    def build_query(game_name: str = None, track_name: str = None, date_from: datetime.datetime = None, date_to: datetime.datetime = None, tag_name: str = None) -> Select:
+        """
+        Returns the export query, with the given filters
+        """
+
+        # tags are concatenated per run, so every run is a single row
+        tags = (
+            select(func.group_concat(Tag.name, ","))
+            .select_from(run_tag_table.join(Tag, run_tag_table.c.tag_id == Tag.id))
+            .where(run_tag_table.c.run_id == Run.id)
+            .scalar_subquery()
+        )
+
+        query = (
+            select(
+                Run.id,
+                Game.name,
+                Track.name,
+                Run.conditions,
+                Car.name,
+                Car.car_class,
+                Run.run_date,
+                Run.runtime_seconds,
+                tags,
+            )
+            .join(Game, Run.game_id == Game.id)
+            .join(Track, Run.track_id == Track.id)
+            .join(Car, Run.car_id == Car.id)
+            .order_by(Run.id)
+        )
+
+        if game_name is not None:
+            query = query.where(Game.name == game_name)
+        if track_name is not None:
+            query = query.where(Track.name == track_name)
+        if date_from is not None:
+            query = query.where(Run.run_date >= date_from)
+        if date_to is not None:
+            query = query.where(Run.run_date < date_to)
+        if tag_name is not None:
+            query = query.where(
+                exists()
+                .select_from(run_tag_table.join(Tag, run_tag_table.c.tag_id == Tag.id))
+                .where(run_tag_table.c.run_id == Run.id, Tag.name == tag_name.lower())
+            )
+
+        return query
+
+
+
+    def export(output_format: str, query: Select) -> Iterator[bytes]:
+        """
+        Returns a generator, that yields the encoded runs in chunks
+        """
+
+        if output_format == "csv":
+            return RunExporter._encode_csv(RunExporter._read_chunks(query))
+        if output_format == "ndjson":
+            return RunExporter._encode_ndjson(RunExporter._read_chunks(query))
+        if output_format == "parquet":
+            if pyarrow is None:
+                raise RuntimeError("Parquet export needs the pyarrow package")
+            return RunExporter._encode_parquet(RunExporter._read_chunks(query))
+
+        raise ValueError(f"Invalid format \"{output_format}\", expected one of {RunExporter.FORMATS}")
+
+
+
+    def _read_chunks(query: Select) -> Iterator[List[tuple]]:
+        """
+        Reads the query results with a server-side cursor, CHUNK_SIZE rows at a time
+        """
+
+        with read_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=RunExporter.CHUNK_SIZE).execute(query)
+            for chunk in result.partitions(RunExporter.CHUNK_SIZE):
+                yield chunk
+
+
+
+    def _encode_csv(chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        writer.writerow(RunExporter.COLUMNS)
+        for chunk in chunks:
+            writer.writerows(
+                row[:6] + (row[6].isoformat(), row[7], row[8] or "") for row in chunk
+            )
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+        # header only, if there were no rows
+        if buffer.tell() > 0:
+            yield buffer.getvalue().encode("utf-8")
+
+
+
+    def _encode_ndjson(chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+        for chunk in chunks:
+            lines = []
+            for row in chunk:
+                record = dict(zip(RunExporter.COLUMNS, row))
+                record["run_date"] = row[6].isoformat()
+                record["tags"] = row[8].split(",") if row[8] else []
+                lines.append(json.dumps(record))
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+
+    def _encode_parquet(chunks: Iterator[List[tuple]]) -> Iterator[bytes]:
+        """
+        Each chunk is written as a row group, the bytes written so far are yielded after each one
+        """
+
+        schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("game", pyarrow.string()),
+            ("track", pyarrow.string()),
+            ("conditions", pyarrow.string()),
+            ("car", pyarrow.string()),
+            ("car_class", pyarrow.string()),
+            ("run_date", pyarrow.timestamp("us")),
+            ("runtime_seconds", pyarrow.float64()),
+            ("tags", pyarrow.list_(pyarrow.string())),
+        ])
+
+        sink = io.BytesIO()
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+
+        def drain():
+            data = sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+            return data
+
+        for chunk in chunks:
+            columns = [list(column) for column in zip(*chunk)]
+            columns[8] = [tags.split(",") if tags else [] for tags in columns[8]]
+            writer.write_table(pyarrow.Table.from_arrays(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+            ))
+            yield drain()
+
+        writer.close()
+        yield drain()
@@ -0,0 +1,272 @@
+import csv
+import datetime
+import sqlite3
+from typing import Callable, Dict, Iterator
+
+from sqlalchemy import DateTime, bindparam, insert, select, text
+from sqlalchemy.engine import Connection
+
+from classes.database.DbEngine import engine
+from classes.database.models.Car import Car
+from classes.database.models.Game import Game
+from classes.database.models.Run import Tag
+from classes.database.models.Track import Track
+from classes.game.GameDirtRally2 import DirtRally2CarList, DirtRally2TrackList
+
+
+class RunImporter:
+    """
+    Streams historical Dirt Rally 2 times from other loggers into the database.
+
+    Formats:
+    - dtr: the SQLite database of dirt-rally-time-recorder (laptimes, tracks and cars tables)
+    - csv: a CSV file with a header row. Columns (case insensitive):
+        - date: unix timestamp or ISO date
+        - time: run time in seconds
+        - track, or track_length and start_z
+        - car, or max_rpm, idle_rpm and max_gears
+        - car_class, conditions (optional)
+
+    Tracks and cars are identified with DirtRally2TrackList / DirtRally2CarList when their fingerprints are available,
+    rows are read one by one, and inserted in BATCH_SIZE transactions.
+    Rows that match an existing run (same game, track, car, date and time) are skipped, so imports can be repeated.
+    """
+
+    FORMATS = ["dtr", "csv"]
+    BATCH_SIZE = 10000
+    GAME_NAME = "DirtRally2"
+
+    # inserts the run, unless the same run already exists (uses ix_runs_dedupe)
+    _insert_run = text("""
+        INSERT INTO runs (conditions, run_date, runtime_seconds, game_id, track_id, car_id)
+        SELECT :conditions, :run_date, :runtime_seconds, :game_id, :track_id, :car_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM runs
+            WHERE game_id = :game_id AND track_id = :track_id AND car_id = :car_id
+            AND run_date = :run_date AND runtime_seconds = :runtime_seconds
+        )
+    """).bindparams(bindparam("run_date", type_=DateTime()))
+
+
+
+    def import_runs(path: str, source_format: str, tag: str = None, progress: Callable = None) -> Dict[str, int]:
+        """
+        Imports the runs of a file
+
+        :param tag: tag to add to the imported runs (optional)
+        :param progress: called with the counters after each batch (optional)
+
+        Returns the counters: { "read", "inserted", "skipped" }
+        """
+
+        if source_format == "dtr":
+            rows = RunImporter._read_dtr(path)
+        elif source_format == "csv":
+            rows = RunImporter._read_csv(path)
+        else:
+            raise ValueError(f"Invalid format \"{source_format}\", expected one of {RunImporter.FORMATS}")
+
+        counters = { "read": 0, "inserted": 0, "skipped": 0 }
+        track_ids = {}
+        car_ids = {}
+
+        with engine.connect() as conn:
+            game_id = conn.execute(
+                select(Game.id).where(Game.name == RunImporter.GAME_NAME)
+            ).scalar_one()
+            tag_id = RunImporter._get_tag_id(conn, tag) if tag is not None else None
+            conn.commit()
+
+        # the writer connection is taken for each batch, so the runs saved meanwhile don't wait for the whole import
+        batch = []
+        for row in rows:
+            counters["read"] += 1
+            batch.append(row)
+
+            if len(batch) == RunImporter.BATCH_SIZE:
+                with engine.connect() as conn:
+                    RunImporter._insert_batch(conn, batch, game_id, tag_id, track_ids, car_ids, counters)
+                batch = []
+                if progress is not None:
+                    progress(counters)
+
+        if len(batch) > 0:
+            with engine.connect() as conn:
+                RunImporter._insert_batch(conn, batch, game_id, tag_id, track_ids, car_ids, counters)
+            if progress is not None:
+                progress(counters)
+
+        return counters
+
+
+
+    def _insert_batch(conn: Connection, batch, game_id, tag_id, track_ids, car_ids, counters) -> None:
+        """
+        Inserts a batch of rows in a single transaction
+        """
+
+        params = []
+        for row in batch:
+            params.append({
+                "conditions": row.get("conditions"),
+                "run_date": row["run_date"],
+                "runtime_seconds": row["runtime_seconds"],
+                "game_id": game_id,
+                "track_id": RunImporter._get_track_id(conn, game_id, row["track"], track_ids),
+                "car_id": RunImporter._get_car_id(conn, game_id, row["car"], row.get("car_class"), car_ids),
+            })
+
+        # the writer lock is held for the whole transaction, so every run after max_id is from this batch
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM runs")).scalar_one()
+        conn.execute(RunImporter._insert_run, params)
+        inserted = conn.execute(text("SELECT COUNT(*) FROM runs WHERE id > :max_id"), { "max_id": max_id }).scalar_one()
+
+        if tag_id is not None and inserted > 0:
+            conn.execute(
+                text("INSERT OR IGNORE INTO run_tags (run_id, tag_id) SELECT id, :tag_id FROM runs WHERE id > :max_id"),
+                { "tag_id": tag_id, "max_id": max_id }
+            )
+
+        conn.commit()
+
+        counters["inserted"] += inserted
+        counters["skipped"] += len(batch) - inserted
+
+
+
+    def _get_track_id(conn: Connection, game_id: int, name: str, cache: dict) -> int:
+        """
+        Returns the id of a track, creates it if it does not exist
+        """
+
+        if name not in cache:
+            track_id = conn.execute(
+                select(Track.id).where(Track.name == name, Track.game_id == game_id)
+            ).scalar()
+            if track_id is None:
+                track_id = conn.execute(
+                    insert(Track.__table__).values(name=name, game_id=game_id)
+                ).inserted_primary_key[0]
+            cache[name] = track_id
+
+        return cache[name]
+
+
+
+    def _get_car_id(conn: Connection, game_id: int, name: str, car_class: str, cache: dict) -> int:
+        """
+        Returns the id of a car, creates it if it does not exist
+        """
+
+        if name not in cache:
+            car_id = conn.execute(
+                select(Car.id).where(Car.name == name, Car.game_id == game_id)
+            ).scalar()
+            if car_id is None:
+                car_id = conn.execute(
+                    insert(Car.__table__).values(name=name, game_id=game_id, car_class=car_class)
+                ).inserted_primary_key[0]
+            cache[name] = car_id
+
+        return cache[name]
+
+
+
+    def _get_tag_id(conn: Connection, name: str) -> int:
+        """
+        Returns the id of a tag, creates it if it does not exist
+        """
+
+        tag_id = conn.execute(select(Tag.id).where(Tag.name == name.lower())).scalar()
+        if tag_id is None:
+            tag_id = conn.execute(insert(Tag.__table__).values(name=name.lower())).inserted_primary_key[0]
+        return tag_id
+
+
+
+    def _read_dtr(path: str) -> Iterator[dict]:
+        """
+        Reads the laptimes of a dirt-rally-time-recorder database, row by row
+        """
+
+        track_list = DirtRally2TrackList()
+        car_list = DirtRally2CarList()
+
+        source = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        source.row_factory = sqlite3.Row
+        try:
+            # the track and car tables are small, the laptimes are streamed
+            tracks = { row["id"]: dict(row) for row in source.execute("SELECT * FROM tracks") }
+            cars = { row["id"]: dict(row) for row in source.execute("SELECT * FROM cars") }
+
+            for row in source.execute("SELECT Track, Car, Timestamp, Time FROM laptimes"):
+                track = tracks.get(row["Track"], {})
+                car = cars.get(row["Car"], {})
+
+                track_name = track_list.indentify_track(track.get("length"), track.get("startz"))
+                if track_name == "Unknown":
+                    track_name = track.get("name") or "Unknown"
+
+                car_name, car_class = car_list.indentify_car(car.get("maxrpm"), car.get("idlerpm"), car.get("topgear"))
+                if car_name == "Unknown":
+                    car_name = car.get("name") or "Unknown"
+                    car_class = None
+
+                yield {
+                    "run_date": datetime.datetime.fromtimestamp(row["Timestamp"]),
+                    "runtime_seconds": row["Time"],
+                    "track": track_name,
+                    "car": car_name,
+                    "car_class": car_class,
+                }
+        finally:
+            source.close()
+
+
+
+    def _read_csv(path: str) -> Iterator[dict]:
+        """
+        Reads a CSV file, row by row
+        """
+
+        track_list = DirtRally2TrackList()
+        car_list = DirtRally2CarList()
+
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+
+            for row in reader:
+                if row.get("track"):
+                    track_name = row["track"]
+                else:
+                    track_name = track_list.indentify_track(float(row["track_length"]), float(row["start_z"]))
+
+                car_class = row.get("car_class") or None
+                if row.get("car"):
+                    car_name = row["car"]
+                else:
+                    car_name, car_class = car_list.indentify_car(
+                        float(row["max_rpm"]), float(row["idle_rpm"]), float(row["max_gears"])
+                    )
+
+                yield {
+                    "run_date": RunImporter._parse_date(row["date"]),
+                    "runtime_seconds": float(row["time"]),
+                    "track": track_name,
+                    "car": car_name,
+                    "car_class": car_class,
+                    "conditions": row.get("conditions") or None,
+                }
+
+
+
+    def _parse_date(value: str) -> datetime.datetime:
+        """
+        Parses a unix timestamp or an ISO date
+        """
+
+        try:
+            return datetime.datetime.fromtimestamp(float(value))
+        except ValueError:
+            return datetime.datetime.fromisoformat(value)
@@ -0,0 +1,134 @@
+import datetime
+from typing import Callable, Dict
+
+import numpy as np
+
+from classes.database.AttributeSearch import AttributeSearch
+from classes.database.DBHandler import DBHandler
+from classes.game.GameHandler import GameHandlerState
+from classes.game.GameWrapper import GameWrapper
+from classes.telemetry.PacketCapture import PacketCapture
+from classes.telemetry.TelemetryStore import TelemetryStore
+
+
+class RunReprocessor:
+    """
+    Detects the runs of recorded sessions again, offline, and rebuilds their rows in the runs table.
+
+    Captures (see PacketCapture) are read as memory maps, and the runs are found by the detect_runs() of their game,
+    on the whole capture at once. Finished runs are matched to the saved runs of the game by date
+    (at most MATCH_SECONDS apart, the closest one wins):
+    - no saved run: the run is saved, with its splits (and the tag, if given)
+    - saved run with a 0 time (the 00:00:000 results): its time is replaced
+    - otherwise the saved run is kept as it is (the user may have edited it)
+
+    Nothing changes on a second pass, so reprocessing can be repeated.
+    The telemetry of saved runs only covers the running packets, so it can only fix 0 times (see fix_times_from_telemetry).
+    """
+
+    MATCH_SECONDS = 2.0
+
+
+
+    def reprocess(path: str, tag: str = None, dry_run: bool = False, progress: Callable = None) -> Dict[str, int]:
+        """
+        Reprocesses a capture, or every capture under a directory (eg. captures/DirtRally2/2024-05-01)
+
+        :param tag: tag to add to the inserted runs (optional)
+        :param dry_run: only count, don't change the database
+        :param progress: called with the counters after each capture (optional)
+
+        Returns the counters: { "captures", "packets", "runs", "finished", "inserted", "fixed", "unchanged" }
+        """
+
+        counters = { "captures": 0, "packets": 0, "runs": 0, "finished": 0, "inserted": 0, "fixed": 0, "unchanged": 0 }
+
+        for capture_path in PacketCapture.list_captures(path):
+            RunReprocessor._reprocess_capture(capture_path, tag, dry_run, counters)
+            if progress is not None:
+                progress(counters)
+
+        return counters
+
+
+
+    def fix_times_from_telemetry(dry_run: bool = False) -> Dict[str, int]:
+        """
+        Replaces the 0 times of the saved runs that have telemetry with the last lap_time of the recording
+
+        Returns the counters: { "runs" (with a 0 time), "fixed" }
+        """
+
+        run_ids = DBHandler.get_runs_without_time()
+        counters = { "runs": len(run_ids), "fixed": 0 }
+
+        for run_id in run_ids:
+            if not TelemetryStore.has_run(run_id) or "lap_time" not in TelemetryStore.read_meta(run_id)["channels"]:
+                continue
+
+            lap_time = TelemetryStore.load_channels(run_id, ["lap_time"])["lap_time"]
+            if len(lap_time) == 0 or lap_time[-1] <= 0:
+                continue
+
+            if not dry_run:
+                DBHandler.set_run_time(run_id, float(lap_time[-1]))
+            counters["fixed"] += 1
+
+        return counters
+
+
+
+    def _reprocess_capture(path: str, tag: str, dry_run: bool, counters: Dict[str, int]) -> None:
+        """
+        Detects the runs of a capture, and saves or fixes the finished ones
+        """
+
+        meta, times, values = PacketCapture.read(path)
+        counters["captures"] += 1
+        counters["packets"] += len(times)
+        if len(times) == 0:
+            return
+
+        game_name = meta["game_name"]
+        runs = GameWrapper._get_game_class(game_name).detect_runs(times, values)
+        counters["runs"] += len(runs)
+
+        finished = [run_data for state, run_data in runs if state == GameHandlerState.FINISHED]
+        counters["finished"] += len(finished)
+        if len(finished) == 0:
+            return
+
+        # the saved runs of the whole capture are read at once, and matched by the closest date
+        margin = datetime.timedelta(seconds=RunReprocessor.MATCH_SECONDS)
+        saved = DBHandler.get_runs_between(game_name, finished[0].run_date - margin, finished[-1].run_date + margin)
+        saved_dates = np.array([run["run_date"].timestamp() for run in saved])
+
+        for run_data in finished:
+            match = None
+            if len(saved) > 0:
+                date = run_data.run_date.timestamp()
+                position = np.searchsorted(saved_dates, date)
+                closest = min(
+                    (i for i in [position - 1, position] if 0 <= i < len(saved)),
+                    key=lambda i: abs(saved_dates[i] - date)
+                )
+                if abs(saved_dates[closest] - date) <= RunReprocessor.MATCH_SECONDS:
+                    match = saved[closest]
+
+            if match is None:
+                if tag is not None:
+                    run_data.tags = [tag]
+                if not dry_run:
+                    DBHandler.save_run(run_data)
+                counters["inserted"] += 1
+
+            elif not match["runtime_seconds"] and run_data.run_time_sec > 0:
+                if not dry_run:
+                    DBHandler.set_run_time(match["id"], run_data.run_time_sec)
+                counters["fixed"] += 1
+
+            else:
+                counters["unchanged"] += 1
+
+        if not dry_run and counters["inserted"] > 0:
+            AttributeSearch.invalidate(game_name)
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy.orm import relationship
+from . import Base
+
+
+class IdentificationCorrection(Base):
+    """
+    A car or track the user picked, after the game data identified it as something else (or could not identify it)
+    """
+
+    __tablename__ = "identification_corrections"
+    __table_args__ = (
+        UniqueConstraint("game_id", "kind", "fingerprint"),
+        {"sqlite_autoincrement": True}
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False) # "car" or "track"
+    fingerprint = Column(String, nullable=False) # JSON list of the values the identification used (eg. max rpm, idle rpm, gears)
+    name = Column(String, nullable=False)
+    car_class = Column(String)
+    updated_date = Column(DateTime, nullable=False)
+
+    game_id = Column(Integer, ForeignKey("games.id"), nullable=False)
+
+    game = relationship("Game")
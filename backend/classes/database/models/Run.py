@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Table, UniqueConstraint
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, Table, UniqueConstraint
 from sqlalchemy.orm import relationship
 from . import Base
 
@@ -14,7 +14,16 @@ run_tag_table = Table(
 
 class Run(Base):
     __tablename__ = "runs"
-    __table_args__ = {"sqlite_autoincrement": True}
+    __table_args__ = (
+        # duplicate check of imported runs
+        Index("ix_runs_dedupe", "game_id", "track_id", "car_id", "run_date"),
+        # keyset pagination of the run history, by date and by time (optionally on a track)
+        Index("ix_runs_date", "run_date", "id"),
+        Index("ix_runs_time", "runtime_seconds", "id"),
+        Index("ix_runs_track_date", "track_id", "run_date", "id"),
+        Index("ix_runs_track_time", "track_id", "runtime_seconds", "id"),
+        {"sqlite_autoincrement": True}
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     conditions = Column(String)
@@ -29,6 +38,7 @@ class Run(Base):
     track = relationship("Track", back_populates="runs")
     car = relationship("Car", back_populates="runs")
     tags = relationship("Tag", secondary=run_tag_table, back_populates="runs")
+    splits = relationship("RunSplit", back_populates="run", order_by="RunSplit.sector")
 
 
 class Tag(Base):
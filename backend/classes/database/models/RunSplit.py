@@ -0,0 +1,28 @@
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, UniqueConstraint
+from sqlalchemy.orm import relationship
+from . import Base
+
+
+class RunSplit(Base):
+    __tablename__ = "run_splits"
+    __table_args__ = (
+        UniqueConstraint("run_id", "sector"),
+        # best sector queries, per track and per track & car
+        Index("ix_run_splits_track_sector", "track_id", "sector", "sector_seconds"),
+        Index("ix_run_splits_track_car_sector", "track_id", "car_id", "sector", "sector_seconds"),
+        {"sqlite_autoincrement": True}
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    sector = Column(Integer, nullable=False) # 1 based
+    split_seconds = Column(Float, nullable=False) # time from the start, at the end of the sector
+    sector_seconds = Column(Float, nullable=False) # time spent in the sector
+
+    run_id = Column(Integer, ForeignKey("runs.id"), nullable=False)
+    # copied from the run, so best sector queries don't need to join the runs table
+    track_id = Column(Integer, ForeignKey("tracks.id"), nullable=False)
+    car_id = Column(Integer, ForeignKey("cars.id"), nullable=False)
+
+    run = relationship("Run", back_populates="splits")
+    track = relationship("Track")
+    car = relationship("Car")
@@ -5,5 +5,7 @@ from . import (
     Game,
     Track,
     Car,
-    Run
+    Run,
+    RunSplit,
+    IdentificationCorrection
 )
\ No newline at end of file
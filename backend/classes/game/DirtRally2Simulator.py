@@ -0,0 +1,360 @@
+from typing import Iterator, List, Tuple
+import datetime
+import os
+import socket
+import threading
+import time
+
+import numpy as np
+
+from classes.base.AppSettings import AppSettings
+from classes.database.DBHandler import DBHandler
+from classes.game.GameDirtRally2 import DirtRally2CarList, DirtRally2Fields, DirtRally2TrackList
+from classes.game.GameWrapper import GameWrapper
+
+
+class DirtRally2Simulator:
+    """
+    Generates synthetic Dirt Rally 2 packet streams (in the DirtRally2Fields layout), for load and soak testing without the game.
+
+    A session is a series of attempts on one stage, with one car (like restarting the same stage over and over):
+    - the track length and start z, and the car RPM / gear fingerprint come from DirtRally2TrackList and DirtRally2CarList,
+      so AUTO-DETECT identifies them
+    - distance and lap_time grow monotonically, the speed is a bounded random walk, the gear, RPM, position,
+      velocity and g-forces follow from it, the sector times are set when a third / two thirds of the stage are passed
+    - each attempt ends with a finish (laps_completed = 1, last_lap_time set), an in-game restart (the stage starts over),
+      or an abort (quit to the menu, the packets stop for a while)
+    - before and after each attempt the game keeps sending packets with lap_time 0, like the real game does
+
+    rate is the number of packets sent per second, speed is the game seconds per second (so the game time between two packets is speed / rate).
+    """
+
+    OUTCOMES = ["finish", "restart", "abort"]
+    TAG = "simulated"  # tag of the runs saved by check()
+
+    IDLE_SECONDS = 0.5  # packets with lap_time 0, before the start and after the end of an attempt (wall time)
+    ABORT_PAUSE_SECONDS = 1.0  # no packets after an abort (wall time)
+    SAVE_TIMEOUT_SECONDS = 10.0  # wait for the saves after the last packet, at most
+    BLOCK_SIZE = 4096  # packets generated at once
+    MIN_SPEED = 8.0  # m/s
+    MAX_SPEED = 45.0
+
+
+
+    def plan_session(runs: int, abort_share: float = 0.1, restart_share: float = 0.1, seed: int = None) -> dict:
+        """
+        Picks a stage, a car and the outcome of each attempt
+
+        { "track": (name, length, start_z), "car": (name, class, max_rpm, idle_rpm, max_gears), "outcomes": [ outcome ], "seed": int }
+        """
+
+        if seed is None:
+            seed = int.from_bytes(os.urandom(4), "little")
+        rng = np.random.default_rng(seed)
+
+        tracks = [(name, length, start_z) for length, candidates in DirtRally2TrackList().track_dict.items() for start_z, name in candidates]
+        cars = [(name, car_class, max_rpm, idle_rpm, max_gears) for (max_rpm, idle_rpm, max_gears), (name, car_class) in DirtRally2CarList().car_dict.items()]
+
+        finish_share = max(0.0, 1.0 - abort_share - restart_share)
+        outcomes = rng.choice(DirtRally2Simulator.OUTCOMES, size=runs, p=np.array([finish_share, restart_share, abort_share]) / (finish_share + restart_share + abort_share))
+
+        return {
+            "track": tracks[rng.integers(len(tracks))],
+            "car": cars[rng.integers(len(cars))],
+            "outcomes": [str(outcome) for outcome in outcomes],
+            "seed": seed,
+        }
+
+
+
+    def generate(plan: dict, rate: float, speed: float = 1.0) -> Iterator[Tuple[np.ndarray, float]]:
+        """
+        Yields the packets of a session, in blocks: (float32 array [packets, len(DirtRally2Fields)], pause in seconds before the block)
+
+        The expected result of each attempt is appended to plan["expected"] as it is generated:
+        { "outcome", "track", "car", "car_class", "time" (the stage time, 0 if not finished) }
+        """
+
+        rng = np.random.default_rng(plan["seed"] + 1)
+        track_name, track_length, start_z = plan["track"]
+        car_name, car_class, max_rpm, idle_rpm, max_gears = plan["car"]
+        plan["expected"] = []
+
+        dt = speed / rate
+        idle_packets = max(int(DirtRally2Simulator.IDLE_SECONDS * rate), 5)
+        game_time = 0.0  # run_time keeps growing over the whole session
+
+        # the same fields in every packet
+        static = np.zeros(len(DirtRally2Fields), dtype=np.float32)
+        static[DirtRally2Fields.total_laps.value] = 1
+        static[DirtRally2Fields.track_length.value] = track_length
+        static[DirtRally2Fields.max_rpm.value] = max_rpm
+        static[DirtRally2Fields.idle_rpm.value] = idle_rpm
+        static[DirtRally2Fields.max_gears.value] = max_gears
+        static[DirtRally2Fields.pos_z.value] = start_z
+        static[DirtRally2Fields.rpm.value] = idle_rpm
+        static[DirtRally2Fields.gear.value] = 1
+        static[DirtRally2Fields.brakes_temp_rl.value:DirtRally2Fields.brakes_temp_fr.value + 1] = 150
+
+        pause = 0.0
+        for outcome in plan["outcomes"]:
+            # waiting at the start line
+            block = np.tile(static, (idle_packets, 1))
+            block[:, DirtRally2Fields.run_time.value] = game_time + np.arange(idle_packets) * dt
+            game_time += idle_packets * dt
+            yield block, pause
+            pause = 0.0
+
+            end_distance = track_length if outcome == "finish" else track_length * rng.uniform(0.05, 0.9)
+            stage = DirtRally2Simulator._drive(rng, static, end_distance, track_length, dt, game_time)
+            last = None
+            for block in stage:
+                last = block[-1]
+                game_time = float(last[DirtRally2Fields.run_time.value])
+                yield block, 0.0
+
+            # the end of the attempt, and the game idling after it
+            stage_time = float(last[DirtRally2Fields.lap_time.value])
+            block = np.tile(static, (idle_packets, 1))
+            block[:, DirtRally2Fields.run_time.value] = game_time + np.arange(1, idle_packets + 1) * dt
+            block[:, DirtRally2Fields.pos_x.value] = last[DirtRally2Fields.pos_x.value]
+            block[:, DirtRally2Fields.pos_y.value] = last[DirtRally2Fields.pos_y.value]
+            block[:, DirtRally2Fields.pos_z.value] = last[DirtRally2Fields.pos_z.value]
+            if outcome == "finish":
+                block[:, DirtRally2Fields.distance.value] = last[DirtRally2Fields.distance.value]
+                block[:, DirtRally2Fields.progress.value] = 1
+                block[:, DirtRally2Fields.laps_completed.value] = 1
+                block[:, DirtRally2Fields.last_lap_time.value] = stage_time
+                block[:, DirtRally2Fields.sector.value] = 2
+                block[:, DirtRally2Fields.sector_1_time.value] = last[DirtRally2Fields.sector_1_time.value]
+                block[:, DirtRally2Fields.sector_2_time.value] = last[DirtRally2Fields.sector_2_time.value]
+            game_time += idle_packets * dt
+            yield block, 0.0
+
+            if outcome == "abort":
+                pause = DirtRally2Simulator.ABORT_PAUSE_SECONDS
+
+            plan["expected"].append({
+                "outcome": outcome,
+                "track": track_name,
+                "car": car_name,
+                "car_class": car_class,
+                # the time is saved as it was sent, a float32
+                "time": float(np.float32(stage_time)) if outcome == "finish" else 0.0,
+            })
+
+
+
+    def send(blocks: Iterator[Tuple[np.ndarray, float]], address: Tuple[str, int], rate: float) -> dict:
+        """
+        Sends the packets to address, paced to rate packets per second
+
+        Returns { "packets", "seconds", "rate" (achieved), "cpu_seconds" (of the sending thread) }
+        """
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        packet_size = len(DirtRally2Fields) * 4
+        sent = 0
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        next_time = start
+
+        try:
+            for block, pause in blocks:
+                if pause > 0:
+                    time.sleep(pause)
+                    next_time = time.perf_counter()
+
+                data = memoryview(block.astype("<f4", copy=False).tobytes())
+                for i in range(len(block)):
+                    # sleep only when ahead by more than a millisecond, shorter sleeps are not precise
+                    ahead = next_time - time.perf_counter()
+                    if ahead > 0.001:
+                        time.sleep(ahead)
+                    sock.sendto(data[i * packet_size:(i + 1) * packet_size], address)
+                    next_time += 1 / rate
+                    sent += 1
+        finally:
+            sock.close()
+
+        seconds = time.perf_counter() - start
+        return {
+            "packets": sent,
+            "seconds": seconds,
+            "rate": sent / seconds if seconds > 0 else 0,
+            "cpu_seconds": time.thread_time() - cpu_start,
+        }
+
+
+
+    def check(plan: dict, rate: float, speed: float = 1.0) -> dict:
+        """
+        Runs a session in this process (AUTO-DETECT, auto-save and auto-restart, the runs are tagged TAG),
+        streams the plan to it, and compares the saved runs to the expected ones
+
+        Returns the send() stats, and:
+        - cpu_per_packet: CPU seconds of the backend per packet sent (this process without the sender, plus the ingestion process if it is used)
+        - expected / saved: the finished attempts, and the runs saved
+        - errors: the differences, and a session still running after it was stopped
+        """
+
+        game_settings = AppSettings().read_setting("game_settings")["DirtRally2"]
+        host = game_settings.get("udp_bind_address", "127.0.0.1")
+        address = ("127.0.0.1" if host == "0.0.0.0" else host, game_settings["udp_port"])
+
+        started = datetime.datetime.now()
+        result = GameWrapper.start_run({
+            "game_name": "DirtRally2",
+            "track": "AUTO-DETECT",
+            "car": "AUTO-DETECT",
+            "tags": [DirtRally2Simulator.TAG],
+            "auto_save_enabled": True,
+            "auto_restart_enabled": True,
+        })
+        if result != "ok":
+            raise RuntimeError(result)
+
+        times_start = os.times()
+        stats = {}
+        sender = threading.Thread(target=lambda: stats.update(DirtRally2Simulator.send(DirtRally2Simulator.generate(plan, rate, speed), address, rate)), name="simulator")
+        sender.start()
+        sender.join()
+
+        # the last run is saved after its end is seen, stopping before that would discard it
+        expected = [run for run in plan["expected"] if run["outcome"] == "finish"]
+        deadline = time.monotonic() + DirtRally2Simulator.SAVE_TIMEOUT_SECONDS
+        while len(expected) > 0 and len(DirtRally2Simulator._saved_runs(started, len(expected))) < len(expected) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        session = GameWrapper.sessions.get("")
+        GameWrapper.stop_run("")
+        times_end = os.times()
+
+        cpu = (times_end.user - times_start.user) + (times_end.system - times_start.system) - stats["cpu_seconds"]
+        cpu += (times_end.children_user - times_start.children_user) + (times_end.children_system - times_start.children_system)
+        stats["cpu_per_packet"] = cpu / max(stats["packets"], 1)
+
+        saved = DirtRally2Simulator._saved_runs(started, len(expected) + 10)
+        stats["expected"] = expected
+        stats["saved"] = saved
+        stats["errors"] = DirtRally2Simulator._compare(expected, saved)
+
+        # stopping ends the session, also between two auto-restarted runs
+        if session is not None and session.is_alive():
+            stats["errors"].append("the session is still running after it was stopped")
+
+        return stats
+
+
+
+    def _drive(rng: np.random.Generator, static: np.ndarray, end_distance: float, track_length: float, dt: float, game_time: float) -> Iterator[np.ndarray]:
+        """
+        Yields the packets of an attempt, from the start line to end_distance
+        """
+
+        max_rpm = static[DirtRally2Fields.max_rpm.value]
+        idle_rpm = static[DirtRally2Fields.idle_rpm.value]
+        max_gears = int(static[DirtRally2Fields.max_gears.value])
+        gear_speed = DirtRally2Simulator.MAX_SPEED / max_gears  # speed range of a gear
+
+        speed = DirtRally2Simulator.MIN_SPEED
+        heading = rng.uniform(0, 2 * np.pi)
+        position = np.array([0.0, 0.0, float(static[DirtRally2Fields.pos_z.value])])
+        distance = 0.0
+        lap_time = 0.0
+        sector_times = [0.0, 0.0]
+        count = 0
+
+        while distance < end_distance:
+            n = DirtRally2Simulator.BLOCK_SIZE
+            steps = np.arange(1, n + 1)
+
+            # bounded random walks for the speed and the heading
+            speeds = np.clip(speed + np.cumsum(rng.normal(0.4 * dt, 4.0 * np.sqrt(dt), n)), DirtRally2Simulator.MIN_SPEED, DirtRally2Simulator.MAX_SPEED)
+            headings = heading + np.cumsum(rng.normal(0, 0.3 * np.sqrt(dt), n))
+            distances = distance + np.cumsum(speeds * dt)
+            lap_times = lap_time + steps * dt
+
+            # the end of the attempt is in this block
+            over = np.flatnonzero(distances >= end_distance)
+            if len(over) > 0:
+                n = over[0] + 1
+                speeds, headings, distances, lap_times, steps = speeds[:n], headings[:n], distances[:n], lap_times[:n], steps[:n]
+                distances[-1] = end_distance
+
+            block = np.tile(static, (n, 1))
+            block[:, DirtRally2Fields.run_time.value] = game_time + (count + steps) * dt
+            block[:, DirtRally2Fields.lap_time.value] = lap_times
+            block[:, DirtRally2Fields.distance.value] = distances
+            block[:, DirtRally2Fields.progress.value] = distances / track_length
+            block[:, DirtRally2Fields.speed_ms.value] = speeds
+            block[:, DirtRally2Fields.wsp_rl.value:DirtRally2Fields.wsp_fr.value + 1] = speeds[:, None]
+
+            # position and velocity follow the heading, the altitude rolls gently
+            vel_x = speeds * np.cos(headings)
+            vel_y = speeds * np.sin(headings)
+            block[:, DirtRally2Fields.vel_x.value] = vel_x
+            block[:, DirtRally2Fields.vel_z.value] = vel_y
+            block[:, DirtRally2Fields.pos_x.value] = position[0] + np.cumsum(vel_x * dt)
+            block[:, DirtRally2Fields.pos_y.value] = 20 * np.sin(distances / 500)
+            block[:, DirtRally2Fields.pos_z.value] = position[2] + np.cumsum(vel_y * dt)
+
+            # inputs and forces derived from the speed changes and the turning rate
+            accel = np.diff(speeds, prepend=speed) / dt
+            block[:, DirtRally2Fields.throttle.value] = np.clip(0.6 + accel / 10, 0, 1)
+            block[:, DirtRally2Fields.brakes.value] = np.clip(-accel / 10, 0, 1)
+            block[:, DirtRally2Fields.steering.value] = np.clip(np.diff(headings, prepend=heading) / dt, -1, 1)
+            block[:, DirtRally2Fields.g_force_lon.value] = accel / 9.81
+            block[:, DirtRally2Fields.g_force_lat.value] = speeds * np.diff(headings, prepend=heading) / dt / 9.81
+            block[:, DirtRally2Fields.susp_rl.value:DirtRally2Fields.susp_fr.value + 1] = rng.normal(0, 5, (n, 4))
+
+            # gear and RPM from the speed, the RPM climbs within the speed range of each gear
+            gears = np.clip(np.ceil(speeds / gear_speed), 1, max_gears)
+            block[:, DirtRally2Fields.gear.value] = gears
+            block[:, DirtRally2Fields.rpm.value] = idle_rpm + (max_rpm - idle_rpm) * np.clip(speeds / gear_speed - (gears - 1), 0.3, 1)
+
+            # sectors change at a third and two thirds of the stage, their times are set when they are passed
+            sectors = np.minimum((distances / (track_length / 3)).astype(int), 2)
+            block[:, DirtRally2Fields.sector.value] = sectors
+            for sector in [1, 2]:
+                crossed = np.flatnonzero(sectors >= sector)
+                if sector_times[sector - 1] == 0 and len(crossed) > 0:
+                    sector_times[sector - 1] = float(lap_times[crossed[0]]) - sum(sector_times[:sector - 1])
+                    block[crossed[0]:, DirtRally2Fields.sector_1_time.value + sector - 1] = sector_times[sector - 1]
+                elif sector_times[sector - 1] > 0:
+                    block[:, DirtRally2Fields.sector_1_time.value + sector - 1] = sector_times[sector - 1]
+
+            speed, heading = float(speeds[-1]), float(headings[-1])
+            distance, lap_time = float(distances[-1]), float(lap_times[-1])
+            position = np.array([block[-1, DirtRally2Fields.pos_x.value], 0.0, block[-1, DirtRally2Fields.pos_z.value]], dtype=np.float64)
+            count += n
+
+            yield block
+
+
+
+    def _saved_runs(started: datetime.datetime, limit: int) -> List[dict]:
+        """
+        Returns the runs saved by check() since started, oldest first
+        """
+
+        return DBHandler.get_runs({ "game": "DirtRally2", "tags": [DirtRally2Simulator.TAG], "date_from": started }, sort="date", order="asc", limit=limit)["runs"]
+
+
+
+    def _compare(expected: List[dict], saved: List[dict]) -> List[str]:
+        """
+        Returns the differences between the expected finishes and the saved runs (in order)
+        """
+
+        errors = []
+        if len(saved) != len(expected):
+            errors.append(f"expected {len(expected)} saved runs, found {len(saved)}")
+
+        for i, (run, row) in enumerate(zip(expected, saved)):
+            for key, saved_key in [("track", "track"), ("car", "car"), ("car_class", "car_class")]:
+                if run[key] != row[saved_key]:
+                    errors.append(f"run {i + 1}: {key} is \"{row[saved_key]}\", expected \"{run[key]}\"")
+            if abs(run["time"] - row["runtime_seconds"]) > 0.001:
+                errors.append(f"run {i + 1}: time is {row['runtime_seconds']:.3f}, expected {run['time']:.3f}")
+
+        return errors
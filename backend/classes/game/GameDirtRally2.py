@@ -1,15 +1,22 @@
 import datetime
-from enum import Enum
+import logging
 import numpy as np
-import struct
 from threading import Thread
+import time
 from collections import defaultdict
 
 from sqlalchemy import false
 
+from classes.analysis.LiveDelta import LiveDelta
+from classes.base.LogHandler import PacketLog
 from classes.database.DBHandler import DBHandler
+from classes.database.IdentificationCache import IdentificationCache
+from classes.game.PacketSchema import PacketField, PacketSchema, PacketVariant
 from classes.game.RunData import RunData
 from classes.game.GameHandler import GameHandler, GameHandlerProcessMode, GameHandlerState
+from classes.telemetry.PacketCapture import PacketCapture
+from classes.telemetry.TelemetryRecorder import TelemetryRecorder
+from classes.telemetry.TelemetryStore import TelemetryStore
 
 # high priority:
 #   TODO: under *some* circumstances, the result will be 00:00:000,
@@ -23,29 +30,32 @@ from classes.game.GameHandler import GameHandler, GameHandlerProcessMode, GameHa
 
 class GameDirtRally2(GameHandler):
 
-    def __init__(self):
-        super().__init__()
+    _log = logging.getLogger(__name__)
+
+    # class (static) variables
+    _known_names: dict = None
+
+    def __init__(self, source = None):
+        super().__init__(source)
         
         self._restart_abort = False # set to true, if the state was set to abort due to an ingame restart 
         self.car_list = DirtRally2CarList()
         self.track_list = DirtRally2TrackList()
+        self._packet_log = PacketLog(__name__ + ".packets", ["lap_time", "run_time", "laps_completed"])
 
+        # corrections are read now, so the identification on the first running packet does not wait for the DB
+        IdentificationCache.load("DirtRally2")
 
 
-    def _bit_stream_to_float32(data, pos):
-        try:
-            return struct.unpack("f", data[pos : pos + 4])[0]
-        except Exception as e:
-            return 0
 
     # -----------------------------------------------------------------------------------------------------------------
     # Parent class abstract methods
     # -----------------------------------------------------------------------------------------------------------------
 
     # abstractmethod
-    def parse_udp_data(self):
+    def parse_udp_data(self, data: bytes = None):
         """
-        Parses the latest UDP packet received, stores it in the generalized format in self._run_result
+        Parses the latest UDP packet received (or data, if given), stores it in the generalized format in self._run_result
         """
 
         # if a previous container exists use that, else create a new one
@@ -56,12 +66,16 @@ class GameDirtRally2(GameHandler):
 
         run_data.game_name = "DirtRally2"
 
+        # every field of the packet, at once (0 if there is no packet yet)
+        packet = DirtRally2Packet.schema.unpack(self.udp_data() if data is None else data)
+
         # the "last_lap_time" fields gets a value after a run has ended
         # it contains the run time of the run that just ended
         # during the run it is 0
-        run_data.run_time_sec = GameDirtRally2._bit_stream_to_float32(
-            self.udp_data(), DirtRally2Fields.last_lap_time.value * 4
-        )
+        # total_laps will always be 1, laps_completed is 0 during the run, 1 if the run has ended with a finish
+        # distance is from the start line (can be slightly negative before the start)
+        # current_sector is 0 based, changes when a split is passed
+        DirtRally2Packet.schema.to_run_data(packet, run_data)
 
         # BUG: under some circumstances, the result will be 00:00:000, in that case use the last lap time
         if run_data.run_time_sec == 0:
@@ -72,45 +86,26 @@ class GameDirtRally2(GameHandler):
         # and we use that to detect state changes
         if len(run_data.lap_times_sec) == 0:
             run_data.lap_times_sec.append(0)
-        run_data.lap_times_sec[0] = GameDirtRally2._bit_stream_to_float32(
-            self.udp_data(), DirtRally2Fields.lap_time.value * 4
-        )
-
-        # will always be 1
-        run_data.total_laps = GameDirtRally2._bit_stream_to_float32(
-            self.udp_data(), DirtRally2Fields.total_laps.value * 4
-        )
-
-        # 0 during the run, 1 if the run has ended with a finish
-        run_data.laps_completed = GameDirtRally2._bit_stream_to_float32(
-            self.udp_data(), DirtRally2Fields.laps_completed.value * 4
-        )
+        run_data.lap_times_sec[0] = packet.lap_time
 
         # get car & track info only when the run is started
         if self.get_state() == GameHandlerState.RUNNING:
 
             # get car info
             if run_data.car == '' or run_data.car == "AUTO-DETECT":
-                car = self.car_list.indentify_car(
-                    GameDirtRally2._bit_stream_to_float32(self.udp_data(), DirtRally2Fields.max_rpm.value * 4),
-                    GameDirtRally2._bit_stream_to_float32(self.udp_data(), DirtRally2Fields.idle_rpm.value * 4),
-                    GameDirtRally2._bit_stream_to_float32(self.udp_data(), DirtRally2Fields.max_gears.value * 4)
-                )
+                fingerprint = (packet.max_rpm, packet.idle_rpm, packet.max_gears)
+                car = self.car_list.indentify_car(*fingerprint)
                 run_data.car = car[0]
                 run_data.car_class = car[1]
-                print("* identified car: " + run_data.car + " of class: " + run_data.car_class)
+                self._identified["car"] = (fingerprint, car[0], car[1])
+                GameDirtRally2._log.info("identified car: %s of class: %s", run_data.car, run_data.car_class)
 
             # get track info
             if run_data.track == '' or run_data.track == "AUTO-DETECT":
-                run_data.track = self.track_list.indentify_track(
-                    GameDirtRally2._bit_stream_to_float32(self.udp_data(), DirtRally2Fields.track_length.value * 4),
-                    GameDirtRally2._bit_stream_to_float32(self.udp_data(), DirtRally2Fields.pos_z.value * 4)
-                )
-                print("* identified track: " + run_data.track)
-
-        # debug
-        if run_data.lap_times_sec[0] > 0 or run_data.run_time_sec > 0 or run_data.laps_completed > 0:
-            print(f"{run_data.lap_times_sec[0]:.2f}\t{run_data.run_time_sec:.2f}\t{run_data.laps_completed}")
+                fingerprint = (packet.track_length, packet.pos_z)
+                run_data.track = self.track_list.indentify_track(*fingerprint)
+                self._identified["track"] = (fingerprint, run_data.track)
+                GameDirtRally2._log.info("identified track: %s", run_data.track)
 
         self._run_result = run_data
 
@@ -132,12 +127,17 @@ class GameDirtRally2(GameHandler):
         if self.get_state() != GameHandlerState.IDLE:
             raise Exception("Can't start a run when not in IDLE state. Current state: " + str(self.get_state()))
 
+        # Open the UDP listener here, so a busy port is reported to the caller (it stays open until the gather thread ends)
+        self._start_listening()
+
         # Set run settings, if provided
-        self._run_result = run_config
+        self._run_result = run_config if run_config is not None else RunData()
         
         # Start parsing the incoming UDP data
+        self._active = True
         self._set_state(GameHandlerState.WAITING_FOR_START)
-        Thread(target=self._gather_wrapper, daemon=True).start()
+        self._gather_thread = Thread(target=self._gather_wrapper, daemon=True, name="gather-DirtRally2")
+        self._gather_thread.start()
 
 
 
@@ -148,24 +148,49 @@ class GameDirtRally2(GameHandler):
 
         If auto-restart is enabled, it will also enable auto-save,
         and it will kepp the run config
+
+        The session lasts until shutdown() (or until a run ends that is not restarted), and the UDP listener (opened by start_run)
+        stays open for all of it. Each restarted run sets the state back to WAITING_FOR_START.
+        The auto-save runs on the worker thread of the session (see process_run), so the gather loop is back
+        on the packets right after a stage ended (the listener only keeps the latest packet, a busy gather thread misses the ones in between)
+
+        If capture is enabled, every packet of the session is recorded (see PacketCapture)
         """
 
         self._run_result.auto_save_enabled = True if self._run_result.auto_restart_enabled else self._run_result.auto_save_enabled
-      
-        should_run = True
-        while should_run:
-            should_run = False
 
-            self._gather_data()
+        try:
+            self._open_ring()
+            if PacketCapture.is_enabled():
+                self._capture = PacketCapture("DirtRally2", GameDirtRally2.get_channel_names(), self.source)
+
+            should_run = True
+            while should_run:
+                should_run = False
+
+                self._gather_data()
+
+                # the session was shut down, or the run was discarded, nothing to restart
+                if not self._active or self._run_result is None:
+                    break
+
+                if self._run_result.auto_restart_enabled:
+                    # run again, if it was aborted due to an in-game restart
+                    if self.get_state() == GameHandlerState.ABORTED and self._restart_abort:
+                        should_run = True
 
-            if self._run_result.auto_restart_enabled:
-                # run again, if it was aborted due to an in-game restart
-                if self.get_state() == GameHandlerState.ABORTED and self._restart_abort:
-                    should_run = True
+                    # run again, if the state is in idle (run finished & processed)
+                    if self.get_state() == GameHandlerState.IDLE:
+                        should_run = True
+        finally:
+            # shut down UDP listener
+            self._active = False
+            self._stop_listening()
 
-                # run again, if the state is in idle (run finished & processed)
-                if self.get_state() == GameHandlerState.IDLE:
-                    should_run = True
+            if self._capture is not None:
+                self._capture.close()
+                GameDirtRally2._log.info("captured %d packets to %s", self._capture.count, self._capture.path)
+                self._capture = None
 
 
 
@@ -174,20 +199,31 @@ class GameDirtRally2(GameHandler):
         - Handles state changes between WAITING_FOR_START, RUNNING, FINISHED and ABORTED
         - Calls the parser for the UDP data, so it will be a generic RunData
         - Sets the parsed data as the _run_result
-        - Starts/Stops the UDP listner
         """
 
-        print(f"* starting run for DirtRally2 (autosave: {self._run_result.auto_save_enabled}, auto-restart: {self._run_result.auto_restart_enabled})")
+        GameDirtRally2._log.info("starting run for DirtRally2 (autosave: %s, auto-restart: %s)", self._run_result.auto_save_enabled, self._run_result.auto_restart_enabled)
 
         last_runtime_value = 0
         current_runtime_value = 0
+        last_sector = 0
+        last_packet = None
+        live_delta_requested = False
         self._stop = False
         self._restart_abort = False
 
-        self._start_listening()
+        # a restarted run (after an auto-save, or an in-game restart) waits for its start again
+        if self.get_state() != GameHandlerState.WAITING_FOR_START:
+            self._set_state(GameHandlerState.WAITING_FOR_START)
+
+        parse_seconds = GameHandler._parse_seconds.labels("DirtRally2")
 
-        while not self._stop:
-            self.parse_udp_data()
+        while not self._stop and self._active:
+            # the loop spins between packets, only the parse of a new packet is timed
+            packet = self.udp_data()
+            parse_start = time.perf_counter()
+            self.parse_udp_data(packet)
+            if packet is not last_packet:
+                parse_seconds.observe(time.perf_counter() - parse_start)
 
             # Change state based on current and last-iteration runtime values
             last_runtime_value = current_runtime_value
@@ -197,6 +233,12 @@ class GameDirtRally2(GameHandler):
                 # Run started
                 self._set_state(GameHandlerState.RUNNING)
                 self._run_result.run_date = datetime.datetime.now()
+                self._run_result.split_times_sec = []
+                last_sector = 0
+                self._live_delta = None
+                live_delta_requested = False
+                if TelemetryStore.is_enabled():
+                    self._telemetry = TelemetryRecorder(GameDirtRally2.get_channel_names(), GameDirtRally2.decode_packet)
 
             if last_runtime_value != 0 and current_runtime_value == 0:
                 # Run ended
@@ -209,17 +251,88 @@ class GameDirtRally2(GameHandler):
                     self._restart_abort = True
                     self._set_state(GameHandlerState.ABORTED)
 
+            # record a split, each time a new sector is reached
+            if self.get_state() == GameHandlerState.RUNNING and self._run_result.current_sector > last_sector:
+                last_sector = self._run_result.current_sector
+                self._run_result.split_times_sec.append(self._get_split_time(last_sector))
+
+            # the track and car are identified on the first running packet, the best run can be looked up after that
+            if (
+                self.get_state() == GameHandlerState.RUNNING
+                and not live_delta_requested
+                and self._run_result.track not in ["", "AUTO-DETECT"]
+                and self._run_result.car not in ["", "AUTO-DETECT"]
+            ):
+                live_delta_requested = True
+                self._load_live_delta()
+
+            # update the delta to the best run on every new packet
+            if packet is not last_packet:
+                last_packet = packet
+                if self._live_delta is not None and self.get_state() == GameHandlerState.RUNNING:
+                    self._live_delta.update(self._run_result.distance, self._run_result.lap_times_sec[0])
+                if self.ring is not None or self._capture is not None:
+                    values = GameDirtRally2.decode_packet(packet)
+                    if self.ring is not None:
+                        self._publish_packet(values)
+                    if self._capture is not None:
+                        self._capture.add_packet(values)
+
+                # debug line of the new packet (sampled, or to the trace file, see PacketLog)
+                if current_runtime_value > 0 or self._run_result.run_time_sec > 0 or self._run_result.laps_completed > 0:
+                    self._packet_log.log(current_runtime_value, self._run_result.run_time_sec, self._run_result.laps_completed)
+
+            # record every new packet while running
+            if self._telemetry is not None and self.get_state() == GameHandlerState.RUNNING:
+                self._telemetry.add_packet(packet)
+
+        # discarded while running (shutdown)
+        if self._run_result is None:
+            GameDirtRally2._log.info("stopping run for DirtRally2 - state is now: %s", self.get_state().name)
+            return
+
         # adjust data stucture, because the general structure expects the run result in the lap_times_sec array
         self._run_result.lap_times_sec = [self._run_result.run_time_sec]
         result_time_str = RunData.format_time(self._run_result.run_time_sec)
 
         # auto-save result if not aborted, and setting is set
         if self.get_state() == GameHandlerState.FINISHED and self._run_result.auto_save_enabled:
-            self.process_run(GameHandlerProcessMode.ALL, keep_config=self._run_result.auto_restart_enabled)
+            self.process_run(GameHandlerProcessMode.ALL, keep_config=self._run_result.auto_restart_enabled, in_background=True)
+
+        GameDirtRally2._log.info("stopping run for DirtRally2 ( %s ) - state is now: %s%s", result_time_str, self.get_state().name, " (in-game restart)" if self._restart_abort else "")
+
+
+
+    def _load_live_delta(self):
+        """
+        Loads the best previous run with the same track and car in the background, for the live delta
+        """
+
+        run_date = self._run_result.run_date
+
+        def set_live_delta(live_delta):
+            # the run could have ended while loading
+            if self._run_result is not None and self._run_result.run_date == run_date:
+                self._live_delta = live_delta
+
+        LiveDelta.load_best_async(
+            self._run_result.game_name, self._run_result.track, self._run_result.car, set_live_delta
+        )
+
+
+
+    def _get_split_time(self, sector: int) -> float:
+        """
+        Returns the time from the start, at the end of the given (1 based) sector.
+        Uses the sector times reported by the game, falls back to the current stage time if they are not set.
+        """
+
+        packet = DirtRally2Packet.schema.unpack(self.udp_data())
+        sector_times = [packet.sector_1_time, packet.sector_2_time]
 
-        # shut down UDP listener
-        self._stop_listening()
-        print(f"* stopping run for DirtRally2 ( {result_time_str} ) - state is now: {self.get_state().name}" + (f" (in-game restart)" if self._restart_abort else ""))
+        if sector <= len(sector_times) and all(t > 0 for t in sector_times[:sector]):
+            return sum(sector_times[:sector])
+        return self._run_result.lap_times_sec[0]
 
 
 
@@ -234,30 +347,138 @@ class GameDirtRally2(GameHandler):
 
 
     # abstractmethod
-    def get_attributes():
-        return {
+    def get_attributes(lite = False):
+        attributes = {
             "car": {
                 "supports_car_detection": True,
-                "saved_cars": DBHandler.get_saved_cars("DirtRally2"),
                 "saved_car_classes": DBHandler.get_saved_car_classes("DirtRally2")
             },
 
             "track": {
                 "supports_track_detection": True,
-                "saved_tracks": DBHandler.get_saved_tracks("DirtRally2"),
                 "saved_track_conditions": DBHandler.get_saved_track_conditions("DirtRally2")
             },
 
-            "saved_tags": DBHandler.get_saved_tags("DirtRally2"),
-
             "additional_fields": []
         }
 
+        # the lists can be long, lite clients look them up through the search instead
+        if not lite:
+            attributes["car"]["saved_cars"] = DBHandler.get_saved_cars("DirtRally2")
+            attributes["track"]["saved_tracks"] = DBHandler.get_saved_tracks("DirtRally2")
+            attributes["saved_tags"] = DBHandler.get_saved_tags("DirtRally2")
+
+        return attributes
+
+
+
+    def get_known_names():
+        """
+        Returns the names of every track and car the game can identify
+        """
+
+        if GameDirtRally2._known_names is None:
+            GameDirtRally2._known_names = {
+                "track": sorted(set(name for candidates in DirtRally2TrackList().track_dict.values() for _, name in candidates)),
+                "car": sorted(set(tuple(car) for car in DirtRally2CarList().car_dict.values())),
+            }
+
+        return GameDirtRally2._known_names
+
+
+
+    def get_channel_names():
+        return DirtRally2Packet.schema.channel_names
+
+
+
+    def decode_packet(packet):
+        """
+        Returns the fields of a packet as float32 values (a shorter packet is padded with 0)
+        """
+        return DirtRally2Packet.schema.decode(packet)
+
+
+
+    def detect_runs(times, values):
+        """
+        Finds the runs of a capture with the rules of _gather_data, on the whole arrays at once:
+        - a run starts on the packet lap_time becomes non-zero, and ends on the packet it drops back to 0
+        - it is FINISHED if laps_completed equals total_laps on the end packet, ABORTED otherwise
+        - a run still going on at the end of the capture is left out
+
+        The time is last_lap_time of the end packet. The game can send the end packet before last_lap_time is set
+        (the 00:00:000 results), so the first non-zero last_lap_time before the next start is used in that case,
+        and the lap_time of the last running packet if there is none.
+
+        The car and track are identified from the start packet, the splits are taken like in _get_split_time.
+        """
+
+        lap_time = values[:, DirtRally2Fields.lap_time.value]
+        last_lap_time = values[:, DirtRally2Fields.last_lap_time.value]
+
+        # transitions of lap_time != 0, a capture starting mid-run counts the first packet as the start (as _gather_data does)
+        running = lap_time != 0
+        was_running = np.concatenate(([False], running[:-1]))
+        starts = np.flatnonzero(running & ~was_running)
+        ends = np.flatnonzero(~running & was_running)
+        starts = starts[:len(ends)]
+
+        finished = values[ends, DirtRally2Fields.laps_completed.value] == values[ends, DirtRally2Fields.total_laps.value]
+
+        # first non-zero last_lap_time from the end packet on, if it comes before the next start
+        result_indexes = np.flatnonzero(last_lap_time != 0)
+        next_starts = np.append(starts[1:], len(lap_time))
+        positions = np.searchsorted(result_indexes, ends)
+        candidates = result_indexes[np.minimum(positions, max(len(result_indexes) - 1, 0))] if len(result_indexes) > 0 else ends
+        has_result = (positions < len(result_indexes)) & (candidates < next_starts)
+        run_times = np.where(has_result, last_lap_time[candidates], lap_time[ends - 1])
+
+        car_list = DirtRally2CarList()
+        track_list = DirtRally2TrackList()
+
+        runs = []
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            packet = values[start]
+
+            run_data = RunData()
+            run_data.game_name = "DirtRally2"
+            run_data.run_date = datetime.datetime.fromtimestamp(float(times[start]))
+            run_data.run_time_sec = float(run_times[i])
+            run_data.lap_times_sec = [run_data.run_time_sec]
+            run_data.total_laps = float(values[end, DirtRally2Fields.total_laps.value])
+            run_data.laps_completed = float(values[end, DirtRally2Fields.laps_completed.value])
+
+            run_data.car, run_data.car_class = car_list.indentify_car(
+                float(packet[DirtRally2Fields.max_rpm.value]),
+                float(packet[DirtRally2Fields.idle_rpm.value]),
+                float(packet[DirtRally2Fields.max_gears.value]),
+            )
+            run_data.track = track_list.indentify_track(
+                float(packet[DirtRally2Fields.track_length.value]),
+                float(packet[DirtRally2Fields.pos_z.value]),
+            )
+
+            # a split on every packet the highest sector reached so far grows
+            sectors = np.maximum.accumulate(values[start:end, DirtRally2Fields.sector.value].astype(int))
+            changes = np.flatnonzero(np.diff(sectors, prepend=0) > 0)
+            for change in changes:
+                sector = sectors[change]
+                sector_times = values[start + change, [DirtRally2Fields.sector_1_time.value, DirtRally2Fields.sector_2_time.value]]
+                if sector <= len(sector_times) and np.all(sector_times[:sector] > 0):
+                    run_data.split_times_sec.append(sum(float(t) for t in sector_times[:sector]))
+                else:
+                    run_data.split_times_sec.append(float(lap_time[start + change]))
+
+            runs.append((GameHandlerState.FINISHED if finished[i] else GameHandlerState.ABORTED, run_data))
+
+        return runs
 
 
-class DirtRally2Fields(Enum):
+
+class DirtRally2Packet:
     """
-    Dirt Rally 2 returns XX bytes of data per packet, arranged in a struct. Each field consists of 4 bytes, representing a float. The position of each field in the struct is specified in the following table.
+    Dirt Rally 2 returns 264 bytes of data per packet, arranged in a struct. Each field consists of 4 bytes, representing a float. The fields are declared in the schema below, in the order of the struct.
 
     To set the game up, open C:\\Users\\USERNAME\\Documents\\My Games\\DiRT Rally 2.0\\hardwaresettings\\hardware_settings_config.xml and set up the following:
     - <udp enabled="true" extradata="3" ip="127.0.0.1" port="51659" delay="1" />
@@ -265,72 +486,91 @@ class DirtRally2Fields(Enum):
     Special thanks to https://github.com/ErlerPhilipp/dr2_logger & https://github.com/soong-construction/dirt-rally-time-recorder for the struct format.
     """
 
-    run_time = 0
-    lap_time = 1
-    distance = 2
-    progress = 3
-    pos_x = 4
-    pos_y = 5
-    pos_z = 6
-    speed_ms = 7
-    vel_x = 8
-    vel_y = 9
-    vel_z = 10
-    roll_x = 11
-    roll_y = 12
-    roll_z = 13
-    pitch_x = 14
-    pitch_y = 15
-    pitch_z = 16
-    susp_rl = 17
-    susp_rr = 18
-    susp_fl = 19
-    susp_fr = 20
-    susp_vel_rl = 21
-    susp_vel_rr = 22
-    susp_vel_fl = 23
-    susp_vel_fr = 24
-    wsp_rl = 25
-    wsp_rr = 26
-    wsp_fl = 27
-    wsp_fr = 28
-    throttle = 29
-    steering = 30
-    brakes = 31
-    clutch = 32
-    gear = 33
-    g_force_lat = 34
-    g_force_lon = 35
-    current_lap = 36
-    rpm = 37  # / 10
-    sli_pro_support = 38  # ignored
-    car_pos = 39
-    kers_level = 40  # ignored
-    kers_max_level = 41  # ignored
-    drs = 42  # ignored
-    traction_control = 43  # ignored
-    anti_lock_brakes = 44  # ignored
-    fuel_in_tank = 45  # ignored
-    fuel_capacity = 46  # ignored
-    in_pit = 47  # ignored
-    sector = 48
-    sector_1_time = 49
-    sector_2_time = 50
-    brakes_temp_rl = 51
-    brakes_temp_rr = 52
-    brakes_temp_fl = 53
-    brakes_temp_fr = 54
-    tyre_pressure_rl = 55  # ignored
-    tyre_pressure_rr = 56  # ignored
-    tyre_pressure_fl = 57  # ignored
-    tyre_pressure_fr = 58  # ignored
-    laps_completed = 59
-    total_laps = 60
-    track_length = 61
-    last_lap_time = 62
-    max_rpm = 63  # / 10
-    idle_rpm = 64  # / 10
-    max_gears = 65
+    schema = PacketSchema(
+        "DirtRally2",
+        [
+            PacketVariant("extradata3", [
+                PacketField("run_time"),
+                PacketField("lap_time"),
+                PacketField("distance"),
+                PacketField("progress"),
+                PacketField("pos_x"),
+                PacketField("pos_y"),
+                PacketField("pos_z"),
+                PacketField("speed_ms"),
+                PacketField("vel_x"),
+                PacketField("vel_y"),
+                PacketField("vel_z"),
+                PacketField("roll_x"),
+                PacketField("roll_y"),
+                PacketField("roll_z"),
+                PacketField("pitch_x"),
+                PacketField("pitch_y"),
+                PacketField("pitch_z"),
+                PacketField("susp_rl"),
+                PacketField("susp_rr"),
+                PacketField("susp_fl"),
+                PacketField("susp_fr"),
+                PacketField("susp_vel_rl"),
+                PacketField("susp_vel_rr"),
+                PacketField("susp_vel_fl"),
+                PacketField("susp_vel_fr"),
+                PacketField("wsp_rl"),
+                PacketField("wsp_rr"),
+                PacketField("wsp_fl"),
+                PacketField("wsp_fr"),
+                PacketField("throttle"),
+                PacketField("steering"),
+                PacketField("brakes"),
+                PacketField("clutch"),
+                PacketField("gear"),
+                PacketField("g_force_lat"),
+                PacketField("g_force_lon"),
+                PacketField("current_lap"),
+                PacketField("rpm"),  # / 10
+                PacketField("sli_pro_support"),  # ignored
+                PacketField("car_pos"),
+                PacketField("kers_level"),  # ignored
+                PacketField("kers_max_level"),  # ignored
+                PacketField("drs"),  # ignored
+                PacketField("traction_control"),  # ignored
+                PacketField("anti_lock_brakes"),  # ignored
+                PacketField("fuel_in_tank"),  # ignored
+                PacketField("fuel_capacity"),  # ignored
+                PacketField("in_pit"),  # ignored
+                PacketField("sector"),
+                PacketField("sector_1_time"),
+                PacketField("sector_2_time"),
+                PacketField("brakes_temp_rl"),
+                PacketField("brakes_temp_rr"),
+                PacketField("brakes_temp_fl"),
+                PacketField("brakes_temp_fr"),
+                PacketField("tyre_pressure_rl"),  # ignored
+                PacketField("tyre_pressure_rr"),  # ignored
+                PacketField("tyre_pressure_fl"),  # ignored
+                PacketField("tyre_pressure_fr"),  # ignored
+                PacketField("laps_completed"),
+                PacketField("total_laps"),
+                PacketField("track_length"),
+                PacketField("last_lap_time"),
+                PacketField("max_rpm"),  # / 10
+                PacketField("idle_rpm"),  # / 10
+                PacketField("max_gears"),
+            ]),
+        ],
+        run_data={
+            "run_time_sec": "last_lap_time",
+            "total_laps": "total_laps",
+            "laps_completed": "laps_completed",
+            "distance": "distance",
+            "current_sector": ("sector", int),
+        },
+    )
+
+
+
+# position of each field in the decoded packets (see GameDirtRally2.decode_packet)
+DirtRally2Fields = DirtRally2Packet.schema.channel_enum("DirtRally2Fields")
 
 
 
@@ -474,7 +714,12 @@ class DirtRally2CarList:
         """
 
         key = (max_rpm, idle_rpm, max_gears)
-        
+
+        # the cars the user picked for a fingerprint come first
+        learned = IdentificationCache.find_car("DirtRally2", key)
+        if learned is not None:
+            return list(learned)
+
         if key in self.car_dict.keys():
             car = self.car_dict[key]
         else:
@@ -703,6 +948,11 @@ class DirtRally2TrackList:
         Returns the track name
         """
 
+        # the tracks the user picked for a length and start come first
+        learned = IdentificationCache.find_track("DirtRally2", length, start_z)
+        if learned is not None:
+            return learned
+
         if start_z is not None and length in self.track_dict.keys():
             track_candidates = self.track_dict[length]
             track_candidates_start_z = np.array([t[0] for t in track_candidates])
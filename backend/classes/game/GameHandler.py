@@ -1,13 +1,26 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-from typing import Any
+from threading import Thread, current_thread
+from typing import Any, Callable, List, Tuple
+import logging
 import math
+import time
+import numpy as np
 from numpy import median
 
+from classes.database.AttributeSearch import AttributeSearch
 from classes.database.DBHandler import DBHandler
+from classes.database.IdentificationCache import IdentificationCache
 from classes.game.RunData import RunData
 from classes.base.AppSettings import AppSettings
+from classes.base.Metrics import Metrics
+from classes.base.PacketRing import PacketRing
+from classes.analysis.LiveDelta import LiveDelta
 from classes.base.UdpHandler import UdpHandler
+from classes.telemetry.PacketCapture import PacketCapture
+from classes.telemetry.TelemetryRecorder import TelemetryRecorder
+from classes.telemetry.TelemetryStore import TelemetryStore
 
 
 
@@ -39,19 +52,50 @@ class GameHandlerProcessMode(Enum):
 
 class GameHandler(ABC):
 
-    def __init__(self) -> None:
+    _log = logging.getLogger(__name__)
+
+    # metrics
+    _state_transitions = Metrics.counter("simstats_state_transitions_total", "State changes of the game handlers", ("game", "state"))
+    _state_timestamps = Metrics.gauge("simstats_state_transition_timestamp_seconds", "Unix time of the last change to each state", ("game", "state"))
+    _parse_seconds = Metrics.histogram("simstats_parse_seconds", "Time spent parsing a UDP packet", ("game",))
+
+    # appended to the decoded packet in the live ring: seconds since the session started, the delta to the best run,
+    # and its id (NaN while there is no best run, ids are exact up to 2^24 in float32)
+    LIVE_CHANNELS = ["live_time", "delta_to_best", "best_run_id"]
+
+    def __init__(self, source: Tuple[str, int] = None) -> None:
         """
         Initializes the game handler.
 
         Loads game settings from settings.json (settings.game_settings.GAMENAME).
         If it doesn't exist, it creates a default entry, based on Class.get_default_settings()
+
+        :param source: (ip, port) of the rig this handler tracks, None to use the last packet from any source
         """
 
         self.udp_handler = None
         self.game_settings = None
+        self.source = source
 
         self._state: GameHandlerState = GameHandlerState.IDLE
         self._run_result: RunData = None
+        self._telemetry: TelemetryRecorder = None # recording of the current run, if telemetry is enabled
+        self._live_delta: LiveDelta = None # comparison to the best previous run, while running
+        self._identified: dict = {} # { "car": (fingerprint, name, class), "track": (fingerprint, name) } as identified from the game data
+        self._capture: PacketCapture = None # raw packets of the session, if capture is enabled
+        self._active = False # the session is listening, from start_run until shutdown (or its last run ended), also between auto-restarted runs
+        self._stop = False # ends the current pass of the gather loop
+        self._gather_thread: Thread = None
+        self._saver = ThreadPoolExecutor(1, thread_name_prefix="save-" + self.__class__.__name__.replace("Game", "")) # auto-saves, off the gather thread
+
+        # decoded packets of the session, for /game/live (kept across the runs of the session, see _publish_packet)
+        self.channel_names: List[str] = self.__class__.get_channel_names() + GameHandler.LIVE_CHANNELS
+        self.ring: PacketRing = None # set by IngestionProcess to its shared ring, else created by _open_ring
+        self._ring_record: np.ndarray = None
+        self._ring_start = 0
+
+        # hook for the ingestion process (see IngestionProcess), called on the gather thread
+        self.on_state_change: Callable[[GameHandlerState], None] = None # every state change
 
         classname = self.__class__.__name__
         if classname == "GameHandler":
@@ -66,7 +110,7 @@ class GameHandler(ABC):
         except (TypeError, KeyError):
             # if game_settings is missing, "None" is returned. Accessing it with game_name will raise a TypeError
             # if game_settings is found, but the game_name is not it it, a KeyError is raised
-            print("* missing settings for game: " + game_name)
+            GameHandler._log.error("missing settings for game: %s", game_name)
             raise Exception()
 
         # Create UDP handler
@@ -80,8 +124,21 @@ class GameHandler(ABC):
         """
         Starts listening for UDP data
         """
-        self.udp_handler.start_listen(
-            self.game_settings["udp_port"], self.game_settings["udp_buffer_size"]
+        GameHandler.start_listener(self.game_settings)
+
+
+
+    def start_listener(game_settings: dict):
+        """
+        Starts listening for UDP data, with the settings of a game (settings.game_settings.GAMENAME)
+
+        Also used without a game handler instance, to hold the shared listener open (release it with UdpHandler().stop_listen())
+        """
+        UdpHandler().start_listen(
+            game_settings["udp_port"],
+            game_settings["udp_buffer_size"],
+            game_settings.get("udp_bind_address", "127.0.0.1"),
+            game_settings.get("udp_allowed_sources"),
         )
 
 
@@ -96,9 +153,9 @@ class GameHandler(ABC):
 
     def udp_data(self) -> bytes:
         """
-        Returns the last UDP data received
+        Returns the last UDP data received (from self.source, if set)
         """
-        return self.udp_handler.get_data()
+        return self.udp_handler.get_data(self.source)
 
 
 
@@ -109,7 +166,13 @@ class GameHandler(ABC):
         Sets the current state of the game handler
         """
         self._state = new_state
-        pass
+
+        game_name = self.__class__.__name__.replace("Game", "")
+        GameHandler._state_transitions.labels(game_name, new_state.name).inc()
+        GameHandler._state_timestamps.labels(game_name, new_state.name).set(time.time())
+
+        if self.on_state_change is not None:
+            self.on_state_change(new_state)
 
 
 
@@ -121,6 +184,78 @@ class GameHandler(ABC):
 
 
 
+    def get_live_settings() -> dict:
+        """
+        Returns the live ring settings, with defaults for the missing keys
+
+        { "enabled": bool, "ring_slots": int } (the ingestion process always has a ring, of ingestion.ring_slots)
+        """
+
+        settings = AppSettings().read_setting("live") or {}
+        return {
+            "enabled": settings.get("enabled", True),
+            "ring_slots": settings.get("ring_slots", 8192),
+        }
+
+
+
+    def _open_ring(self):
+        """
+        Creates the live ring of the session, unless it has one (or it is disabled)
+        """
+
+        if self.ring is None:
+            settings = GameHandler.get_live_settings()
+            if not settings["enabled"]:
+                return
+            self.ring = PacketRing(len(self.channel_names), settings["ring_slots"], shared=False)
+
+        self._ring_record = np.full(self.ring.width, np.nan, dtype=np.float32)
+        self._ring_start = time.monotonic()
+
+
+
+    def _publish_packet(self, values: np.ndarray):
+        """
+        Writes the decoded values of a new packet, followed by the LIVE_CHANNELS, to the live ring
+        """
+
+        record = self._ring_record
+        count = min(len(values), len(record) - len(GameHandler.LIVE_CHANNELS))
+        record[:] = np.nan
+        record[:count] = values[:count]
+        record[-3] = time.monotonic() - self._ring_start
+
+        live_delta = self._live_delta
+        if live_delta is not None:
+            record[-1] = live_delta.run_id
+            if live_delta.delta is not None:
+                record[-2] = live_delta.delta
+
+        self.ring.write(record)
+
+
+
+    def get_live_status(self) -> dict:
+        """
+        Returns the live comparison of the current run to the best previous run
+        """
+
+        if self._live_delta is None:
+            return { "best_run_id": None, "delta_to_best": None }
+
+        return { "best_run_id": self._live_delta.run_id, "delta_to_best": self._live_delta.delta }
+
+
+
+    def is_alive(self) -> bool:
+        """
+        Returns True while the session is gathering (its gather thread is running)
+        """
+        return self._gather_thread is not None and self._gather_thread.is_alive()
+
+
+
     def is_run_over(self):
         return self._state == GameHandlerState.FINISHED or self._state == GameHandlerState.ABORTED
 
@@ -137,12 +272,14 @@ class GameHandler(ABC):
 
 
 
-    def process_run(self, process_mode: GameHandlerProcessMode, edited_data: RunData = None, keep_config = False):
+    def process_run(self, process_mode: GameHandlerProcessMode, edited_data: RunData = None, keep_config = False, in_background = False):
         """
         Saves or discards the run data, as selected by the user
 
         :param process_mode: what to do with the data? Discard, or save in one of several ways
         :param edited_data: None, if the data is to be handled as it was, or RunData type if it was edited after the run was over
+        :param in_background: save on the worker thread of the session (one run at a time, in order), and return once the instance is reset.
+            Used by the auto-save, so the gather thread is back on the packets right away. Errors of the save are logged.
         :param discard_bottom_percent: how many percent of the data to discard from the bottom
         :param discard_top_percent: how many percent of the data to discard from the top
         """
@@ -190,15 +327,63 @@ class GameHandler(ABC):
             case _:
                 raise ValueError("Invalid process mode")
 
-        # save data
+        # save data (the reset replaces the run result, recording and identification, so the save keeps these ones)
         if process_mode != GameHandlerProcessMode.DISCARD:
-            DBHandler.save_run(data_to_process)
+            if in_background:
+                self._saver.submit(self._save_run_in_background, data_to_process, self._telemetry, self._identified)
+            else:
+                self._save_run(data_to_process, self._telemetry, self._identified)
 
         # reset instance
         self._reset_instance(keep_config=keep_config)
 
 
 
+    def _save_run(self, run_data: RunData, telemetry: TelemetryRecorder, identified: dict):
+        """
+        Saves the run to the DB, with its recording (if any)
+        """
+
+        run_ids = DBHandler.save_run(run_data)
+        AttributeSearch.invalidate(run_data.game_name)
+        self._learn_identification(run_data, identified)
+
+        # the recording covers the whole run, so it can only be attached if the run was saved as a single entry
+        if telemetry is not None and len(run_ids) == 1:
+            TelemetryStore.save_run(run_ids[0], run_data.game_name, telemetry.get_channels())
+
+
+
+    def _save_run_in_background(self, run_data: RunData, telemetry: TelemetryRecorder, identified: dict):
+        try:
+            self._save_run(run_data, telemetry, identified)
+        except Exception:
+            GameHandler._log.exception("could not save the run (%s, %s)", run_data.track, run_data.car)
+
+
+
+    def _learn_identification(self, run_data: RunData, identified: dict):
+        """
+        Records the car and track the user saved the run with, if they differ from the identified ones,
+        so the next identification of the same fingerprint returns them
+        """
+
+        try:
+            car = identified.get("car")
+            if car is not None and run_data.car not in ["", "AUTO-DETECT"] and (run_data.car, run_data.car_class) != (car[1], car[2]):
+                IdentificationCache.record_car(run_data.game_name, car[0], run_data.car, run_data.car_class)
+                GameHandler._log.info("learned car: %s / %s (identified as %s / %s)", run_data.car, run_data.car_class, car[1], car[2])
+
+            track = identified.get("track")
+            if track is not None and run_data.track not in ["", "AUTO-DETECT"] and run_data.track != track[1]:
+                IdentificationCache.record_track(run_data.game_name, *track[0], run_data.track)
+                GameHandler._log.info("learned track: %s (identified as %s)", run_data.track, track[1])
+
+        except Exception as e:
+            GameHandler._log.warning("could not save the identification correction: %s", e)
+
+
+
     def _reset_instance(self, keep_config = False):
         """
         Resets the class instance to a known state, so that a new run can be started
@@ -228,15 +413,29 @@ class GameHandler(ABC):
         else:
             self._run_result = None
 
-        self._state = GameHandlerState.IDLE
+        self._telemetry = None
+        self._live_delta = None
+        self._identified = {}
+        self._set_state(GameHandlerState.IDLE)
 
 
 
     def shutdown(self):
         """
         Does everything necessary to properly dispose of the class instance
+
+        Ends the session whatever the state (it is IDLE for a moment between two auto-restarted runs),
+        waits for the gather thread and the auto-saves, then discards the run that was not processed
         """
-        
+
+        self._active = False
+        self._stop = True
+        if self._gather_thread is not None and self._gather_thread is not current_thread():
+            self._gather_thread.join()
+
+        # the auto-saved runs are in the DB once the session is shut down
+        self._saver.shutdown(wait=True)
+
         if self.get_state() == GameHandlerState.IDLE:
             return
 
@@ -273,5 +472,45 @@ class GameHandler(ABC):
 
 
     @abstractmethod
-    def get_attributes():
-        pass
\ No newline at end of file
+    def get_attributes(lite = False):
+        pass
+
+
+
+    def get_known_names():
+        """
+        Returns the names the game can identify without a saved run, for the attribute search
+
+        { "track": [ name ], "car": [ (name, class) ] }
+        """
+        return {}
+
+
+
+    def get_channel_names() -> List[str]:
+        """
+        Returns the names of the values in a decoded packet (see decode_packet)
+        Games declare their packet layout as a PacketSchema, and return its channel_names and decode() here
+        """
+        return []
+
+
+
+    def decode_packet(packet: bytes):
+        """
+        Returns the values of a packet as a float32 numpy array, in the order of get_channel_names()
+        """
+        return None
+
+
+
+    def detect_runs(times, values) -> List[Tuple[GameHandlerState, RunData]]:
+        """
+        Finds the runs of a capture (see PacketCapture), with the rules the game uses while running
+
+        :param times: unix time of each packet
+        :param values: decoded packets, one row per packet, in the order of get_channel_names()
+
+        Returns the state each run ended in (FINISHED or ABORTED), and its RunData
+        """
+        return []
\ No newline at end of file
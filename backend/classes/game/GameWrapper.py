@@ -1,11 +1,29 @@
+import base64
+import math
+from threading import Thread
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from classes.base.AppSettings import AppSettings
+from classes.base.UdpHandler import UdpHandler
+from classes.database.AttributeSearch import AttributeSearch
 from classes.game.RunData import RunData
 from classes.game.GameHandler import GameHandler, GameHandlerProcessMode, GameHandlerState
 from classes.game.GameDirtRally2 import GameDirtRally2
+from classes.game.IngestionProcess import IngestionProcess
 
 
 class GameWrapper:
 
-    game_instance: GameHandler = None
+    # sessions, keyed by source ("ip:port"), the "" key is the session that takes packets from any source
+    sessions: Dict[str, GameHandler] = {}
+
+    # "auto" source: the parameters new sources are started with, and the sessions started that way
+    _auto_parameters: dict = None
+    _auto_sources: set = set()
+    _auto_listening: bool = False # the listener is held open for the sources to come
 
     def get_game_list():
         """
@@ -25,49 +43,50 @@ class GameWrapper:
 
 
 
-    def get_game_attributes(game_name: str):
+    def get_game_attributes(game_name: str, lite: bool = False):
         """
         Returns the attributes and saved data of a game
+        With lite, the saved track, car and tag lists are left out (use search_attributes instead)
         """
 
-        #  get all classes that inherit from GameHandler (only works for classes that are imported here)
-        game_classes = GameHandler.__subclasses__()
+        # return the attributes of the class
+        return GameWrapper._get_game_class(game_name).get_attributes(lite)
 
-        # get the class that matches the game name
-        game_class = list(
-            filter(
-                lambda x: x.__name__.replace("Game", "") == game_name,
-                game_classes
-            )
-        )[0]
 
-        # return the attributes of the class
-        return game_class.get_attributes()
+
+    def search_attributes(game_name: str, query: str, kinds: List[str] = None, limit: int = 10):
+        """
+        Returns the tracks, cars and tags of a game matching the query
+        """
+
+        try:
+            game_class = GameWrapper._get_game_class(game_name)
+            return AttributeSearch.search(game_name, query, kinds, limit, game_class.get_known_names())
+
+        except Exception as e:
+            return "Could not search attributes" + "\n" + str(e)
 
 
 
     def start_run(parameters):
         """
         Starts a new run of a game
+
+        The optional "source" parameter selects the rig ("ip:port") the run is tracked for.
+        "auto" starts a session, with the same parameters, for every source that sends packets.
         """
         try:
-            # shut down previous instance
-            if GameWrapper.game_instance is not None:
-                GameWrapper.game_instance.shutdown()
+            source = parameters.get("source", "")
 
-            # get game_name
-            game_name = parameters["game_name"]
+            if source == "auto":
+                return GameWrapper._start_auto_sessions(parameters)
 
-            #  get all classes that inherit from GameHandler (only works for classes that are imported here)
-            game_classes = GameHandler.__subclasses__()
+            # shut down previous instance
+            if source in GameWrapper.sessions:
+                GameWrapper.sessions[source].shutdown()
 
             # get the class that matches the game name
-            game_class: GameHandler = list(
-                filter(
-                    lambda x: x.__name__.replace("Game", "") == game_name,
-                    game_classes
-                )
-            )[0]
+            game_class = GameWrapper._get_game_class(parameters["game_name"])
 
             # set up RunData (if keys other than the game_name are present)
             if len(list(parameters.keys())) > 1:
@@ -76,9 +95,17 @@ class GameWrapper:
             else:
                 run_data = None
 
-            # start the run
-            GameWrapper.game_instance: GameHandler = game_class()
-            GameWrapper.game_instance.start_run(run_data)
+            # start the run, in a child process if enabled (the "auto" sessions share the listener of this process)
+            parsed_source = UdpHandler.parse_source(source) if source else None
+            if IngestionProcess.is_enabled() and source not in GameWrapper._auto_sources:
+                for other_source, session in GameWrapper.sessions.items():
+                    if other_source != source and isinstance(session, IngestionProcess) and session.is_alive():
+                        raise Exception(f"A run is already going on in the ingestion process (source \"{other_source}\"), stop it first")
+                game_instance = IngestionProcess(game_class, parsed_source)
+            else:
+                game_instance: GameHandler = game_class(parsed_source)
+            game_instance.start_run(run_data)
+            GameWrapper.sessions[source] = game_instance
 
             return "ok"
 
@@ -87,14 +114,17 @@ class GameWrapper:
 
 
 
-    def stop_run():
+    def stop_run(source: str = ""):
         """
         Stops the current run of a game
         """
         try:
+            if source == "auto":
+                return GameWrapper._stop_auto_sessions()
+
             # shut down previous instance
-            if GameWrapper.game_instance is not None:
-                GameWrapper.game_instance.shutdown()
+            if source in GameWrapper.sessions:
+                GameWrapper.sessions[source].shutdown()
 
             return "ok"
 
@@ -103,7 +133,15 @@ class GameWrapper:
 
 
 
-    def get_run_status():
+    def is_running() -> bool:
+        """
+        Returns True while any session is recording a run
+        """
+        return any(session.get_state() == GameHandlerState.RUNNING for session in list(GameWrapper.sessions.values()))
+
+
+
+    def get_run_status(source: str = ""):
         """
         Returns the status of the current run
         """
@@ -111,12 +149,17 @@ class GameWrapper:
             response = {}
 
             # get status of the run
-            state = GameWrapper.game_instance.get_state()
+            game_instance = GameWrapper.sessions[source]
+            state = game_instance.get_state()
             response["state"] = str(state.name)
 
+            # add the delta to the best run, while running
+            if state == GameHandlerState.RUNNING:
+                response["live"] = game_instance.get_live_status()
+
             # add results to response, if finished
             if state == GameHandlerState.FINISHED:
-                response["results"] = GameWrapper.game_instance.get_run_result()
+                response["results"] = game_instance.get_run_result()
 
             return response
 
@@ -129,12 +172,196 @@ class GameWrapper:
     def process_run(parameters):
 
         mode = GameHandlerProcessMode[parameters["mode"]]
+        game_instance = GameWrapper.sessions[parameters.get("source", "")]
 
         if len(list(parameters.keys())) > 1:
-            edited_data = GameWrapper.game_instance.get_run_result()
+            edited_data = game_instance.get_run_result()
             edited_data.set_parameters(parameters)
         else:
             edited_data = None
 
-        GameWrapper.game_instance.process_run(mode, edited_data)
-        return "ok"
\ No newline at end of file
+        game_instance.process_run(mode, edited_data)
+        return "ok"
+
+
+
+    def get_sources():
+        """
+        Returns the rigs that sent packets to the listener, and the state of their sessions
+        """
+
+        now = time.time()
+        sources = []
+        for addr, last_seen in UdpHandler().get_sources().items():
+            source = UdpHandler.format_source(addr)
+            session = GameWrapper.sessions.get(source)
+            sources.append({
+                "source": source,
+                "last_seen_sec": round(now - last_seen, 3),
+                "state": session.get_state().name if session is not None else None,
+            })
+
+        return sources
+
+
+
+    def get_live(parameters):
+        """
+        Returns the samples of the live ring of a session written after a sequence number, so a polling client
+        only gets what is new
+
+        Available parameters:
+        - source: the session (default "")
+        - after: the cursor of the previous response (default: everything the ring holds)
+        - channels: comma separated channel names (default every channel, see the "channels" of the response)
+        - rate: samples per second to return at most (default every sample), the last sample of each 1/rate
+          interval of live_time is kept
+        - encoding: base64 (little-endian float32 array, [samples, channels] row by row) or json (list of rows), default: base64
+
+        Returns { "cursor" (pass it as after next time), "seq" (of the last sample), "lost" (samples overwritten before
+        they were read), "reset" (the cursor is from another ring, eg. of an earlier session: everything is sent again),
+        "count", "channels", "encoding", "samples" }
+
+        The cursor is "EPOCH:SEQ", every ring has its own epoch, as its sequence numbers start from 1.
+        """
+
+        try:
+            session = GameWrapper.sessions.get(parameters.get("source", ""))
+            if session is None or session.ring is None:
+                return "No live data for this session"
+
+            ring = session.ring
+            channel_names = [c for c in parameters.get("channels", "").split(",") if c != ""] or session.channel_names
+            unknown = [c for c in channel_names if c not in session.channel_names]
+            if len(unknown) > 0:
+                return "Unknown channels: " + ", ".join(unknown)
+
+            encoding = parameters.get("encoding", "base64")
+            if encoding not in ["json", "base64"]:
+                return f"Invalid encoding \"{encoding}\""
+
+            rate = float(parameters["rate"]) if "rate" in parameters else None
+            if rate is not None and rate <= 0:
+                return "The rate must be positive"
+
+            # a cursor of another ring (eg. of an earlier session) starts over
+            after = 0
+            reset = False
+            if parameters.get("after", "") != "":
+                epoch, _, after_seq = parameters["after"].partition(":")
+                if epoch == ring.epoch and after_seq.isdigit() and int(after_seq) <= ring.last_seq():
+                    after = int(after_seq)
+                else:
+                    reset = True
+
+            # only the requested columns are copied (and live_time, to decimate by)
+            columns = [session.channel_names.index(c) for c in channel_names]
+            time_column = session.channel_names.index("live_time")
+            seqs, samples = ring.read_after(after, columns=columns + [time_column])
+
+            seq = int(seqs[-1]) if len(seqs) > 0 else max(after, 0)
+            lost = int(seqs[0]) - after - 1 if len(seqs) > 0 else 0
+
+            if rate is not None and len(samples) > 1:
+                buckets = np.floor(samples[:, -1].astype(np.float64) * rate)
+                samples = samples[np.append(buckets[1:] != buckets[:-1], True)]
+            samples = samples[:, :-1]
+
+            if encoding == "base64":
+                encoded = base64.b64encode(samples.astype("<f4", copy=False).tobytes()).decode("ascii")
+            else:
+                # NaN (eg. no best run) is not valid JSON
+                encoded = [[None if math.isnan(value) else value for value in row] for row in samples.tolist()]
+
+            return {
+                "cursor": f"{ring.epoch}:{seq}",
+                "seq": seq,
+                "lost": lost,
+                "reset": reset,
+                "count": len(samples),
+                "channels": channel_names,
+                "encoding": encoding,
+                "samples": encoded,
+            }
+
+        except Exception as e:
+            return "Could not get live data" + "\n" + str(e)
+
+
+
+    # per-source session handling -----------------------------------------------------
+
+    def _get_game_class(game_name: str):
+        """
+        Returns the GameHandler subclass that matches the game name
+        """
+
+        #  get all classes that inherit from GameHandler (only works for classes that are imported here)
+        game_classes = GameHandler.__subclasses__()
+
+        return list(
+            filter(
+                lambda x: x.__name__.replace("Game", "") == game_name,
+                game_classes
+            )
+        )[0]
+
+
+
+    def _start_auto_sessions(parameters):
+        """
+        Keeps the listener open, and starts a session for every source (already seen, or new)
+        """
+
+        GameWrapper._stop_auto_sessions()
+
+        # the listener is held open while waiting for sources, with the settings of the game (the sessions reuse it)
+        game_class = GameWrapper._get_game_class(parameters["game_name"])
+        GameHandler.start_listener(AppSettings().read_setting("game_settings")[game_class.__name__.replace("Game", "")])
+        GameWrapper._auto_listening = True
+
+        GameWrapper._auto_parameters = dict(parameters)
+        udp_handler = UdpHandler()
+        udp_handler.set_source_callback(GameWrapper._on_new_source)
+        for addr in udp_handler.get_sources().keys():
+            GameWrapper._on_new_source(addr)
+
+        return "ok"
+
+
+
+    def _stop_auto_sessions():
+        """
+        Shuts down the sessions started by the "auto" source, and releases the listener
+        """
+
+        UdpHandler().set_source_callback(None)
+        GameWrapper._auto_parameters = None
+
+        for source in GameWrapper._auto_sources:
+            if source in GameWrapper.sessions:
+                GameWrapper.sessions[source].shutdown()
+        GameWrapper._auto_sources = set()
+
+        if GameWrapper._auto_listening:
+            UdpHandler().stop_listen()
+            GameWrapper._auto_listening = False
+
+        return "ok"
+
+
+
+    def _on_new_source(addr):
+        """
+        Called by the UdpHandler when a new source shows up, starts a session for it
+        """
+
+        if GameWrapper._auto_parameters is None:
+            return
+
+        parameters = dict(GameWrapper._auto_parameters)
+        parameters["source"] = UdpHandler.format_source(addr)
+        GameWrapper._auto_sources.add(parameters["source"])
+
+        # starting a run shuts down the previous session, don't do that on the listener thread
+        Thread(target=GameWrapper.start_run, args=(parameters,), daemon=True).start()
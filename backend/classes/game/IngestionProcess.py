@@ -0,0 +1,340 @@
+from multiprocessing.connection import Connection
+from threading import Lock, Thread
+from typing import List, Tuple
+import logging
+import math
+import multiprocessing
+import time
+
+from classes.base.AppSettings import AppSettings
+from classes.base.LogHandler import LogHandler
+from classes.base.PacketRing import PacketRing
+from classes.database.AttributeSearch import AttributeSearch
+from classes.game.GameHandler import GameHandler, GameHandlerProcessMode, GameHandlerState
+from classes.game.RunData import RunData
+
+
+class IngestionProcess:
+    """
+    Runs a game session (UDP listener, packet decoding and the state machine) in a child process,
+    so the web API (requests, jsonpickle, gzip) never holds the GIL the ingestion needs, and the other way around.
+
+    Has the methods of a GameHandler that GameWrapper uses, so it can stand in for one.
+
+    The child publishes:
+    - every new packet, decoded (game_class.decode_packet) and followed by GameHandler.LIVE_CHANNELS, into a PacketRing (shared memory)
+    - every state change, over a one-way pipe, read by the "ingestion-events" thread
+    Everything else (run result, stop, process) is a command, sent over a second pipe, and answered by the child.
+
+    Enabled with settings.ingestion.mode = "process" (default "thread": the session runs in a thread of this process).
+    Only one session can run in a child process at a time (the child binds the UDP port),
+    the sessions started by the "auto" source stay in threads, they share the listener of this process.
+    The metrics of the child are not in the /metrics of this process, except for the state changes, which are mirrored.
+    """
+
+    COMMAND_TIMEOUT = 30  # seconds
+
+    _context = multiprocessing.get_context("spawn")
+    _log = logging.getLogger(__name__)
+
+
+
+    def __init__(self, game_class: type, source: Tuple[str, int] = None) -> None:
+        self.game_class = game_class
+        self.game_name = game_class.__name__.replace("Game", "")
+        self.source = source
+
+        self.channel_names: List[str] = game_class.get_channel_names() + GameHandler.LIVE_CHANNELS
+        self.ring: PacketRing = None
+
+        self._state: GameHandlerState = GameHandlerState.IDLE
+        self._state_seq = 0  # number of the last state change applied, events can arrive after a newer command reply
+        self._state_lock = Lock()
+        self._command_lock = Lock()
+        self._process = None
+        self._commands: Connection = None
+        self._events: Connection = None
+
+
+
+    def get_settings() -> dict:
+        """
+        Returns the ingestion settings, with defaults for the missing keys
+        """
+
+        settings = AppSettings().read_setting("ingestion") or {}
+        return {
+            "mode": settings.get("mode", "thread"),
+            "ring_slots": settings.get("ring_slots", 8192),
+        }
+
+
+
+    def is_enabled() -> bool:
+        return IngestionProcess.get_settings()["mode"] == "process"
+
+
+
+    # GameHandler methods -------------------------------------------------------------
+
+    def start_run(self, run_config: RunData = None):
+        """
+        Starts the child process, and the run in it
+        """
+
+        if self.is_alive():
+            raise Exception("Can't start a run when not in IDLE state. Current state: " + str(self.get_state()))
+
+        settings = IngestionProcess.get_settings()
+        self._state_seq = 0
+
+        try:
+            self.ring = PacketRing(len(self.channel_names), settings["ring_slots"])
+
+            commands, child_commands = IngestionProcess._context.Pipe()
+            events, child_events = IngestionProcess._context.Pipe(duplex=False)
+
+            self._process = IngestionProcess._context.Process(
+                target=IngestionProcess._child_main,
+                args=(self.game_class, self.source, run_config, self.ring.name, self.ring.slots, self.ring.width, child_commands, child_events),
+                daemon=True,
+                name="ingestion-" + self.game_name,
+            )
+            self._process.start()
+
+            # the child holds the other ends, closing them here lets recv() see the end of the child
+            child_commands.close()
+            child_events.close()
+            self._commands = commands
+            self._events = events
+
+            Thread(target=self._read_events, daemon=True, name="ingestion-events").start()
+
+            # the run is started by the time the child answers
+            self._command("ping")
+        except Exception:
+            # frees the ring, and stops the child if it got that far
+            self.shutdown()
+            raise
+
+
+
+    def stop_run(self):
+        self._command("stop")
+
+
+
+    def process_run(self, process_mode: GameHandlerProcessMode, edited_data: RunData = None, keep_config = False):
+        self._command("process", process_mode, edited_data, keep_config)
+
+
+
+    def shutdown(self):
+        """
+        Discards the run (like GameHandler.shutdown), and stops the child process
+        """
+
+        try:
+            if self.is_alive():
+                self._command("shutdown", timeout=5)
+        except Exception as e:
+            IngestionProcess._log.warning("could not shut down the ingestion process cleanly: %s", e)
+
+        if self._process is not None:
+            self._process.join(5)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join()
+            self._process = None
+
+        if self._commands is not None:
+            self._commands.close()
+            self._commands = None
+
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+
+        self._apply_state(self._state_seq + 1, GameHandlerState.IDLE.name)
+
+
+
+    def get_state(self) -> GameHandlerState:
+        return self._state
+
+
+
+    def is_run_over(self):
+        return self._state == GameHandlerState.FINISHED or self._state == GameHandlerState.ABORTED
+
+
+
+    def get_run_result(self) -> RunData:
+        """
+        Returns the RunData (a copy, from the child) if the Run is over, None otherwise
+        """
+        if not self.is_run_over():
+            return None
+        return self._command("result")
+
+
+
+    def get_live_status(self) -> dict:
+        """
+        Returns the live comparison of the current run to the best previous run, from the last record of the ring
+        """
+
+        record = self.ring.latest() if self.ring is not None else None
+        if record is None or math.isnan(record[-1]):
+            return { "best_run_id": None, "delta_to_best": None }
+
+        delta = float(record[-2])
+        return { "best_run_id": int(record[-1]), "delta_to_best": None if math.isnan(delta) else delta }
+
+
+
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.is_alive()
+
+
+
+    # parent side -----------------------------------------------------------------------
+
+    def _command(self, *message, timeout: float = None):
+        """
+        Sends a command to the child, and returns its answer (raises the errors of the child as RuntimeError)
+        """
+
+        if not self.is_alive():
+            raise RuntimeError("The ingestion process is not running")
+
+        with self._command_lock:
+            self._commands.send(message)
+            if not self._commands.poll(timeout if timeout is not None else IngestionProcess.COMMAND_TIMEOUT):
+                raise TimeoutError(f"The ingestion process did not answer \"{message[0]}\"")
+            status, value, state_seq, state_name = self._commands.recv()
+
+        self._apply_state(state_seq, state_name)
+        if status == "error":
+            raise RuntimeError(value)
+        return value
+
+
+
+    def _read_events(self):
+        """
+        Applies the state changes sent by the child, until it exits
+        """
+
+        events = self._events
+        try:
+            while True:
+                _, state_seq, state_name = events.recv()
+                self._apply_state(state_seq, state_name)
+        except (EOFError, OSError):
+            pass
+        finally:
+            events.close()
+
+        # the child is gone, with or without a shutdown
+        self._apply_state(self._state_seq + 1, GameHandlerState.IDLE.name)
+
+
+
+    def _apply_state(self, state_seq: int, state_name: str):
+        """
+        Sets the state, if it is newer than the current one, and mirrors the state metrics of the child
+        """
+
+        with self._state_lock:
+            if state_seq <= self._state_seq:
+                return
+            self._state_seq = state_seq
+
+            new_state = GameHandlerState[state_name]
+            if new_state == self._state:
+                return
+            self._state = new_state
+
+        GameHandler._state_transitions.labels(self.game_name, new_state.name).inc()
+        GameHandler._state_timestamps.labels(self.game_name, new_state.name).set(time.time())
+
+        # the run was processed (and maybe saved) in the child
+        if new_state == GameHandlerState.IDLE:
+            AttributeSearch.invalidate(self.game_name)
+
+
+
+    # child side ------------------------------------------------------------------------
+
+    def _child_main(game_class: type, source: Tuple[str, int], run_config: RunData, ring_name: str, ring_slots: int, width: int, commands: Connection, events: Connection):
+        """
+        Entry point of the child process: runs the session, publishes its packets and states, and answers commands
+        """
+
+        LogHandler.setup()
+        ring = PacketRing(width, ring_slots, ring_name)
+        session: GameHandler = game_class(source)
+
+        # the session publishes its packets to the shared ring, instead of one of its own
+        session.ring = ring
+        state = { "seq": 0, "name": session.get_state().name }
+        events_lock = Lock()
+
+        def on_state_change(new_state):
+            # state changes come from the gather thread, and from commands (stop, process)
+            with events_lock:
+                state["seq"] += 1
+                state["name"] = new_state.name
+                try:
+                    events.send(("state", state["seq"], new_state.name))
+                except (BrokenPipeError, OSError):
+                    pass
+
+        session.on_state_change = on_state_change
+
+        try:
+            session.start_run(run_config)
+        except Exception as e:
+            # answered to the first command, and the child exits
+            commands.recv()
+            commands.send(("error", str(e), state["seq"], state["name"]))
+            return
+
+        while True:
+            try:
+                message = commands.recv()
+            except (EOFError, OSError):
+                # the parent is gone
+                message = ("shutdown",)
+
+            command, args = message[0], message[1:]
+            try:
+                match command:
+                    case "ping":
+                        value = None
+                    case "result":
+                        value = session.get_run_result()
+                    case "stop":
+                        value = session.stop_run()
+                    case "process":
+                        value = session.process_run(*args)
+                    case "shutdown":
+                        value = session.shutdown()
+                    case _:
+                        raise ValueError(f"Unknown command \"{command}\"")
+                reply = ("ok", value)
+            except Exception as e:
+                reply = ("error", str(e))
+
+            with events_lock:
+                reply = reply + (state["seq"], state["name"])
+            try:
+                commands.send(reply)
+            except (BrokenPipeError, OSError):
+                pass
+
+            if command == "shutdown":
+                break
+
+        ring.close()
@@ -0,0 +1,259 @@
+import struct
+from collections import namedtuple
+from enum import Enum
+from typing import Callable, Dict, List, Tuple, Union
+
+import numpy as np
+
+from classes.game.RunData import RunData
+
+
+class PacketField:
+    """
+    A field of a packet
+
+    :param type: struct format character (eg. "f" float32, "d" float64, "B" uint8, "H" uint16, "i" int32, "I" uint32)
+    :param offset: byte offset in the packet, right after the previous field if not set
+    """
+
+    def __init__(self, name: str, type: str = "f", offset: int = None) -> None:
+        self.name = name
+        self.type = type
+        self.offset = offset
+
+
+
+class PacketVariant:
+    """
+    A layout of the packets of a game (games can send several kinds of packets, or a different layout per setting)
+
+    A packet is of this variant if
+    - it is size bytes long (if size is set)
+    - its fields in match have the given values (if match is set, eg. { "packet_type": 3 })
+    A variant without size and match takes every packet (shorter ones are padded with 0)
+    """
+
+    def __init__(self, name: str, fields: List[PacketField], size: int = None, match: Dict[str, Union[int, float]] = None) -> None:
+        self.name = name
+        self.fields = fields
+        self.size = size
+        self.match = match or {}
+
+
+
+class PacketSchema:
+    """
+    The declared packet layout of a game, compiled once into the decoders the game handler and the telemetry use:
+    - unpack(): one packet as a record (a namedtuple of every channel, read with a single struct.Struct call),
+      for the state detection
+    - decode(): one packet as a float32 row of every channel, for the telemetry, the captures and the live ring
+    - decode_records() and columns(): many packets of a variant at once, through a numpy dtype
+    - to_run_data(): copies fields of a record to a RunData, as declared in run_data
+
+    The channels are the fields of every variant, in the order they are first declared. The channels a variant does not
+    have are 0 in its records and rows. Unpacking a packet that is too short (or None) gives 0 for the missing fields.
+
+    :param endianness: "<" (little) or ">" (big endian), for every variant
+    :param run_data: RunData attribute -> field name, or (field name, conversion), eg. { "current_sector": ("sector", int) }
+    """
+
+    def __init__(
+        self,
+        name: str,
+        variants: List[PacketVariant],
+        endianness: str = "<",
+        run_data: Dict[str, Union[str, Tuple[str, Callable]]] = None,
+    ) -> None:
+        self.name = name
+        self.endianness = endianness
+
+        self.channel_names: List[str] = []
+        for variant in variants:
+            for field in variant.fields:
+                if field.name not in self.channel_names:
+                    self.channel_names.append(field.name)
+        self.index: Dict[str, int] = { name: i for i, name in enumerate(self.channel_names) }
+
+        self.Record = namedtuple(name + "Record", self.channel_names)
+        self._empty_record = self.Record._make([0] * len(self.channel_names))
+
+        self.variants = [_CompiledVariant(variant, self) for variant in variants]
+        self._default = next((variant for variant in self.variants if variant.is_default), None)
+
+        self._run_data = [
+            (attribute, self.index[mapping], None) if isinstance(mapping, str) else (attribute, self.index[mapping[0]], mapping[1])
+            for attribute, mapping in (run_data or {}).items()
+        ]
+
+
+
+    def channel_enum(self, enum_name: str) -> Enum:
+        """
+        Returns an Enum of the channels, with their position in the records and rows as value
+        """
+        return Enum(enum_name, [(name, i) for i, name in enumerate(self.channel_names)])
+
+
+
+    def variant(self, packet: bytes) -> "_CompiledVariant":
+        """
+        Returns the variant of a packet, None if it matches none of them
+        """
+
+        for variant in self.variants:
+            if variant.matches(packet):
+                return variant
+        return self._default
+
+
+
+    def unpack(self, packet: bytes):
+        """
+        Returns the packet as a Record (fields by name, eg. record.lap_time)
+        """
+
+        if not packet:
+            return self._empty_record
+
+        variant = self.variant(packet)
+        if variant is None:
+            return self._empty_record
+
+        values = variant.unpack(packet)
+        if variant.is_identity:
+            return self.Record._make(values)
+
+        channels = [0] * len(self.channel_names)
+        for position, value in zip(variant.positions, values):
+            channels[position] = value
+        return self.Record._make(channels)
+
+
+
+    def decode(self, packet: bytes) -> np.ndarray:
+        """
+        Returns the packet as a float32 row, in the order of channel_names
+        """
+
+        variant = self.variant(packet) if packet else None
+        if variant is None:
+            return np.zeros(len(self.channel_names), dtype=np.float32)
+
+        # the layout is a float32 array already
+        if variant.is_float_array and len(packet) >= variant.size:
+            return np.frombuffer(packet, dtype=self.endianness + "f4", count=len(self.channel_names))
+
+        row = np.zeros(len(self.channel_names), dtype=np.float32)
+        row[variant.positions] = variant.unpack(packet)
+        return row
+
+
+
+    def decode_records(self, data: bytes, variant_name: str = None) -> np.ndarray:
+        """
+        Returns the packets of a buffer (of one variant, back to back, eg. a recording) as a numpy record array
+        """
+
+        variant = self.variants[0] if variant_name is None else next(v for v in self.variants if v.name == variant_name)
+        return np.frombuffer(data, dtype=variant.dtype, count=len(data) // variant.size)
+
+
+
+    def columns(self, records: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Returns the records (see decode_records) as a channel name -> contiguous float32 array dict
+        """
+
+        return {
+            name: np.ascontiguousarray(records[name], dtype=np.float32) if name in records.dtype.names else np.zeros(len(records), dtype=np.float32)
+            for name in self.channel_names
+        }
+
+
+
+    def to_run_data(self, record, run_data: RunData) -> RunData:
+        """
+        Copies the fields declared in run_data from a record to a RunData
+        """
+
+        for attribute, position, conversion in self._run_data:
+            value = record[position]
+            setattr(run_data, attribute, value if conversion is None else conversion(value))
+        return run_data
+
+
+
+class _CompiledVariant:
+    """
+    A PacketVariant, compiled into a struct.Struct (with pad bytes for the gaps) and a numpy dtype
+    """
+
+    def __init__(self, variant: PacketVariant, schema: PacketSchema) -> None:
+        self.name = variant.name
+
+        # the offsets of the fields, in declaration order
+        fields = []
+        offset = 0
+        for field in variant.fields:
+            field_offset = field.offset if field.offset is not None else offset
+            fields.append((field_offset, field))
+            offset = field_offset + struct.calcsize(schema.endianness + field.type)
+
+        # struct formats go front to back
+        fields.sort(key=lambda item: item[0])
+        layout = ""
+        offset = 0
+        for field_offset, field in fields:
+            if field_offset < offset:
+                raise ValueError(f"{schema.name}: field {field.name} of {variant.name} overlaps the previous field")
+            layout += "x" * (field_offset - offset) + field.type
+            offset = field_offset + struct.calcsize(schema.endianness + field.type)
+
+        self.size = variant.size if variant.size is not None else offset
+        self.struct = struct.Struct(schema.endianness + layout + "x" * (self.size - offset))
+        self.dtype = np.dtype({
+            "names": [field.name for _, field in fields],
+            "formats": [schema.endianness + field.type for _, field in fields],
+            "offsets": [field_offset for field_offset, _ in fields],
+            "itemsize": self.size,
+        })
+
+        # channel position of each unpacked value
+        self.positions = [schema.index[field.name] for _, field in fields]
+        self.is_identity = self.positions == list(range(len(schema.channel_names)))
+        self.is_float_array = (
+            self.is_identity
+            and all(field.type == "f" for _, field in fields)
+            and [field_offset for field_offset, _ in fields] == [i * 4 for i in range(len(fields))]
+        )
+
+        self.is_default = variant.size is None and len(variant.match) == 0
+        self._exact_size = variant.size
+        self._match = [
+            (struct.Struct(schema.endianness + field.type), field_offset, variant.match[field.name])
+            for field_offset, field in fields if field.name in variant.match
+        ]
+
+
+
+    def matches(self, packet: bytes) -> bool:
+        if self.is_default:
+            return False
+        if self._exact_size is not None and len(packet) != self._exact_size:
+            return False
+
+        for match_struct, offset, value in self._match:
+            if len(packet) < offset + match_struct.size or match_struct.unpack_from(packet, offset)[0] != value:
+                return False
+        return True
+
+
+
+    def unpack(self, packet: bytes) -> tuple:
+        """
+        Returns the values of the fields, ordered by offset (a packet too short is padded with 0)
+        """
+
+        if len(packet) < self.size:
+            packet = bytes(packet) + bytes(self.size - len(packet))
+        return self.struct.unpack_from(packet)
@@ -12,6 +12,10 @@ class RunData:
         self.lap_times_sec = [] # user chooses how it is saved in DB (GameHandler.GameHandlerProcessMode)
         self.run_time_sec : float = 0 # does not get saved in DB
 
+        self.split_times_sec = [] # time from the start at each sector change, the finish is not included
+        self.current_sector : int = 0 # does not get saved in DB
+        self.distance : float = 0 # distance from the start, does not get saved in DB
+
         self.total_laps : float = 0 # does not get saved in DB
         self.laps_completed : float = 0 # does not get saved in DB
 
@@ -0,0 +1,193 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class Downsampler:
+    """
+    Reduces telemetry channels to a target number of points for the charts.
+
+    Modes:
+    - lttb: Largest-Triangle-Three-Buckets, keeps the visual shape of the line
+    - minmax: keeps the min and max of each bucket (envelope), so spikes are never lost
+
+    Runs that are viewed repeatedly get a multi-resolution pyramid (PYRAMID_BASE, PYRAMID_BASE / 2, ... points) kept in memory,
+    later requests are downsampled from the smallest level that still has enough points, instead of the full run.
+    """
+
+    MODES = ["lttb", "minmax"]
+
+    PYRAMID_BASE = 8192  # points of the finest pyramid level
+    PYRAMID_MIN = 256  # points of the coarsest pyramid level
+    PYRAMID_VIEWS = 2  # a pyramid is built on this view of the same series
+    PYRAMID_CACHE_SIZE = 64  # number of series to keep pyramids for
+    VIEWS_CACHE_SIZE = 4096  # number of series to count views for
+
+    # class (static) variables
+    _lock: Lock = Lock()
+    _views: Dict[tuple, int] = {}
+    _pyramids: OrderedDict = OrderedDict()
+
+
+
+    def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+        """
+        Returns the indices of the points selected by Largest-Triangle-Three-Buckets.
+
+        The first and last points are always kept, the rest is split into points - 2 buckets.
+        From each bucket the point that forms the largest triangle with the previously selected point
+        and the average of the next bucket is selected.
+        """
+
+        n = len(y)
+        if points >= n or points < 3:
+            return np.arange(n)
+
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        # bucket i covers [edges[i], edges[i + 1]), buckets never are empty, because points < n
+        edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+        counts = np.diff(edges)
+
+        # averages of each bucket, the last bucket is followed by the last point
+        avg_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+        avg_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+        next_x = np.append(avg_x[1:], x[n - 1])
+        next_y = np.append(avg_y[1:], y[n - 1])
+
+        selected = np.empty(points, dtype=np.int64)
+        selected[0] = 0
+        selected[-1] = n - 1
+
+        a = 0
+        for i in range(points - 2):
+            start, stop = edges[i], edges[i + 1]
+            bucket_x = x[start:stop]
+            bucket_y = y[start:stop]
+
+            # doubled triangle area, the constant factor does not change the argmax
+            area = np.abs(
+                (x[a] - next_x[i]) * (bucket_y - y[a])
+                - (x[a] - bucket_x) * (next_y[i] - y[a])
+            )
+            a = start + int(np.argmax(area))
+            selected[i + 1] = a
+
+        return selected
+
+
+
+    def minmax(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+        """
+        Returns the indices of the min and max point of each bucket (points / 2 buckets), in order.
+        """
+
+        n = len(y)
+        if points >= n or points < 2:
+            return np.arange(n)
+
+        # equal sized buckets, the last one is padded
+        size = -(-n // (points // 2))
+        buckets = -(-n // size)
+
+        low = np.full(buckets * size, np.inf)
+        high = np.full(buckets * size, -np.inf)
+        low[:n] = y
+        high[:n] = y
+
+        offsets = np.arange(buckets) * size
+        mins = np.argmin(low.reshape(buckets, size), axis=1) + offsets
+        maxs = np.argmax(high.reshape(buckets, size), axis=1) + offsets
+
+        return np.unique(np.concatenate([mins, maxs]))
+
+
+
+    def downsample(x: np.ndarray, y: np.ndarray, points: int, mode: str = "lttb") -> np.ndarray:
+        """
+        Returns the indices of the points to keep, with the given mode
+        """
+
+        if mode == "lttb":
+            return Downsampler.lttb(x, y, points)
+        if mode == "minmax":
+            return Downsampler.minmax(x, y, points)
+        raise ValueError(f"Invalid downsampling mode \"{mode}\", expected one of {Downsampler.MODES}")
+
+
+
+    def get_series(key: tuple, x: np.ndarray, y: np.ndarray, points: int, mode: str = "lttb") -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the (x, y) of a series downsampled to at most the given number of points.
+
+        :param key: identifies the series (eg.: run id, x channel, y channel), used for the pyramid cache
+        :param x: the full resolution x values (can be a memory map, it is only read when there is no pyramid)
+        :param y: the full resolution y values
+        """
+
+        cache_key = key + (mode,)
+
+        with Downsampler._lock:
+            pyramid = Downsampler._pyramids.get(cache_key)
+            if pyramid is not None:
+                Downsampler._pyramids.move_to_end(cache_key)
+            if len(Downsampler._views) > Downsampler.VIEWS_CACHE_SIZE:
+                Downsampler._views.clear()
+            views = Downsampler._views.get(cache_key, 0) + 1
+            Downsampler._views[cache_key] = views
+
+        # build the pyramid for frequently viewed series
+        if pyramid is None and views >= Downsampler.PYRAMID_VIEWS and len(y) > Downsampler.PYRAMID_BASE:
+            pyramid = Downsampler._build_pyramid(x, y, mode)
+            with Downsampler._lock:
+                Downsampler._pyramids[cache_key] = pyramid
+                while len(Downsampler._pyramids) > Downsampler.PYRAMID_CACHE_SIZE:
+                    Downsampler._pyramids.popitem(last=False)
+
+        # use the smallest level that still has enough points
+        if pyramid is not None and points <= len(pyramid[0][1]):
+            level_x, level_y = pyramid[0]
+            for candidate_x, candidate_y in pyramid[1:]:
+                if len(candidate_y) < points:
+                    break
+                level_x, level_y = candidate_x, candidate_y
+            x, y = level_x, level_y
+
+        indices = Downsampler.downsample(x, y, points, mode)
+        return x[indices], y[indices]
+
+
+
+    def invalidate(run_id: int) -> None:
+        """
+        Drops the pyramids of a run (eg.: its telemetry was rewritten)
+        """
+
+        with Downsampler._lock:
+            for cache_key in [k for k in Downsampler._pyramids.keys() if k[0] == run_id]:
+                del Downsampler._pyramids[cache_key]
+            for cache_key in [k for k in Downsampler._views.keys() if k[0] == run_id]:
+                del Downsampler._views[cache_key]
+
+
+
+    def _build_pyramid(x: np.ndarray, y: np.ndarray, mode: str) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Returns the pyramid levels, from the finest to the coarsest.
+        Each level is downsampled from the previous one.
+        """
+
+        indices = Downsampler.downsample(x, y, Downsampler.PYRAMID_BASE, mode)
+        levels = [(np.array(x[indices]), np.array(y[indices]))]
+
+        points = Downsampler.PYRAMID_BASE // 2
+        while points >= Downsampler.PYRAMID_MIN:
+            level_x, level_y = levels[-1]
+            indices = Downsampler.downsample(level_x, level_y, points, mode)
+            levels.append((level_x[indices], level_y[indices]))
+            points //= 2
+
+        return levels
@@ -0,0 +1,148 @@
+import datetime
+import json
+import os
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from classes.base.AppSettings import AppSettings
+
+
+class PacketCapture:
+    """
+    Records every new packet of a session (in every state, not only while running), decoded to float32 channels,
+    so the runs can be detected again offline (see RunReprocessor)
+
+    - CAPTURE_PATH/GAME/DATE/TIME.bin: one record per packet, the unix time it was seen (f8) and the channels (f4)
+    - CAPTURE_PATH/GAME/DATE/TIME.json: game_name, channels, source, started
+
+    Records are kept in a preallocated block, and appended to the .bin file every BLOCK_SIZE packets (and on close),
+    a crash loses at most one block. Packets shorter than the channel list are padded with 0.
+
+    Settings are read from settings.capture ({ "enabled": bool, "path": str })
+    """
+
+    BLOCK_SIZE = 1024  # packets, about 17 s at 60 Hz
+
+
+
+    def __init__(self, game_name: str, channel_names: List[str], source: Tuple[str, int] = None) -> None:
+        started = datetime.datetime.now()
+        directory = os.path.join(PacketCapture.get_settings()["path"], game_name, started.strftime("%Y-%m-%d"))
+        os.makedirs(directory, exist_ok=True)
+
+        name = started.strftime("%H%M%S-%f")
+        self.path = os.path.join(directory, name + ".bin")
+        self.dtype = PacketCapture.record_dtype(len(channel_names))
+        self.count = 0
+
+        with open(os.path.join(directory, name + ".json"), "w") as f:
+            json.dump({
+                "game_name": game_name,
+                "channels": channel_names,
+                "source": f"{source[0]}:{source[1]}" if source is not None else None,
+                "started": started.isoformat(),
+            }, f, indent=4)
+
+        self._file = open(self.path, "ab")
+        self._block = np.zeros(PacketCapture.BLOCK_SIZE, dtype=self.dtype)
+        self._used = 0
+
+
+
+    def get_settings() -> dict:
+        """
+        Returns the capture settings, with defaults for the missing keys
+        """
+
+        settings = AppSettings().read_setting("capture") or {}
+        return {
+            "enabled": settings.get("enabled", False),
+            "path": settings.get("path", "captures"),
+        }
+
+
+
+    def is_enabled() -> bool:
+        return PacketCapture.get_settings()["enabled"]
+
+
+
+    def record_dtype(channel_count: int) -> np.dtype:
+        return np.dtype([("time", "<f8"), ("values", "<f4", (channel_count,))])
+
+
+
+    def add_packet(self, values: np.ndarray, received: float = None) -> None:
+        """
+        Adds the decoded values of a packet, seen at received (unix time, now if not set)
+        """
+
+        record = self._block[self._used]
+        record["time"] = received if received is not None else time.time()
+
+        count = min(len(values), len(record["values"]))
+        record["values"][:count] = values[:count]
+        record["values"][count:] = 0
+
+        self._used += 1
+        self.count += 1
+        if self._used == PacketCapture.BLOCK_SIZE:
+            self._flush()
+
+
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+
+        self._flush()
+        self._file.close()
+        self._file = None
+
+
+
+    def _flush(self) -> None:
+        self._block[:self._used].tofile(self._file)
+        self._file.flush()
+        self._used = 0
+
+
+
+    # reading ---------------------------------------------------------------------------
+
+    def list_captures(path: str) -> List[str]:
+        """
+        Returns the .bin files of a capture (path to the .bin file), or of every capture under a directory (eg. a day), by start time
+        """
+
+        if os.path.isfile(path):
+            return [path]
+
+        captures = []
+        for directory, _, files in os.walk(path):
+            for name in files:
+                if name.endswith(".bin") and os.path.isfile(os.path.join(directory, name[:-4] + ".json")):
+                    captures.append(os.path.join(directory, name))
+
+        return sorted(captures)
+
+
+
+    def read(path: str) -> Tuple[dict, np.ndarray, np.ndarray]:
+        """
+        Returns the meta, the times (f8) and the values (f4, one row per packet) of a capture, as memory maps.
+        A record cut off by a crash is left out.
+        """
+
+        with open(path[:-4] + ".json") as f:
+            meta = json.load(f)
+
+        dtype = PacketCapture.record_dtype(len(meta["channels"]))
+        count = os.path.getsize(path) // dtype.itemsize
+        if count == 0:
+            return meta, np.zeros(0, dtype="<f8"), np.zeros((0, len(meta["channels"])), dtype="<f4")
+
+        records = np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+        return meta, records["time"], records["values"]
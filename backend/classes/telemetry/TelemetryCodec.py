@@ -0,0 +1,144 @@
+from typing import Tuple
+import struct
+import zlib
+
+import numpy as np
+
+
+class TelemetryCodec:
+    """
+    Encodes float32 telemetry chunks into compact byte strings, and back.
+
+    Codecs (picked per chunk, by whichever is smallest):
+    - RLE: (value, run length) pairs, for channels that rarely change (gear, sector, lap counters, track length)
+    - XOR: each value XOR-ed with the previous one (like Gorilla), similar floats share their sign, exponent and top mantissa bits,
+      so the top bytes become zeros
+    - DELTA: difference of the bit patterns as integers, for steadily growing channels (run_time, distance)
+    - RAW: the values as they are, for noisy chunks that would not get smaller
+
+    The XOR and DELTA outputs are split into byte planes (all 1st bytes, then all 2nd bytes, ...),
+    so the zero bytes are next to each other, and each plane is compressed with zlib on its own.
+    The low mantissa bytes of noisy channels are close to random, those planes are stored as they are,
+    so decoding does not spend time decompressing them.
+    Bit-packing the XOR-ed values like Gorilla does would be smaller, but too slow in Python, the byte planes are vectorized.
+    """
+
+    RLE = 0
+    XOR = 1
+    DELTA = 2
+    RAW = 3
+
+    COMPRESS_LEVEL = 1  # zlib level, the higher levels are much slower for a few percent
+    RLE_MAX_RUNS = 8  # RLE is used if the chunk has at most 1 / RLE_MAX_RUNS as many runs as values
+    RAW_MIN_RATIO = 0.9  # a byte plane is stored uncompressed, if zlib can not make it smaller than this share
+
+    _PLANES_HEADER = struct.Struct("<4B4I")  # compressed flag and size of each byte plane
+
+
+
+    def encode(values: np.ndarray) -> Tuple[int, bytes]:
+        """
+        Encodes a chunk of float32 values
+
+        Returns (codec, compressed bytes)
+        """
+
+        bits = np.ascontiguousarray(values, dtype="<f4").view("<u4")
+        n = len(bits)
+        if n == 0:
+            return TelemetryCodec.RLE, zlib.compress(b"", TelemetryCodec.COMPRESS_LEVEL)
+
+        # run starts, where the value differs from the previous one
+        starts = np.flatnonzero(np.concatenate(([True], bits[1:] != bits[:-1])))
+        if len(starts) * TelemetryCodec.RLE_MAX_RUNS <= n:
+            lengths = np.diff(np.append(starts, n)).astype("<u4")
+            payload = bits[starts].tobytes() + lengths.tobytes()
+            return TelemetryCodec.RLE, zlib.compress(payload, TelemetryCodec.COMPRESS_LEVEL)
+
+        xored = bits.copy()
+        xored[1:] ^= bits[:-1]
+
+        deltas = bits.copy()
+        deltas[1:] -= bits[:-1]  # wraps around, undone by the (also wrapping) cumsum
+
+        candidates = [
+            (TelemetryCodec.XOR, TelemetryCodec._pack_planes(xored)),
+            (TelemetryCodec.DELTA, TelemetryCodec._pack_planes(deltas)),
+        ]
+        codec, (data, compressed) = min(candidates, key=lambda c: len(c[1][0]))
+
+        if not compressed:
+            return TelemetryCodec.RAW, bits.tobytes()
+        return codec, data
+
+
+
+    def decode(codec: int, data: bytes, count: int) -> np.ndarray:
+        """
+        Decodes a chunk of count values, encoded by encode()
+        """
+
+        if codec == TelemetryCodec.RAW:
+            return np.frombuffer(data, dtype="<f4", count=count)
+
+        if codec == TelemetryCodec.RLE:
+            payload = zlib.decompress(data)
+            runs = len(payload) // 8
+            values = np.frombuffer(payload, dtype="<u4", count=runs)
+            lengths = np.frombuffer(payload, dtype="<u4", offset=runs * 4)
+            return np.repeat(values, lengths).view("<f4")
+
+        words = TelemetryCodec._unpack_planes(data, count)
+        if codec == TelemetryCodec.XOR:
+            return np.bitwise_xor.accumulate(words).view("<f4")
+        if codec == TelemetryCodec.DELTA:
+            return np.cumsum(words, dtype="<u4").view("<f4")
+
+        raise ValueError(f"Unknown telemetry codec {codec}")
+
+
+
+    def _pack_planes(words: np.ndarray) -> Tuple[bytes, bool]:
+        """
+        Splits 32 bit words into 4 byte planes, and compresses the planes that get smaller
+
+        Returns (header + planes, was any plane compressed)
+        """
+
+        planes = words.view(np.uint8).reshape(-1, 4).T
+        flags = []
+        parts = []
+
+        for plane in planes:
+            raw = plane.tobytes()
+            packed = zlib.compress(raw, TelemetryCodec.COMPRESS_LEVEL)
+            if len(packed) < len(raw) * TelemetryCodec.RAW_MIN_RATIO:
+                flags.append(1)
+                parts.append(packed)
+            else:
+                flags.append(0)
+                parts.append(raw)
+
+        header = TelemetryCodec._PLANES_HEADER.pack(*flags, *[len(part) for part in parts])
+        return header + b"".join(parts), any(flags)
+
+
+
+    def _unpack_planes(data: bytes, count: int) -> np.ndarray:
+        """
+        Joins the 4 byte planes written by _pack_planes into 32 bit words
+        """
+
+        header = TelemetryCodec._PLANES_HEADER.unpack_from(data)
+        flags, sizes = header[:4], header[4:]
+
+        out = np.empty((count, 4), dtype=np.uint8)
+        pos = TelemetryCodec._PLANES_HEADER.size
+        for i in range(4):
+            plane = data[pos:pos + sizes[i]]
+            if flags[i]:
+                plane = zlib.decompress(plane)
+            out[:, i] = np.frombuffer(plane, dtype=np.uint8, count=count)
+            pos += sizes[i]
+
+        return out.view("<u4").ravel()
@@ -0,0 +1,233 @@
+from threading import Event, Thread
+from typing import Callable, List
+import datetime
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from classes.analysis.RunComparison import RunComparison
+from classes.base.AppSettings import AppSettings
+from classes.base.Metrics import Metrics
+from classes.database.DBHandler import DBHandler
+from classes.telemetry.Downsampler import Downsampler
+from classes.telemetry.TelemetryStore import TelemetryStore
+
+
+class TelemetryCompactor:
+    """
+    Background job, that downsamples the telemetry of old runs, so it does not fill up the disk.
+
+    Policy, from settings.telemetry.retention:
+    - enabled: run the job at all (default False)
+    - after_days: runs older than this are compacted (default 30)
+    - rate_hz: sample rate the runs are reduced to (default 50)
+    - keep_best: leave the fastest run of each track and car at full rate (default True)
+    - interval_minutes: time between passes (default 60)
+
+    A pass is skipped (and a started pass stops) while a run is RUNNING, and the thread runs at the lowest OS priority.
+    Runs are rewritten by TelemetryStore.save_run, as a new version, so readers see either the old or the new files.
+    Times, splits and tags live in the DB, they are not touched.
+    """
+
+    _log = logging.getLogger(__name__)
+
+    # class (static) variables
+    _thread: Thread = None
+    _stop: Event = Event()
+    _is_busy: Callable[[], bool] = None
+
+    # metrics
+    _runs_compacted = Metrics.counter("simstats_telemetry_compacted_runs_total", "Runs downsampled by the telemetry compaction")
+    _bytes_freed = Metrics.counter("simstats_telemetry_compacted_bytes_total", "Bytes freed by the telemetry compaction")
+
+
+
+    def get_settings() -> dict:
+        """
+        Returns the retention policy, with defaults for the missing keys
+        """
+
+        settings = (AppSettings().read_setting("telemetry") or {}).get("retention") or {}
+        return {
+            "enabled": settings.get("enabled", False),
+            "after_days": settings.get("after_days", 30),
+            "rate_hz": settings.get("rate_hz", 50),
+            "keep_best": settings.get("keep_best", True),
+            "interval_minutes": settings.get("interval_minutes", 60),
+        }
+
+
+
+    def start(is_busy: Callable[[], bool]) -> None:
+        """
+        Starts the background thread, if the policy is enabled
+
+        :param is_busy: returns True while a run is being recorded, compaction waits until it returns False
+        """
+
+        if not TelemetryCompactor.get_settings()["enabled"]:
+            return
+        if TelemetryCompactor._thread is not None and TelemetryCompactor._thread.is_alive():
+            return
+
+        TelemetryCompactor._is_busy = is_busy
+        TelemetryCompactor._stop.clear()
+        TelemetryCompactor._thread = Thread(target=TelemetryCompactor._loop, daemon=True, name="compaction")
+        TelemetryCompactor._thread.start()
+
+
+
+    def stop() -> None:
+        TelemetryCompactor._stop.set()
+
+
+
+    def compact(run_ids: List[int] = None) -> int:
+        """
+        Runs a compaction pass (on the given runs, or every run with telemetry)
+
+        Returns the number of runs compacted
+        """
+
+        settings = TelemetryCompactor.get_settings()
+        if run_ids is None:
+            run_ids = TelemetryStore.list_runs()
+
+        candidates = TelemetryCompactor._get_candidates(run_ids, settings)
+        compacted = 0
+
+        for run_id in candidates:
+            # yield to the recording, and to shutdown
+            if TelemetryCompactor._stop.is_set() or TelemetryCompactor._should_wait():
+                break
+
+            if TelemetryCompactor._compact_run(run_id, settings["rate_hz"]):
+                compacted += 1
+
+            # one run at a time, so the GIL is not held for long stretches
+            time.sleep(0.01)
+
+        if compacted > 0:
+            TelemetryCompactor._log.info("compacted the telemetry of %d runs to %s Hz", compacted, settings["rate_hz"])
+
+        return compacted
+
+
+
+    def _loop() -> None:
+        """
+        Runs a compaction pass every interval_minutes
+        """
+
+        TelemetryCompactor._lower_priority()
+
+        while not TelemetryCompactor._stop.is_set():
+            try:
+                if not TelemetryCompactor._should_wait():
+                    TelemetryCompactor.compact()
+            except Exception as e:
+                TelemetryCompactor._log.warning("telemetry compaction failed: %s", e)
+
+            TelemetryCompactor._stop.wait(TelemetryCompactor.get_settings()["interval_minutes"] * 60)
+
+
+
+    def _get_candidates(run_ids: List[int], settings: dict) -> List[int]:
+        """
+        Returns the runs that are old enough, not a personal best (if kept), and not compacted yet
+        """
+
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=settings["after_days"])
+        best_ids = DBHandler.get_personal_best_run_ids() if settings["keep_best"] else set()
+
+        # dates are read in batches, to stay under the bound parameter limit of SQLite
+        run_dates = {}
+        for i in range(0, len(run_ids), 500):
+            run_dates.update(DBHandler.get_run_dates(run_ids[i:i + 500]))
+
+        candidates = []
+        for run_id in run_ids:
+            if run_id in best_ids or run_id not in run_dates or run_dates[run_id] >= cutoff:
+                continue
+
+            rate_hz = TelemetryStore.read_meta(run_id).get("rate_hz")
+            if rate_hz is not None and rate_hz <= settings["rate_hz"]:
+                continue
+
+            candidates.append(run_id)
+
+        return candidates
+
+
+
+    def _compact_run(run_id: int, rate_hz: float) -> bool:
+        """
+        Keeps the first sample of every 1 / rate_hz seconds of run_time (and the last sample), and rewrites the run
+
+        Samples are selected, not interpolated, so gear, sector and the like keep valid values.
+        Returns False if the run has no run_time channel, or is already at or below the rate.
+        """
+
+        meta = TelemetryStore.read_meta(run_id)
+        if "run_time" not in meta["channels"] or meta["samples"] < 2:
+            return False
+
+        channels = TelemetryStore.load_channels(run_id, meta["channels"], mmap=False)
+
+        # the tolerance puts float32 times like 0.02 (0.0199999...) into the bucket they are meant for
+        buckets = np.floor(channels["run_time"].astype(np.float64) * rate_hz + 1e-3)
+        keep = np.flatnonzero(np.concatenate(([True], buckets[1:] != buckets[:-1])))
+        if keep[-1] != meta["samples"] - 1:
+            keep = np.append(keep, meta["samples"] - 1)
+
+        if len(keep) >= meta["samples"]:
+            return False
+
+        size_before = TelemetryCompactor._run_size(run_id)
+
+        extra_meta = { key: value for key, value in meta.items() if key not in ["run_id", "game_name", "format", "channels", "samples", "chunk_size", "chunked_channels", "version"] }
+        extra_meta["rate_hz"] = rate_hz
+        extra_meta["full_samples"] = meta.get("full_samples", meta["samples"])
+        TelemetryStore.save_run(
+            run_id,
+            meta["game_name"],
+            { name: values[keep] for name, values in channels.items() },
+            extra_meta=extra_meta,
+        )
+
+        # cached views of the old samples
+        Downsampler.invalidate(run_id)
+        RunComparison.invalidate(run_id)
+
+        TelemetryCompactor._runs_compacted.inc()
+        TelemetryCompactor._bytes_freed.inc(max(size_before - TelemetryCompactor._run_size(run_id), 0))
+        return True
+
+
+
+    def _should_wait() -> bool:
+        return TelemetryCompactor._is_busy is not None and TelemetryCompactor._is_busy()
+
+
+
+    def _run_size(run_id: int) -> int:
+        return sum(
+            os.path.getsize(os.path.join(directory, name))
+            for directory, _, names in os.walk(TelemetryStore.run_path(run_id))
+            for name in names
+        )
+
+
+
+    def _lower_priority() -> None:
+        """
+        Moves the calling thread to the lowest OS scheduling priority (Linux only, elsewhere the sleeps between runs have to do)
+        """
+
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            pass
@@ -0,0 +1,74 @@
+from typing import Callable, Dict, List
+
+import numpy as np
+
+
+class TelemetryRecorder:
+    """
+    Collects the packets of a run in memory, as rows of float32 values (decoded by the decode_packet of the game).
+
+    Packets are copied into preallocated blocks, so adding one does not reallocate the whole buffer.
+    """
+
+    BLOCK_SIZE = 16384
+
+
+
+    def __init__(self, channel_names: List[str], decode_packet: Callable[[bytes], np.ndarray]) -> None:
+        self.channel_names = channel_names
+        self.decode_packet = decode_packet
+        self._blocks: List[np.ndarray] = []
+        self._block_pos = 0
+        self._last_packet: bytes = None
+
+
+
+    def add_packet(self, data: bytes) -> bool:
+        """
+        Adds a packet to the recording.
+        The same packet object is only recorded once, so this can be called on every gather iteration.
+
+        Returns True if the packet was recorded
+        """
+
+        if data is None or data is self._last_packet:
+            return False
+        self._last_packet = data
+
+        values = self.decode_packet(data)
+
+        if len(self._blocks) == 0 or self._block_pos == TelemetryRecorder.BLOCK_SIZE:
+            self._blocks.append(np.zeros((TelemetryRecorder.BLOCK_SIZE, len(self.channel_names)), dtype=np.float32))
+            self._block_pos = 0
+
+        self._blocks[-1][self._block_pos, :len(values)] = values
+        self._block_pos += 1
+        return True
+
+
+
+    def sample_count(self) -> int:
+        """
+        Returns the number of recorded packets
+        """
+
+        if len(self._blocks) == 0:
+            return 0
+        return (len(self._blocks) - 1) * TelemetryRecorder.BLOCK_SIZE + self._block_pos
+
+
+
+    def get_channels(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the recording as a channel name -> contiguous float32 array dict
+        """
+
+        if len(self._blocks) == 0:
+            rows = np.zeros((0, len(self.channel_names)), dtype=np.float32)
+        else:
+            rows = np.concatenate(self._blocks[:-1] + [self._blocks[-1][:self._block_pos]])
+
+        return {
+            name: np.ascontiguousarray(rows[:, i])
+            for i, name in enumerate(self.channel_names)
+        }
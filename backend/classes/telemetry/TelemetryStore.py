@@ -0,0 +1,428 @@
+import json
+import os
+import shutil
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from classes.base.AppSettings import AppSettings
+from classes.telemetry.TelemetryCodec import TelemetryCodec
+
+
+class TelemetryStore:
+    """
+    Stores the telemetry of saved runs, one directory per run, in one of two formats (recorded in meta.json)
+
+    Every save writes a new version of the run, to TELEMETRY_PATH/RUN_ID/vN/, then switches TELEMETRY_PATH/RUN_ID/meta.json
+    (which names the version) to it, with one atomic rename. Readers read meta.json once, and every other file from the
+    version it names, so a rewrite (eg. by TelemetryCompactor) never mixes the files of two versions, and the run is never
+    missing. Older versions are deleted after the switch. Runs saved before versions existed keep their files in RUN_ID/.
+
+    npy: one .npy file per channel, read as memory maps
+    - VERSION/CHANNEL.npy
+    - VERSION/_index_CHANNEL.npy (monotonic version of the INDEX_CHANNELS, for range lookups)
+
+    chunked: every channel is cut into CHUNK_SIZE samples, each chunk is compressed by TelemetryCodec
+    - VERSION/chunks.bin (the compressed chunks, one after the other)
+    - VERSION/chunks.npy (chunk index, one CHUNK_INDEX_DTYPE row per chunk, ordered by channel and chunk)
+    The _index_ channels are stored as chunks too, reads only decompress the chunks they touch.
+
+    Settings are read from settings.telemetry ({ "enabled": bool, "path": str, "format": "npy" or "chunked" })
+    """
+
+    # channels that range queries can be made on
+    INDEX_CHANNELS = ["distance", "run_time"]
+
+    FORMATS = ["npy", "chunked"]
+    READ_ATTEMPTS = 3  # reads of a run that was rewritten while it was read
+    CHUNK_SIZE = 4096  # samples per chunk
+    CHUNK_INDEX_DTYPE = np.dtype([
+        ("channel", "<u2"),  # position in meta["chunked_channels"]
+        ("offset", "<u8"),  # position in chunks.bin
+        ("nbytes", "<u4"),
+        ("codec", "u1"),
+        ("count", "<u4"),  # samples in the chunk
+        ("first", "<f4"),
+        ("last", "<f4"),
+        ("min", "<f4"),
+        ("max", "<f4"),
+    ])
+
+
+
+    def get_settings() -> dict:
+        """
+        Returns the telemetry settings, with defaults for the missing keys
+        """
+
+        settings = AppSettings().read_setting("telemetry") or {}
+        return {
+            "enabled": settings.get("enabled", False),
+            "path": settings.get("path", "telemetry"),
+            "format": settings.get("format", "chunked"),
+        }
+
+
+
+    def is_enabled() -> bool:
+        return TelemetryStore.get_settings()["enabled"]
+
+
+
+    def run_path(run_id: int) -> str:
+        return os.path.join(TelemetryStore.get_settings()["path"], str(run_id))
+
+
+
+    def has_run(run_id: int) -> bool:
+        return os.path.isfile(os.path.join(TelemetryStore.run_path(run_id), "meta.json"))
+
+
+
+    def get_version(run_id: int) -> int:
+        """
+        Returns a number that changes whenever the telemetry of a run is rewritten (mtime of its meta.json),
+        for caches in other processes, that invalidate() calls do not reach
+        """
+        return os.stat(os.path.join(TelemetryStore.run_path(run_id), "meta.json")).st_mtime_ns
+
+
+
+    def list_runs() -> List[int]:
+        """
+        Returns the ids of the runs with telemetry
+        """
+
+        path = TelemetryStore.get_settings()["path"]
+        if not os.path.isdir(path):
+            return []
+
+        return sorted(
+            int(name) for name in os.listdir(path)
+            if name.isdigit() and os.path.isfile(os.path.join(path, name, "meta.json"))
+        )
+
+
+
+    def save_run(run_id: int, game_name: str, channels: Dict[str, np.ndarray], storage_format: str = None, extra_meta: dict = None) -> None:
+        """
+        Saves the channels of a run, in the format from the settings (unless storage_format is given).
+        Files are written to a new version directory first, so readers never see a half-written run.
+
+        :param extra_meta: additional keys for meta.json (eg.: the sample rate of compacted runs)
+        """
+
+        if storage_format is None:
+            storage_format = TelemetryStore.get_settings()["format"]
+        if storage_format not in TelemetryStore.FORMATS:
+            raise ValueError(f"Invalid telemetry format \"{storage_format}\", expected one of {TelemetryStore.FORMATS}")
+
+        run_path = TelemetryStore.run_path(run_id)
+        os.makedirs(run_path, exist_ok=True)
+
+        # a version number that was never used, also by a save that failed halfway
+        versions = TelemetryStore._list_versions(run_path)
+        version = max(versions, default=0) + 1
+        version_path = os.path.join(run_path, f"v{version}")
+        os.makedirs(version_path)
+
+        # distance can step back a bit (eg.: reversing after a spin), the index is its running maximum,
+        # so it can be binary searched
+        indexes = {}
+        for name in TelemetryStore.INDEX_CHANNELS:
+            if name in channels:
+                indexes["_index_" + name] = np.maximum.accumulate(channels[name])
+
+        samples = len(next(iter(channels.values()))) if len(channels) > 0 else 0
+        meta = {
+            "run_id": run_id,
+            "game_name": game_name,
+            "format": storage_format,
+            "channels": list(channels.keys()),
+            "samples": samples,
+            **(extra_meta or {}),
+            "version": version,
+        }
+
+        if storage_format == "chunked":
+            meta["chunk_size"] = TelemetryStore.CHUNK_SIZE
+            meta["chunked_channels"] = list(channels.keys()) + list(indexes.keys())
+            TelemetryStore._write_chunks(version_path, [channels[name] for name in channels] + list(indexes.values()))
+        else:
+            for name, values in {**channels, **indexes}.items():
+                np.save(os.path.join(version_path, name + ".npy"), values)
+
+        # the switch: meta.json is replaced in one rename, readers get either the old or the new version
+        temp_meta_path = os.path.join(run_path, "meta.json.tmp")
+        with open(temp_meta_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_meta_path, os.path.join(run_path, "meta.json"))
+
+        # readers that resolved an older version have opened its files by now (on Windows, files still open
+        # can't be deleted, they are retried on the next save)
+        for old_version in versions:
+            shutil.rmtree(os.path.join(run_path, f"v{old_version}"), ignore_errors=True)
+
+        # files of a run saved before versions existed
+        for name in os.listdir(run_path):
+            if name.endswith(".npy") or name == "chunks.bin":
+                os.remove(os.path.join(run_path, name))
+
+
+
+    def _list_versions(run_path: str) -> List[int]:
+        return [
+            int(name[1:]) for name in os.listdir(run_path)
+            if name.startswith("v") and name[1:].isdigit() and os.path.isdir(os.path.join(run_path, name))
+        ]
+
+
+
+    def _data_path(run_id: int, meta: dict) -> str:
+        """
+        Returns the directory of the files of the version named by meta
+        """
+
+        run_path = TelemetryStore.run_path(run_id)
+        if "version" not in meta:
+            return run_path
+        return os.path.join(run_path, f"v{meta['version']}")
+
+
+
+    def _write_chunks(path: str, channels: List[np.ndarray]) -> None:
+        """
+        Compresses the channels chunk by chunk into chunks.bin, and writes the chunk index to chunks.npy
+        """
+
+        chunk_size = TelemetryStore.CHUNK_SIZE
+        rows = []
+        offset = 0
+
+        with open(os.path.join(path, "chunks.bin"), "wb") as f:
+            for channel_id, values in enumerate(channels):
+                values = np.asarray(values, dtype=np.float32)
+                for start in range(0, max(len(values), 1), chunk_size):
+                    chunk = values[start:start + chunk_size]
+                    codec, data = TelemetryCodec.encode(chunk)
+                    f.write(data)
+
+                    if len(chunk) > 0:
+                        stats = (chunk[0], chunk[-1], chunk.min(), chunk.max())
+                    else:
+                        stats = (np.nan, np.nan, np.nan, np.nan)
+                    rows.append((channel_id, offset, len(data), codec, len(chunk)) + stats)
+                    offset += len(data)
+
+        np.save(os.path.join(path, "chunks.npy"), np.array(rows, dtype=TelemetryStore.CHUNK_INDEX_DTYPE))
+
+
+
+    def read_meta(run_id: int) -> dict:
+        """
+        Returns the meta.json of a run
+        """
+
+        with open(os.path.join(TelemetryStore.run_path(run_id), "meta.json"), "r") as f:
+            return json.load(f)
+
+
+
+    def _read_version(run_id: int, read: Callable[[dict], Any]):
+        """
+        Returns read(meta), with the meta.json of the run. If the version it names was deleted before read opened
+        its files (the run was rewritten meanwhile), read is called again with the new meta.json,
+        so every file is still read from one version
+        """
+
+        for attempt in range(TelemetryStore.READ_ATTEMPTS):
+            meta = TelemetryStore.read_meta(run_id)
+            try:
+                return read(meta)
+            except FileNotFoundError:
+                if attempt == TelemetryStore.READ_ATTEMPTS - 1 or TelemetryStore.read_meta(run_id).get("version") == meta.get("version"):
+                    raise
+
+
+
+    def load_channels(run_id: int, channel_names: List[str], mmap: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Loads channels of a run.
+        With mmap, npy arrays are read-only memory maps, only the parts that are accessed get read from disk.
+        Chunked runs are always decompressed into memory.
+        """
+
+        def read(meta: dict):
+            for name in channel_names:
+                if name not in meta["channels"]:
+                    raise KeyError(f"Run {run_id} has no telemetry channel \"{name}\"")
+
+            return TelemetryStore._load(run_id, meta, channel_names, mmap)
+
+        return TelemetryStore._read_version(run_id, read)
+
+
+
+    def load_range(run_id: int, channel_names: List[str], start: int, stop: int) -> Dict[str, np.ndarray]:
+        """
+        Loads the [start, stop) samples of channels of a run.
+        Only the pages (npy) or chunks (chunked) of the range are read from disk.
+        """
+
+        def read(meta: dict):
+            for name in channel_names:
+                if name not in meta["channels"]:
+                    raise KeyError(f"Run {run_id} has no telemetry channel \"{name}\"")
+
+            if meta.get("format", "npy") == "npy":
+                # slices of memory maps are views, data is only read (and copied) when it gets used
+                channels = TelemetryStore._load(run_id, meta, channel_names, mmap=True)
+                return { name: values[start:stop] for name, values in channels.items() }
+
+            data_path = TelemetryStore._data_path(run_id, meta)
+            chunk_index = TelemetryStore._read_chunk_index(data_path)
+            chunk_size = meta["chunk_size"]
+            first_chunk = start // chunk_size
+            last_chunk = max(first_chunk, (stop - 1) // chunk_size)
+
+            channels = {}
+            with open(os.path.join(data_path, "chunks.bin"), "rb") as f:
+                for name in channel_names:
+                    rows = TelemetryStore._channel_chunks(meta, chunk_index, name)[first_chunk:last_chunk + 1]
+                    values = TelemetryStore._decode_chunks(f, rows)
+                    channels[name] = values[start - first_chunk * chunk_size:stop - first_chunk * chunk_size]
+
+            return channels
+
+        return TelemetryStore._read_version(run_id, read)
+
+
+
+    def load_index(run_id: int, index_name: str) -> np.ndarray:
+        """
+        Returns the monotonic version of an index channel (read-only memory map for npy runs)
+        """
+
+        if index_name not in TelemetryStore.INDEX_CHANNELS:
+            raise KeyError(f"\"{index_name}\" is not an index channel, expected one of {TelemetryStore.INDEX_CHANNELS}")
+
+        def read(meta: dict):
+            if meta.get("format", "npy") == "chunked":
+                return TelemetryStore._load(run_id, meta, ["_index_" + index_name])["_index_" + index_name]
+
+            index_path = os.path.join(TelemetryStore._data_path(run_id, meta), "_index_" + index_name + ".npy")
+            if os.path.isfile(index_path):
+                return np.load(index_path, mmap_mode="r")
+
+            # runs saved before the index files existed
+            return TelemetryStore.load_channels(run_id, [index_name])[index_name]
+
+        return TelemetryStore._read_version(run_id, read)
+
+
+
+    def find_range(run_id: int, index_name: str, start_value: float = None, stop_value: float = None) -> Tuple[int, int]:
+        """
+        Returns the [start, stop) sample range, where the index channel is between start_value and stop_value.
+        Only the pages (npy) or chunks (chunked) touched by the binary search are read from disk.
+        """
+
+        def read(meta: dict):
+            if meta.get("format", "npy") == "npy":
+                index = TelemetryStore.load_index(run_id, index_name)
+                start = 0 if start_value is None else int(np.searchsorted(index, start_value, side="left"))
+                stop = len(index) if stop_value is None else int(np.searchsorted(index, stop_value, side="right"))
+                return start, max(start, stop)
+
+            if index_name not in TelemetryStore.INDEX_CHANNELS:
+                raise KeyError(f"\"{index_name}\" is not an index channel, expected one of {TelemetryStore.INDEX_CHANNELS}")
+
+            # the last value of a chunk of a monotonic channel is its max, so the chunk to decode is found by a search on them
+            data_path = TelemetryStore._data_path(run_id, meta)
+            rows = TelemetryStore._channel_chunks(meta, TelemetryStore._read_chunk_index(data_path), "_index_" + index_name)
+            with open(os.path.join(data_path, "chunks.bin"), "rb") as f:
+                start = 0 if start_value is None else TelemetryStore._search_chunks(f, rows, start_value, "left")
+                stop = meta["samples"] if stop_value is None else TelemetryStore._search_chunks(f, rows, stop_value, "right")
+
+            return start, max(start, stop)
+
+        return TelemetryStore._read_version(run_id, read)
+
+
+
+    def _load(run_id: int, meta: dict, channel_names: List[str], mmap: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Loads whole channels (including _index_ channels), in either format
+        """
+
+        data_path = TelemetryStore._data_path(run_id, meta)
+
+        if meta.get("format", "npy") == "npy":
+            return {
+                name: np.load(os.path.join(data_path, name + ".npy"), mmap_mode="r" if mmap else None)
+                for name in channel_names
+            }
+
+        chunk_index = TelemetryStore._read_chunk_index(data_path)
+        with open(os.path.join(data_path, "chunks.bin"), "rb") as f:
+            return {
+                name: TelemetryStore._decode_chunks(f, TelemetryStore._channel_chunks(meta, chunk_index, name))
+                for name in channel_names
+            }
+
+
+
+    def _read_chunk_index(data_path: str) -> np.ndarray:
+        return np.load(os.path.join(data_path, "chunks.npy"))
+
+
+
+    def _channel_chunks(meta: dict, chunk_index: np.ndarray, name: str) -> np.ndarray:
+        """
+        Returns the chunk index rows of a channel
+        """
+
+        channel_id = meta["chunked_channels"].index(name)
+        channel_ids = chunk_index["channel"]
+        return chunk_index[np.searchsorted(channel_ids, channel_id, side="left"):np.searchsorted(channel_ids, channel_id, side="right")]
+
+
+
+    def _decode_chunks(f, rows: np.ndarray) -> np.ndarray:
+        """
+        Reads and decodes consecutive chunks from chunks.bin into one array
+        """
+
+        if len(rows) == 0:
+            return np.empty(0, dtype=np.float32)
+
+        # the chunks of a channel are stored one after the other, so they are read in one go
+        f.seek(int(rows[0]["offset"]))
+        data = f.read(int(rows[-1]["offset"]) + int(rows[-1]["nbytes"]) - int(rows[0]["offset"]))
+
+        values = np.empty(int(rows["count"].sum()), dtype=np.float32)
+        data_pos = 0
+        value_pos = 0
+        for row in rows:
+            nbytes = int(row["nbytes"])
+            count = int(row["count"])
+            values[value_pos:value_pos + count] = TelemetryCodec.decode(int(row["codec"]), data[data_pos:data_pos + nbytes], count)
+            data_pos += nbytes
+            value_pos += count
+
+        return values
+
+
+
+    def _search_chunks(f, rows: np.ndarray, value: float, side: str) -> int:
+        """
+        np.searchsorted over the chunks of a monotonic channel, decodes a single chunk
+        """
+
+        chunk = int(np.searchsorted(rows["last"], value, side=side))
+        if chunk >= len(rows):
+            return int(rows["count"].sum())
+
+        chunk_start = int(rows["count"][:chunk].sum())
+        values = TelemetryStore._decode_chunks(f, rows[chunk:chunk + 1])
+        return chunk_start + int(np.searchsorted(values, value, side=side))
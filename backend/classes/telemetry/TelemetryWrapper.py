@@ -0,0 +1,180 @@
+import base64
+
+import numpy as np
+
+from classes.analysis.RunComparison import RunComparison
+from classes.base.JobQueue import JobQueue
+from classes.database.DBHandler import DBHandler
+from classes.telemetry.Downsampler import Downsampler
+from classes.telemetry.TelemetryStore import TelemetryStore
+
+
+class TelemetryWrapper:
+
+    DEFAULT_POINTS = 1000
+    MIN_POINTS = 3  # fewer points would return every sample (see Downsampler)
+    MAX_POINTS = 10000
+
+    def get_chart(run_id: int, parameters):
+        """
+        Returns channels of a run, downsampled for charts
+
+        Available parameters:
+        - channels: comma separated channel names
+        - x: channel to use as the x axis (default: distance)
+        - points: target number of points per channel (default: DEFAULT_POINTS, MIN_POINTS to MAX_POINTS)
+        - mode: lttb or minmax (default: lttb)
+        """
+        try:
+            channel_names = [c for c in parameters.get("channels", "").split(",") if c != ""]
+            x_name = parameters.get("x", "distance")
+            points = min(int(parameters.get("points", TelemetryWrapper.DEFAULT_POINTS)), TelemetryWrapper.MAX_POINTS)
+            mode = parameters.get("mode", "lttb")
+
+            if len(channel_names) == 0:
+                return "No channels given"
+            if points < TelemetryWrapper.MIN_POINTS:
+                return f"points must be at least {TelemetryWrapper.MIN_POINTS}"
+            if mode not in Downsampler.MODES:
+                return f"Invalid mode \"{mode}\""
+            if not TelemetryStore.has_run(run_id):
+                return f"Run {run_id} has no telemetry"
+
+            channels = TelemetryStore.load_channels(run_id, [x_name] + channel_names)
+
+            series = {}
+            for name in channel_names:
+                x, y = Downsampler.get_series(
+                    (run_id, x_name, name), channels[x_name], channels[name], points, mode
+                )
+                series[name] = {
+                    "x": np.round(x.astype(np.float64), 3).tolist(),
+                    "y": np.round(y.astype(np.float64), 3).tolist(),
+                }
+
+            return {
+                "run_id": run_id,
+                "x": x_name,
+                "mode": mode,
+                "samples": len(channels[x_name]),
+                "series": series,
+            }
+
+        except Exception as e:
+            return "Could not get chart data" + "\n" + str(e)
+
+
+
+
+    def get_range(run_id: int, parameters):
+        """
+        Returns the full resolution channels of a run, in a distance or time range
+
+        Available parameters:
+        - channels: comma separated channel names
+        - from_distance, to_distance: distance range (meters)
+        - from_time, to_time: run_time range (seconds), only used if no distance range is given
+        - encoding: json (lists of numbers) or base64 (little-endian float32 arrays), default: json
+        """
+        try:
+            channel_names = [c for c in parameters.get("channels", "").split(",") if c != ""]
+            encoding = parameters.get("encoding", "json")
+
+            if len(channel_names) == 0:
+                return "No channels given"
+            if encoding not in ["json", "base64"]:
+                return f"Invalid encoding \"{encoding}\""
+            if not TelemetryStore.has_run(run_id):
+                return f"Run {run_id} has no telemetry"
+
+            # find the sample range on the matching index channel
+            if "from_distance" in parameters or "to_distance" in parameters:
+                index_name, from_key, to_key = "distance", "from_distance", "to_distance"
+            else:
+                index_name, from_key, to_key = "run_time", "from_time", "to_time"
+            start, stop = TelemetryStore.find_range(
+                run_id,
+                index_name,
+                float(parameters[from_key]) if from_key in parameters else None,
+                float(parameters[to_key]) if to_key in parameters else None,
+            )
+
+            # only the pages / chunks of the range are read
+            channels = TelemetryStore.load_range(run_id, channel_names, start, stop)
+            values = {}
+            for name in channel_names:
+                view = channels[name]
+                if encoding == "base64":
+                    values[name] = base64.b64encode(view.astype("<f4", copy=False).tobytes()).decode("ascii")
+                else:
+                    values[name] = view.tolist()
+
+            return {
+                "run_id": run_id,
+                "index": index_name,
+                "start": start,
+                "stop": stop,
+                "encoding": encoding,
+                "channels": values,
+            }
+
+        except Exception as e:
+            return "Could not get telemetry" + "\n" + str(e)
+
+
+
+    def compare_runs(parameters):
+        """
+        Compares runs to a reference run, with delta-time traces and per-segment gains
+
+        Available parameters:
+        - reference: id of the reference run
+        - runs: comma separated ids of the runs to compare
+        - best: compare to the N fastest runs on the same track (that have telemetry), instead of the runs list
+        - same_car: with best, only use runs with the same car as the reference (1 / 0)
+        - segments: number of segments for the gains and losses (default: 10)
+        - resolution: distance between the delta trace points, in meters (default: 10)
+        - wait: seconds to wait for the result (default: settings.jobs.timeout_seconds, 0 returns right away)
+
+        The comparison runs in the JobQueue, if it is not done within wait, the job is returned ({ "id", "state", ... }),
+        and the result can be fetched from /jobs/<id>
+        """
+        try:
+            if "reference" not in parameters:
+                return "No reference run given"
+            reference_id = int(parameters["reference"])
+
+            if "best" in parameters:
+                best = int(parameters["best"])
+                same_car = parameters.get("same_car", "0") == "1"
+                run_ids = []
+                for run_id in DBHandler.get_best_run_ids(reference_id, same_car):
+                    if len(run_ids) == best:
+                        break
+                    if run_id != reference_id and TelemetryStore.has_run(run_id):
+                        run_ids.append(run_id)
+            else:
+                run_ids = [int(r) for r in parameters.get("runs", "").split(",") if r != ""]
+
+            if len(run_ids) == 0:
+                return "No runs to compare"
+
+            segments = int(parameters.get("segments", 10))
+            resolution = float(parameters.get("resolution", 10.0))
+            wait = float(parameters.get("wait", JobQueue.get_settings()["timeout_seconds"]))
+
+            # the key changes when any of the runs is rewritten, so cached results never outlive the telemetry
+            versions = [TelemetryStore.get_version(r) if TelemetryStore.has_run(r) else 0 for r in [reference_id] + run_ids]
+            cache_key = f"compare:{reference_id}:{run_ids}:{segments}:{resolution}:{versions}"
+
+            job_id = JobQueue.submit("compare", RunComparison.compare, (reference_id, run_ids, segments, resolution), cache_key)
+            job = JobQueue.wait(job_id, wait) if wait > 0 else JobQueue.get(job_id)
+
+            if job["state"] == "done":
+                return job["result"]
+            if job["state"] == "failed":
+                return "Could not compare runs" + "\n" + job["error"]
+            return job
+
+        except Exception as e:
+            return "Could not compare runs" + "\n" + str(e)
\ No newline at end of file
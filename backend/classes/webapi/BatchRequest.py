@@ -0,0 +1,144 @@
+import contextvars
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from flask import Flask
+from werkzeug.exceptions import HTTPException
+
+from classes.base.Metrics import Metrics
+from classes.database.DBHandler import DBHandler
+from classes.webapi.JsonResponse import JsonResponse, Unencoded
+
+
+class BatchRequest:
+    """
+    Runs the sub-requests of a /batch call, eg. the game list, the attributes of every game and the run status,
+    that the UI would otherwise fetch one by one.
+
+    A sub-request is { "id" (optional), "method" (default GET), "path" (with the query string), "body" (optional) },
+    its result is { "id", "status", "body" }, in the order of the sub-requests.
+
+    - consecutive GET sub-requests run concurrently, on WORKERS threads. Other methods run alone, in order,
+      after the ones before them finished (so a GET after a POST sees its effect).
+    - identical GET sub-requests run once
+    - the DB reads of the sub-requests are shared (see DBHandler.batch_memo), eg. the tag list of every game
+    - the results are not encoded by the sub-requests, the /batch response encodes and compresses them at once
+    """
+
+    MAX_REQUESTS = 50
+    WORKERS = 4
+
+    _log = logging.getLogger(__name__)
+
+    # metrics
+    _sub_requests = Metrics.counter("simstats_batch_sub_requests_total", "Sub-requests of /batch calls, executed or answered by an identical one", ("result",))
+
+    # class (static) variables
+    _executor = ThreadPoolExecutor(WORKERS, thread_name_prefix="batch")
+
+
+
+    def run(app: Flask, sub_requests: List[dict], remote_addr: str = None) -> List[dict]:
+        """
+        Runs the sub-requests, and returns their results
+        """
+
+        if not isinstance(sub_requests, list):
+            raise ValueError("requests must be a list")
+        if len(sub_requests) > BatchRequest.MAX_REQUESTS:
+            raise ValueError(f"At most {BatchRequest.MAX_REQUESTS} requests can be batched")
+        for sub_request in sub_requests:
+            if not isinstance(sub_request, dict) or not isinstance(sub_request.get("path"), str):
+                raise ValueError("Every request needs a path")
+
+        # the memo is set before the contexts of the sub-requests are copied, so they all share it
+        memo_token = DBHandler.batch_memo.set({})
+        try:
+            results = [None] * len(sub_requests)
+            pending = {}  # key: (future, positions) of the GET sub-requests since the last barrier
+
+            for position, sub_request in enumerate(sub_requests):
+                method = sub_request.get("method", "GET").upper()
+
+                if method != "GET":
+                    BatchRequest._collect(pending, results)
+                    results[position] = BatchRequest._run_one(app, sub_request, method, remote_addr)
+                    BatchRequest._sub_requests.labels("executed").inc()
+
+                    # it may have changed what the earlier reads returned
+                    DBHandler.batch_memo.get().clear()
+                    continue
+
+                key = (sub_request["path"], json.dumps(sub_request.get("body"), sort_keys=True))
+                if key in pending:
+                    pending[key][1].append(position)
+                    BatchRequest._sub_requests.labels("deduplicated").inc()
+                    continue
+
+                context = contextvars.copy_context()
+                future = BatchRequest._executor.submit(context.run, BatchRequest._run_one, app, sub_request, method, remote_addr)
+                pending[key] = (future, [position])
+                BatchRequest._sub_requests.labels("executed").inc()
+
+            BatchRequest._collect(pending, results)
+
+        finally:
+            DBHandler.batch_memo.reset(memo_token)
+
+        # the ids are given back as they were, for every copy of a deduplicated sub-request
+        return [
+            { "id": sub_request.get("id", position), **result }
+            for position, (sub_request, result) in enumerate(zip(sub_requests, results))
+        ]
+
+
+
+    def _collect(pending: dict, results: list) -> None:
+        """
+        Waits for the running GET sub-requests, and stores their results
+        """
+
+        for future, positions in pending.values():
+            result = future.result()
+            for position in positions:
+                results[position] = result
+
+        pending.clear()
+
+
+
+    def _run_one(app: Flask, sub_request: dict, method: str, remote_addr: str) -> dict:
+        """
+        Runs a sub-request through the view of its route, and returns { "status", "body" }
+        """
+
+        batched_token = JsonResponse.batched.set(True)
+        try:
+            environ_base = { "REMOTE_ADDR": remote_addr } if remote_addr is not None else None
+            with app.test_request_context(sub_request["path"], method=method, json=sub_request.get("body"), environ_base=environ_base) as ctx:
+                request = ctx.request
+                if request.routing_exception is not None:
+                    raise request.routing_exception
+
+                if request.url_rule.endpoint == "batch":
+                    return { "status": 400, "body": "A batch can not contain /batch" }
+
+                response = app.view_functions[request.url_rule.endpoint](**request.view_args)
+
+            # eg. /metrics or /runs/export, that don't return JSON
+            if not isinstance(response, Unencoded):
+                return { "status": 400, "body": f"{sub_request['path']} can not be called in a batch" }
+
+            return { "status": 200, "body": response.message }
+
+        except HTTPException as e:
+            return { "status": e.code, "body": e.description }
+
+        except Exception as e:
+            BatchRequest._log.exception("batched request %s %s failed", method, sub_request["path"])
+            return { "status": 500, "body": "Could not run request" + "\n" + str(e) }
+
+        finally:
+            JsonResponse.batched.reset(batched_token)
@@ -1,9 +1,18 @@
-from flask import Flask, request
+from flask import Flask, Response, g, make_response, request, stream_with_context
 from flask_cors import CORS
+import datetime
 import logging
+import time
 
+from classes.base.JobQueue import JobQueue
+from classes.base.Metrics import Metrics
+from classes.base.Profiler import Profiler
+from classes.webapi.BatchRequest import BatchRequest
 from classes.webapi.JsonResponse import JsonResponse
+from classes.database.DBHandler import DBHandler
+from classes.database.RunExporter import RunExporter
 from classes.game.GameWrapper import GameWrapper
+from classes.telemetry.TelemetryWrapper import TelemetryWrapper
 
 class FlaskApp:
 
@@ -18,7 +27,66 @@ class FlaskApp:
     # disable logging of API calls
     log = logging.getLogger('werkzeug')
     log.setLevel(logging.ERROR)
-    
+
+    # metrics
+    _request_seconds = Metrics.histogram("simstats_request_seconds", "Time spent handling API requests", ("route", "method"))
+
+
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        if Profiler.active:
+            Profiler.request_started()
+
+
+
+    @app.after_request
+    def observe_request_time(response):
+        if Profiler.active:
+            Profiler.request_finished()
+
+        # label by the route pattern (not the path), so the number of labels stays bounded
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        FlaskApp._request_seconds.labels(route, request.method).observe(time.perf_counter() - g.request_start)
+        return response
+
+
+
+    @app.route("/metrics")
+    def get_metrics():
+        """
+        Returns the metrics in the Prometheus text format
+        """
+
+        resp = make_response(Metrics.render())
+        resp.headers["Content-Type"] = "text/plain; version=0.0.4"
+        return resp
+
+
+
+    @app.route("/debug/profile", methods=["GET", "POST"])
+    def profile():
+        """
+        POST: starts profiling the gather threads and/or API requests ({ "seconds", "target", "format" })
+        GET: returns the status of the profiler
+        """
+
+        if request.method == "GET":
+            return JsonResponse.make_response(Profiler.get_status())
+
+        parameters = request.get_json(silent=True) or {}
+        try:
+            output_path = Profiler.start(
+                float(parameters.get("seconds", 10)),
+                parameters.get("target", "all"),
+                parameters.get("format", "collapsed"),
+            )
+            return JsonResponse.make_response({ "output": output_path })
+
+        except Exception as e:
+            return JsonResponse.make_response("Could not start profiling" + "\n" + str(e))
+
 
 
     @app.route("/test")
@@ -30,6 +98,25 @@ class FlaskApp:
 
 
 
+    @app.route("/batch", methods=["POST"])
+    def batch():
+        """
+        Runs several API calls, and returns their results in one response
+
+        Body: { "requests": [ { "id" (optional), "method" (default GET), "path", "body" (optional) } ] }
+        Returns: { "responses": [ { "id", "status", "body" } ] }, in the order of the requests
+        """
+
+        parameters = request.get_json(silent=True) or {}
+        try:
+            responses = BatchRequest.run(FlaskApp.app, parameters.get("requests"), request.remote_addr)
+            return JsonResponse.make_response({ "responses": responses })
+
+        except Exception as e:
+            return JsonResponse.make_response("Could not run batch" + "\n" + str(e))
+
+
+
     @app.route("/game/list")
     def get_game_list():
         """
@@ -47,9 +134,37 @@ class FlaskApp:
         
         # get game name from query parameters of request
         game_name = request.args.get("name")
+        lite = request.args.get("lite", "false").lower() in ["1", "true"]
 
         # return attributes of game
-        return JsonResponse.make_response(GameWrapper.get_game_attributes(game_name))
+        return JsonResponse.make_response(GameWrapper.get_game_attributes(game_name, lite))
+
+
+
+    @app.route("/game/search")
+    def search_game_attributes():
+        """
+        Returns the tracks, cars and tags of a game matching a (partial or misspelled) query
+
+        Query parameters:
+        - name: the game
+        - q: the query
+        - kinds (optional): comma separated, any of track, car, tag
+        - limit (optional): matches per kind (default 10, max 100)
+        """
+
+        try:
+            game_name = request.args.get("name")
+            query = request.args.get("q", "")
+            kinds = request.args["kinds"].split(",") if "kinds" in request.args else None
+            limit = min(int(request.args.get("limit", 10)), 100)
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+
+        except Exception as e:
+            return JsonResponse.make_response("Could not search attributes" + "\n" + str(e))
+
+        return JsonResponse.make_response(GameWrapper.search_attributes(game_name, query, kinds, limit))
 
 
 
@@ -77,8 +192,11 @@ class FlaskApp:
         Stops the current run of a game
         """
 
+        # get the source of the run (optional)
+        parameters = request.get_json(silent=True) or {}
+
         # stop the run
-        return JsonResponse.make_response(GameWrapper.stop_run())
+        return JsonResponse.make_response(GameWrapper.stop_run(parameters.get("source", "")))
 
 
     
@@ -89,7 +207,27 @@ class FlaskApp:
         """
 
         # get status of the run
-        return JsonResponse.make_response(GameWrapper.get_run_status())
+        return JsonResponse.make_response(GameWrapper.get_run_status(request.args.get("source", "")))
+
+
+    
+    @app.route("/game/live")
+    def get_live():
+        """
+        Returns the samples of the current session since the last poll (see GameWrapper.get_live)
+
+        Query parameters: source, after, channels, rate, encoding
+        """
+        return JsonResponse.make_response(GameWrapper.get_live(request.args))
+
+
+    
+    @app.route("/game/sources")
+    def get_sources():
+        """
+        Returns the rigs sending packets, and the state of their sessions
+        """
+        return JsonResponse.make_response(GameWrapper.get_sources())
 
 
     
@@ -107,4 +245,155 @@ class FlaskApp:
             return JsonResponse.make_response("No mode given")
 
         # process the run
-        return JsonResponse.make_response(GameWrapper.process_run(parameters))
\ No newline at end of file
+        return JsonResponse.make_response(GameWrapper.process_run(parameters))
+
+
+
+    @app.route("/runs")
+    def get_runs():
+        """
+        Returns a page of the run history
+
+        Query parameters:
+        - filters (optional): game, track, car, car_class, conditions, tags (comma separated), from, to (ISO dates)
+        - sort: date or time, order: asc or desc
+        - cursor: next_cursor of the previous page
+        - limit: page size (default 50, max 500)
+        """
+
+        try:
+            filters = {}
+            for key in ["game", "track", "car", "car_class", "conditions"]:
+                if key in request.args:
+                    filters[key] = request.args[key]
+            if "tags" in request.args:
+                filters["tags"] = [t for t in request.args["tags"].split(",") if t != ""]
+            if "from" in request.args:
+                filters["date_from"] = datetime.datetime.fromisoformat(request.args["from"])
+            if "to" in request.args:
+                filters["date_to"] = datetime.datetime.fromisoformat(request.args["to"])
+            limit = min(int(request.args.get("limit", 50)), 500)
+            if limit < 1:
+                raise ValueError("limit must be at least 1")
+
+            return JsonResponse.make_response(DBHandler.get_runs(
+                filters,
+                request.args.get("sort", "date"),
+                request.args.get("order"),
+                request.args.get("cursor"),
+                limit,
+            ))
+
+        except Exception as e:
+            return JsonResponse.make_response("Could not get runs" + "\n" + str(e))
+
+
+
+    @app.route("/runs/<int:run_id>/chart")
+    def get_run_chart(run_id: int):
+        """
+        Returns telemetry channels of a run, downsampled for charts
+        """
+
+        # get chart parameters from query parameters of request
+        return JsonResponse.make_response(TelemetryWrapper.get_chart(run_id, request.args))
+
+
+
+    @app.route("/runs/<int:run_id>/telemetry")
+    def get_run_telemetry(run_id: int):
+        """
+        Returns full resolution telemetry channels of a run, in a distance or time range
+        """
+
+        # get range parameters from query parameters of request
+        return JsonResponse.make_response(TelemetryWrapper.get_range(run_id, request.args))
+
+
+
+    @app.route("/runs/compare")
+    def compare_runs():
+        """
+        Compares runs to a reference run (delta-time traces, segment gains and losses)
+        """
+
+        # get comparison parameters from query parameters of request
+        return JsonResponse.make_response(TelemetryWrapper.compare_runs(request.args))
+
+
+
+    @app.route("/jobs/<job_id>")
+    def get_job(job_id):
+        """
+        Returns the state of an analytics job, and its result once it is done
+
+        Query parameters:
+        - wait (optional): seconds to wait for the job to finish
+        """
+
+        try:
+            wait = float(request.args.get("wait", 0))
+            return JsonResponse.make_response(JobQueue.wait(job_id, wait) if wait > 0 else JobQueue.get(job_id))
+
+        except Exception as e:
+            return JsonResponse.make_response("Could not get job" + "\n" + str(e))
+
+
+
+    @app.route("/jobs/<job_id>/cancel", methods=["POST"])
+    def cancel_job(job_id):
+        """
+        Cancels an analytics job
+        """
+
+        try:
+            return JsonResponse.make_response(JobQueue.cancel(job_id))
+
+        except Exception as e:
+            return JsonResponse.make_response("Could not cancel job" + "\n" + str(e))
+
+
+
+    @app.route("/runs/splits/best")
+    def get_best_sectors():
+        """
+        Returns the best sector times on a track, and the theoretical best run
+        """
+
+        # get game, track and car (optional) from query parameters of request
+        game_name = request.args.get("game")
+        track_name = request.args.get("track")
+        car_name = request.args.get("car")
+
+        if game_name is None or track_name is None:
+            return JsonResponse.make_response("No game or track given")
+
+        return JsonResponse.make_response(DBHandler.get_best_sectors(game_name, track_name, car_name))
+
+
+
+    @app.route("/runs/export")
+    def export_runs():
+        """
+        Streams the runs as CSV, NDJSON or Parquet
+
+        Query parameters: format, and the optional filters game, track, from, to (ISO dates), tag
+        """
+
+        output_format = request.args.get("format", "csv")
+        try:
+            query = RunExporter.build_query(
+                request.args.get("game"),
+                request.args.get("track"),
+                datetime.datetime.fromisoformat(request.args["from"]) if "from" in request.args else None,
+                datetime.datetime.fromisoformat(request.args["to"]) if "to" in request.args else None,
+                request.args.get("tag"),
+            )
+            chunks = RunExporter.export(output_format, query)
+
+        except Exception as e:
+            return JsonResponse.make_response("Could not export runs" + "\n" + str(e))
+
+        resp = Response(stream_with_context(chunks), content_type=RunExporter.CONTENT_TYPES[output_format])
+        resp.headers["Content-Disposition"] = f"attachment; filename=runs.{output_format}"
+        return resp
\ No newline at end of file
@@ -1,13 +1,28 @@
+from contextvars import ContextVar
 from flask import make_response
 import jsonpickle
 import gzip
 
+from classes.base.Metrics import Metrics
+
 class JsonResponse:
 
+    # metrics
+    _response_bytes = Metrics.counter("simstats_response_bytes_total", "Bytes of the JSON responses, before (identity) and after gzip", ("encoding",))
+
+    # set for the sub-requests of a /batch call: the message is returned as it is,
+    # and encoded (and compressed) once, with the others, by the /batch response
+    batched: ContextVar[bool] = ContextVar("batched", default=False)
+
     def make_response(message):
-        content = gzip.compress(
-            jsonpickle.encode(message, unpicklable=False).encode('utf-8')
-        )
+        if JsonResponse.batched.get():
+            return Unencoded(message)
+
+        raw = jsonpickle.encode(message, unpicklable=False).encode('utf-8')
+        content = gzip.compress(raw)
+
+        JsonResponse._response_bytes.labels("identity").inc(len(raw))
+        JsonResponse._response_bytes.labels("gzip").inc(len(content))
 
         resp = make_response(content)
 
@@ -15,4 +30,12 @@ class JsonResponse:
         resp.headers["Content-Length"] = len(content)
         resp.headers["Content-Encoding"] = "gzip"
 
-        return resp
\ No newline at end of file
+        return resp
+
+class Unencoded:
+    """
+    The message of a batched sub-request, not yet encoded
+    """
+
+    def __init__(self, message):
+        self.message = message
@@ -1,9 +1,150 @@
+import argparse
+import datetime
+import time
+
+from classes.base.LogHandler import LogHandler, TraceFileHandler
+from classes.base.Profiler import Profiler
 from classes.database.DBHandler import DBHandler
+from classes.database.IdentificationCache import IdentificationCache
+from classes.database.RunExporter import RunExporter
+from classes.database.RunImporter import RunImporter
+from classes.database.RunReprocessor import RunReprocessor
+from classes.game.DirtRally2Simulator import DirtRally2Simulator
+from classes.game.GameWrapper import GameWrapper
+from classes.telemetry.TelemetryCompactor import TelemetryCompactor
 from classes.webapi.FlaskApp import FlaskApp
 
 def main():
+    parser = argparse.ArgumentParser(description="sim-stats backend")
+    parser.add_argument("--profile", type=float, metavar="SECONDS", help="profile the backend for SECONDS after startup")
+    parser.add_argument("--profile-target", choices=Profiler.TARGETS, default="all", help="threads to profile (default: all)")
+    parser.add_argument("--profile-format", choices=Profiler.FORMATS, default="collapsed", help="profile output format (default: collapsed)")
+    parser.add_argument("--import-runs", metavar="PATH", help="import runs from another logger, then exit")
+    parser.add_argument("--import-format", choices=RunImporter.FORMATS, default="dtr", help="format of the imported file: dirt-rally-time-recorder database, or CSV (default: dtr)")
+    parser.add_argument("--import-tag", metavar="TAG", help="tag to add to the imported runs")
+    parser.add_argument("--export-runs", metavar="PATH", help="export runs to a file, then exit")
+    parser.add_argument("--export-format", choices=RunExporter.FORMATS, default="csv", help="format of the exported file (default: csv)")
+    parser.add_argument("--export-game", metavar="GAME", help="only export runs of this game")
+    parser.add_argument("--export-track", metavar="TRACK", help="only export runs on this track")
+    parser.add_argument("--export-from", type=datetime.datetime.fromisoformat, metavar="DATE", help="only export runs from this date (ISO format)")
+    parser.add_argument("--export-to", type=datetime.datetime.fromisoformat, metavar="DATE", help="only export runs before this date (ISO format)")
+    parser.add_argument("--export-tag", metavar="TAG", help="only export runs with this tag")
+    parser.add_argument("--simulate", metavar="HOST:PORT", help="send synthetic Dirt Rally 2 packets to HOST:PORT, then exit (\"check\": to a session started here, and verify the saved runs)")
+    parser.add_argument("--simulate-runs", type=int, default=10, metavar="N", help="number of stage attempts (default: 10)")
+    parser.add_argument("--simulate-rate", type=float, default=60, metavar="HZ", help="packets sent per second (default: 60)")
+    parser.add_argument("--simulate-speed", type=float, default=1, metavar="FACTOR", help="game seconds per second, above 1 the stages run faster (default: 1)")
+    parser.add_argument("--simulate-aborts", type=float, default=0.1, metavar="SHARE", help="share of the attempts that are aborted (default: 0.1)")
+    parser.add_argument("--simulate-restarts", type=float, default=0.1, metavar="SHARE", help="share of the attempts that are restarted in-game (default: 0.1)")
+    parser.add_argument("--simulate-seed", type=int, metavar="SEED", help="random seed, the same seed gives the same session")
+    parser.add_argument("--reprocess", metavar="PATH", help="detect the runs of captured sessions again (a capture, or a directory, eg. captures/DirtRally2/DATE), save the missing ones and fix the 0 times, then exit (\"telemetry\": fix the 0 times from the telemetry of the runs)")
+    parser.add_argument("--reprocess-tag", metavar="TAG", help="tag to add to the runs saved by reprocessing")
+    parser.add_argument("--reprocess-dry-run", action="store_true", help="only print what reprocessing would change")
+    parser.add_argument("--read-trace", metavar="PATH", help="print the records of a trace file (settings.logging.trace), then exit")
+    args = parser.parse_args()
+
+    LogHandler.setup()
+
+    if args.read_trace is not None:
+        read_trace(args.read_trace)
+        return
+
+    if args.import_runs is not None:
+        import_runs(args.import_runs, args.import_format, args.import_tag)
+        return
+
+    if args.export_runs is not None:
+        export_runs(args)
+        return
+
+    if args.simulate is not None:
+        simulate(args)
+        return
+
+    if args.reprocess is not None:
+        reprocess(args)
+        return
+
+    if args.profile is not None:
+        print("* profiling, output: " + Profiler.start(args.profile, args.profile_target, args.profile_format))
+
+    # car and track corrections of the user, checked before the static identification tables
+    for game_name in GameWrapper.get_game_list():
+        IdentificationCache.load(game_name)
+
+    # downsample the telemetry of old runs in the background (if enabled in the settings)
+    TelemetryCompactor.start(GameWrapper.is_running)
+
     FlaskApp.app.run()
 
 
+def import_runs(path, source_format, tag):
+    start_time = time.perf_counter()
+
+    def progress(counters):
+        rate = counters["read"] / max(time.perf_counter() - start_time, 0.001)
+        print(f"* read {counters['read']} rows ({rate:.0f} rows/s), inserted {counters['inserted']}, skipped {counters['skipped']}")
+
+    counters = RunImporter.import_runs(path, source_format, tag, progress)
+    print(f"* import finished in {time.perf_counter() - start_time:.1f} s, inserted {counters['inserted']} of {counters['read']} rows")
+
+
+def export_runs(args):
+    start_time = time.perf_counter()
+
+    query = RunExporter.build_query(args.export_game, args.export_track, args.export_from, args.export_to, args.export_tag)
+    chunks = RunExporter.export(args.export_format, query)
+    with open(args.export_runs, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+    print(f"* export finished in {time.perf_counter() - start_time:.1f} s")
+
+
+def simulate(args):
+    plan = DirtRally2Simulator.plan_session(args.simulate_runs, args.simulate_aborts, args.simulate_restarts, args.simulate_seed)
+    print(f"* simulating {args.simulate_runs} attempts of {plan['track'][0]} with the {plan['car'][0]} (seed {plan['seed']}): {', '.join(plan['outcomes'])}")
+
+    if args.simulate == "check":
+        stats = DirtRally2Simulator.check(plan, args.simulate_rate, args.simulate_speed)
+    else:
+        host, port = args.simulate.rsplit(":", 1)
+        stats = DirtRally2Simulator.send(DirtRally2Simulator.generate(plan, args.simulate_rate, args.simulate_speed), (host, int(port)), args.simulate_rate)
+
+    print(f"* sent {stats['packets']} packets in {stats['seconds']:.1f} s ({stats['rate']:.0f} packets/s, sender CPU {stats['cpu_seconds'] / max(stats['packets'], 1) * 1e6:.1f} us/packet)")
+
+    if args.simulate == "check":
+        print(f"* backend CPU {stats['cpu_per_packet'] * 1e6:.1f} us/packet, saved {len(stats['saved'])} of {len(stats['expected'])} finished runs")
+        for error in stats["errors"]:
+            print("* mismatch: " + error)
+        if len(stats["errors"]) == 0:
+            print("* every finished run was saved with the expected track, car and time")
+
+
+def read_trace(path):
+    for created, name, values in TraceFileHandler.read(path):
+        timestamp = datetime.datetime.fromtimestamp(created).isoformat(sep=" ", timespec="milliseconds")
+        print(f"{timestamp} {name} " + " ".join(f"{field}={value:.3f}" for field, value in values.items()))
+
+
+def reprocess(args):
+    start_time = time.perf_counter()
+    action = "would be" if args.reprocess_dry_run else "were"
+
+    if args.reprocess == "telemetry":
+        counters = RunReprocessor.fix_times_from_telemetry(args.reprocess_dry_run)
+        print(f"* {counters['fixed']} of {counters['runs']} runs with a 0 time {action} fixed from their telemetry, in {time.perf_counter() - start_time:.1f} s")
+        return
+
+    def progress(counters):
+        rate = counters["packets"] / max(time.perf_counter() - start_time, 0.001)
+        print(f"* read {counters['captures']} captures, {counters['packets']} packets ({rate:.0f} packets/s), found {counters['runs']} runs")
+
+    counters = RunReprocessor.reprocess(args.reprocess, args.reprocess_tag, args.reprocess_dry_run, progress)
+    print(
+        f"* reprocessing finished in {time.perf_counter() - start_time:.1f} s, {counters['finished']} finished runs:"
+        f" {counters['inserted']} {action} saved, {counters['fixed']} {action} fixed, {counters['unchanged']} unchanged"
+    )
+
+
 if __name__ == "__main__":
     main()